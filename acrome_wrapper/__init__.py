@@ -1,3 +1,16 @@
 from .system import *
 from .master import *
 from .module import *
+from .group import *
+from .worker import *
+from .cache import *
+from .simulation import *
+from .background import *
+from .scheduler import *
+from .telemetry import *
+from .replay import *
+from .instrument import *
+from .tuning import *
+from .trajectory import *
+from .sampling import *
+from .streaming import *
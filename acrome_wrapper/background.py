@@ -0,0 +1,81 @@
+'''Lifecycle of work done on background threads
+
+'''
+
+from abc import ABC, abstractmethod
+
+
+__all__ = [
+  'BackgroundTask',
+]
+
+
+class BackgroundTask(ABC):
+  '''Base of objects doing a finite piece of work on
+  background threads.
+
+  Subclasses start their threads in _start_threads(), wait
+  until the work is done (or stopped) in
+  _wait_threads(timeout) and join them, re-raising their
+  errors, in _stop_threads(). is_running is True while the
+  threads work. A subclass missing any of them can not be
+  instantiated.
+
+  '''
+
+  @property
+  @abstractmethod
+  def is_running(self) -> bool:
+    '''Returns True from start() until the threads are
+    stopped'''
+
+  @abstractmethod
+  def _start_threads(self, *args, **kwargs):
+    '''Starts the threads'''
+
+  @abstractmethod
+  def _wait_threads(self, timeout:float) -> bool:
+    '''Waits until the work is done or stopped. Returns False
+    if the timeout expired'''
+
+  @abstractmethod
+  def _stop_threads(self):
+    '''Stops and joins the threads, re-raising their error'''
+
+  def start(self, *args, **kwargs):
+    '''Starts the work on background threads'''
+    if self.is_running:
+      return
+    self._start_threads(*args, **kwargs)
+
+  def wait(self, timeout:float=None) -> bool:
+    '''Waits until the work is done (or stopped) and stops
+    the threads
+
+    Parameters:
+    timeout: (optional) maximum wait in seconds
+
+    Returns:
+    False if the timeout expired
+    '''
+    if not self.is_running:
+      return True
+    if not self._wait_threads(timeout):
+      return False
+    self.stop()
+    return True
+
+  def stop(self):
+    '''Stops the work and joins the threads, re-raising the
+    error of a failed thread'''
+    self._stop_threads()
+
+  def run(self, *args, **kwargs) -> 'BackgroundTask':
+    '''Starts the work (see start()) and returns when it is
+    done'''
+    self.start(*args, **kwargs)
+    try:
+      self.wait()
+    finally:
+      self.stop()
+    return self
@@ -0,0 +1,80 @@
+'''Staleness tracking for module states
+
+'''
+
+from time import monotonic
+from .defaults import *
+
+
+__all__ = [
+  'StateCache',
+]
+
+
+class StateCache:
+  '''Tracks how fresh the internally stored states of a
+  module are.
+
+  Each state attribute has a time-to-live (TTL) in
+  seconds. A state stored (touched) less than TTL seconds
+  ago is fresh and can be served without a bus read. A TTL
+  of zero disables caching of the attribute and a TTL of
+  None keeps the state fresh until it is invalidated.
+
+  Hit and miss counters tell how many reads were saved.
+
+  '''
+
+  def __init__(self, **ttl):
+    '''Initializer for StateCache
+
+    Parameters:
+    ttl: time-to-live in seconds of each attribute. Missing
+         attributes use DEFAULT_STATE_TTL.
+    '''
+    self._ttl = dict(ttl)
+    self._stamps = dict()
+    self.hits = 0
+    self.misses = 0
+
+  def __repr__(self):
+    return 'StateCache: hits={} misses={}'.format(
+      self.hits, self.misses)
+
+  def ttl(self, attr:str) -> float:
+    '''Returns the time-to-live of an attribute'''
+    return self._ttl.get(attr, DEFAULT_STATE_TTL)
+
+  def set_ttl(self, **ttl):
+    '''Sets the time-to-live of the given attributes, e.g.
+    set_ttl(mode=0.5, is_enabled=None)'''
+    self._ttl.update(ttl)
+
+  def is_fresh(self, attr:str) -> bool:
+    '''Returns True if the stored state of the attribute can
+    be used without a bus read and counts a hit or a miss'''
+    stamp = self._stamps.get(attr)
+    ttl = self.ttl(attr)
+    if stamp is not None and (
+        ttl is None or monotonic() - stamp < ttl):
+      self.hits += 1
+      return True
+    self.misses += 1
+    return False
+
+  def touch(self, attr:str):
+    '''Marks the stored state of the attribute as just
+    updated'''
+    self._stamps[attr] = monotonic()
+
+  def invalidate(self, attr:str=None):
+    '''Marks the given attribute (or all attributes) stale'''
+    if attr is None:
+      self._stamps.clear()
+    else:
+      self._stamps.pop(attr, None)
+
+  def reset_stats(self):
+    '''Resets the hit and miss counters'''
+    self.hits = 0
+    self.misses = 0
@@ -1,2 +1,5 @@
 # Default module supply voltage in volts
 DEFAULT_SUPPLY_VOLTAGE = 12.0
+
+# Default time-to-live of cached module states in seconds
+DEFAULT_STATE_TTL = 0.0
@@ -0,0 +1,71 @@
+'''Deferred import of the underlying Acrome API
+
+'''
+
+import importlib
+from typing import Callable
+
+
+__all__ = [
+  'DeferredModule',
+  'red',
+]
+
+
+class DeferredModule:
+  '''Stand-in for a module which is imported on first
+  attribute access.
+
+  Once the module is imported its attributes are copied
+  into the stand-in, so later accesses are plain attribute
+  lookups without any indirection. Callbacks registered with
+  on_load() complete tables depending on the module.
+
+  '''
+
+  def __init__(self, name:str):
+    '''Initializer for DeferredModule
+
+    Parameters:
+    name: absolute name of the module
+    '''
+    self._name = name
+    self._module = None
+    self._callbacks = list()
+
+  def __repr__(self):
+    return '<deferred module {!r}{}>'.format(
+      self._name, '' if self._module is None else ' (loaded)')
+
+  @property
+  def is_loaded(self) -> bool:
+    return self._module is not None
+
+  def load(self):
+    '''Imports the module unless it is imported and runs the
+    registered callbacks'''
+    if self._module is None:
+      module = importlib.import_module(self._name)
+      self.__dict__.update(
+        (name, value) for name, value in vars(module).items()
+        if not name.startswith('__') and name not in self.__dict__)
+      self._module = module
+      for callback in self._callbacks:
+        callback(module)
+    return self._module
+
+  def on_load(self, callback:Callable):
+    '''Registers a callable(module) to run once the module
+    is imported (right away if it already is)'''
+    self._callbacks.append(callback)
+    if self._module is not None:
+      callback(self._module)
+
+  def __getattr__(self, name:str):
+    if name.startswith('__') or self._module is not None:
+      raise AttributeError(name)
+    return getattr(self.load(), name)
+
+
+# Acrome SMD protocol implementation (smd.red)
+red = DeferredModule('smd.red')
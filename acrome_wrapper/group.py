@@ -0,0 +1,489 @@
+'''Module groups for bulk operations
+
+'''
+
+import asyncio
+import sys
+from time import monotonic
+from typing import List, Sequence, Iterable
+from .deferred import red
+from .module import Module, Motor
+from . import telemetry
+
+
+__all__ = [
+  'Snapshot',
+  'ModuleGroup',
+  'MotorGroup',
+]
+
+
+# Synchronized set point writes of each control mode:
+# (motor method clamping a value, motor attribute storing
+# the set point, master write method and its (SMD ID, value)
+# pairs argument, written value per set point unit, motor
+# attribute scaling the clamped value into the stored set
+# point, recorded quantity, red.Index name of the written
+# variable). Quantities without a variable are recorded as
+# stored, the others as written.
+SET_POINTS = {
+  Motor.Mode.VOLTAGE_CONTROL: (
+    '_duty_cycle', '_voltage', 'set_duty_cycles', 'id_pct_pairs',
+    100.0, '_supply_voltage', 'voltage', None),
+  Motor.Mode.VELOCITY_CONTROL: (
+    '_clamp_velocity', '_velocity', 'set_velocities', 'id_sp_pairs',
+    1.0, None, 'velocity_set_point', 'SetVelocity'),
+  Motor.Mode.POSITION_CONTROL: (
+    '_clamp_position', '_position', 'set_positions', 'id_sp_pairs',
+    1.0, None, 'position_set_point', 'SetPosition'),
+  Motor.Mode.TORQUE_CONTROL: (
+    '_clamp_torque', '_torque', 'set_torques', 'id_sp_pairs',
+    1.0, None, 'torque_set_point', 'SetTorque'),
+}
+
+
+class Snapshot(dict):
+  '''Result of a batched read. Maps each module to a
+  dictionary of quantity names and values. Values of failed
+  transactions are None.
+
+  Attributes:
+  timestamp: monotonic clock time at the start of the read
+  '''
+
+  def __init__(self, timestamp:float):
+    super().__init__()
+    self.timestamp = timestamp
+
+  def values_of(self, quantity:str) -> list:
+    '''Returns the values of a quantity for all modules
+    having it in module order'''
+    return [
+      values[quantity] for values in self.values()
+      if quantity in values]
+
+
+class ModuleGroup:
+  '''An ordered collection of modules accessed together.
+
+  Group reads fetch the requested quantities of all modules
+  attached to the same SMD in as few get_variables
+  transactions as the package size permits.
+
+  '''
+
+  def __init__(self, modules:Sequence[Module]):
+    '''Initializer for ModuleGroup
+
+    Parameters:
+    modules: modules in the group. The order of the modules
+             is the order of value vectors.
+    '''
+    self._modules = list(dict.fromkeys(modules))
+
+  @staticmethod
+  def find(*args, **kwargs) -> 'ModuleGroup':
+    '''Returns a group of the modules satisfying conditions
+
+    Parameters:
+    see Module.find()
+    '''
+    return ModuleGroup(Module.find(*args, **kwargs))
+
+  def __len__(self):
+    return len(self._modules)
+
+  def __iter__(self):
+    return iter(self._modules)
+
+  def __getitem__(self, index):
+    return self._modules[index]
+
+  def __repr__(self):
+    return '{}: [{}]'.format(
+      type(self).__name__,
+      ', '.join(str(m) for m in self._modules))
+
+  @property
+  def modules(self) -> List[Module]:
+    return self._modules
+
+  def _by_master(self, values:Sequence) -> dict:
+    '''Groups (module, value) pairs by master'''
+    if len(values) != len(self._modules):
+      raise ValueError(
+        'Expected {} values, got {}'.format(
+          len(self._modules), len(values)))
+    groups = dict()
+    for module, value in zip(self._modules, values):
+      groups.setdefault(module.master, list()).append(
+        (module, value))
+    return groups
+
+  def _split(self) -> dict:
+    '''Splits the group into groups of the same type, one
+    for each master'''
+    groups = dict()
+    for module in self._modules:
+      groups.setdefault(module.master, list()).append(module)
+    return {
+      master: type(self)(modules)
+      for master, modules in groups.items()}
+
+  async def aread(self,
+                  quantities:Iterable[str]=None) -> Snapshot:
+    '''Async counterpart of read(). The modules of different
+    masters are read concurrently.'''
+    if quantities is not None:
+      quantities = list(quantities)
+    groups = self._split()
+    snapshots = await asyncio.gather(*[
+      master.arun(group.read, quantities)
+      for master, group in groups.items()])
+    snapshot = Snapshot(min(
+      [s.timestamp for s in snapshots], default=monotonic()))
+    merged = dict()
+    for partial_snapshot in snapshots:
+      merged.update(partial_snapshot)
+    for module in self._modules:
+      snapshot[module] = merged[module]
+    return snapshot
+
+  def read(self, quantities:Iterable[str]=None) -> Snapshot:
+    '''Reads the quantities of all modules in the group with
+    one transaction per SMD (more only if the requested
+    variables do not fit into a single package).
+
+    Motor modules provide 'enabled', 'mode', 'velocity',
+    'position' and 'current', the sensor modules the
+    quantities of their _read_indexes() (e.g. 'distance' of
+    Distance, 'roll' and 'pitch' of IMU modules). Stored
+    motor states are updated with the values read.
+
+    Parameters:
+    quantities: (optional) names of the quantities to read.
+                By default all quantities are read.
+
+    Returns:
+    Snapshot of the values read
+    '''
+    if quantities is not None:
+      quantities = set(quantities)
+    requests = dict()
+    for module in self._modules:
+      for quantity, index in module._read_indexes().items():
+        if quantities is None or quantity in quantities:
+          requests.setdefault(
+            (module.master, module._smd_id), list()).append(
+              (module, quantity, index))
+    snapshot = Snapshot(monotonic())
+    for module in self._modules:
+      snapshot[module] = dict()
+    recorder = telemetry.RECORDER
+    for (master, smd_id), items in requests.items():
+      index_list = list(dict.fromkeys(item[2] for item in items))
+      values = dict(zip(index_list, master.fetch(
+        'read_variables', smd_id=smd_id, index_list=index_list)))
+      for module, quantity, index in items:
+        value = values[index]
+        snapshot[module][quantity] = \
+          None if value is None else module._decode(quantity, value)
+        if recorder is not None:
+          module._record(
+            recorder, quantity, index, value, snapshot[module][quantity])
+    return snapshot
+
+
+class MotorGroup(ModuleGroup):
+  '''An ordered collection of Motor modules commanded
+  together.
+
+  Group commands apply the same per-motor checks, clamping
+  and polarity logic as the individual Motor methods but
+  send the set points of all motors on a master in a single
+  synchronized write frame.
+
+  '''
+
+  def __init__(self, motors:Sequence[Motor]):
+    '''Initializer for MotorGroup
+
+    Parameters:
+    motors: motor modules in the group. The order of the
+            motors is the order of the set point vectors.
+    '''
+    super().__init__(motors)
+    self._arrays = None
+
+  @staticmethod
+  def find(*args, **kwargs) -> 'MotorGroup':
+    '''Returns a group of the motors satisfying conditions
+
+    Parameters:
+    see Motor.find()
+    '''
+    return MotorGroup(Motor.find(*args, **kwargs))
+
+  @property
+  def motors(self) -> List[Motor]:
+    return self._modules
+
+  def enable(self):
+    '''Enables all motor drivers in the group'''
+    for master, pairs in self._by_master(
+        [True] * len(self._modules)).items():
+      id_en_pairs = [(m._smd_id, en) for m, en in pairs]
+      master.post(
+        None, 'enable_torques', id_en_pairs=id_en_pairs)
+    recorder = telemetry.RECORDER
+    for motor in self._modules:
+      motor._is_enabled = True
+      motor.cache.touch('is_enabled')
+      if recorder is not None:
+        recorder.record(
+          motor, 'enabled', red.Index.TorqueEnable, 1.0)
+
+  def disable(self):
+    '''Disables all motor drivers in the group'''
+    for master, pairs in self._by_master(
+        [False] * len(self._modules)).items():
+      id_en_pairs = [(m._smd_id, en) for m, en in pairs]
+      master.post(
+        None, 'enable_torques', id_en_pairs=id_en_pairs)
+    recorder = telemetry.RECORDER
+    for motor in self._modules:
+      motor._is_enabled = False
+      motor.cache.touch('is_enabled')
+      if recorder is not None:
+        recorder.record(
+          motor, 'enabled', red.Index.TorqueEnable, 0.0)
+
+  def set_voltages(self,
+                   voltages:Sequence[float],
+                   forced:bool=False) -> List[float]:
+    '''Sets the terminal voltages of all motors in the group.
+    All motors must be in VOLTAGE_CONTROL mode and enabled
+    (see Motor.set_voltage()). The checks are done for all
+    motors before anything is written.
+
+    A NumPy array of voltages is processed in vectorized
+    form and the actual voltages are returned as an array.
+
+    Args:
+      voltages: voltages in volts in group order
+      forced: (bool) If True ignore drive enable states
+    Return:
+      Actual voltages generated (after clamping)
+    '''
+    numpy = sys.modules.get('numpy')
+    if numpy is not None and isinstance(voltages, numpy.ndarray):
+      return self._set_voltage_array(numpy, voltages, forced)
+    return self._set_points(voltages, Motor.Mode.VOLTAGE_CONTROL, forced)
+
+  def _parameter_arrays(self, numpy) -> tuple:
+    '''Returns the supply voltage and polarity arrays of the
+    motors and the group positions and SMD IDs of the motors
+    of each master. The arrays are rebuilt only after motor
+    parameters change.'''
+    if self._arrays is None or self._arrays[0] != Motor._revision:
+      supply = numpy.array(
+        [m._supply_voltage for m in self._modules], dtype=float)
+      polarity = numpy.array(
+        [m._polarity.value for m in self._modules], dtype=float)
+      positions = dict()
+      for n, motor in enumerate(self._modules):
+        positions.setdefault(motor.master, list()).append(n)
+      masters = [
+        (master, numpy.array(ns, dtype=numpy.intp),
+         [self._modules[n]._smd_id for n in ns])
+        for master, ns in positions.items()]
+      self._arrays = (Motor._revision, supply, polarity, masters)
+    return self._arrays[1:]
+
+  def _set_voltage_array(self, numpy, voltages, forced:bool):
+    '''Vectorized set_voltages() for NumPy arrays'''
+    if voltages.shape != (len(self._modules),):
+      raise ValueError(
+        'Expected {} values, got array of shape {}'.format(
+          len(self._modules), voltages.shape))
+    for motor in self._modules:
+      motor._check_command(Motor.Mode.VOLTAGE_CONTROL, forced)
+    supply, polarity, masters = self._parameter_arrays(numpy)
+    duty_cycles = numpy.clip(voltages / supply, -1.0, 1.0)
+    percentages = polarity * duty_cycles * 100.0
+    for master, positions, smd_ids in masters:
+      id_pct_pairs = list(zip(
+        smd_ids, percentages[positions].tolist()))
+      master.post(
+        ('set_duty_cycles', tuple(smd_ids)),
+        'set_duty_cycles', id_pct_pairs=id_pct_pairs)
+    actual = duty_cycles * supply
+    recorder = telemetry.RECORDER
+    for motor, voltage in zip(self._modules, actual.tolist()):
+      motor._voltage = voltage
+      if recorder is not None:
+        recorder.record(motor, 'voltage', None, voltage)
+    return actual
+
+  async def aset_voltages(self,
+                          voltages:Sequence[float],
+                          forced:bool=False) -> List[float]:
+    '''Async counterpart of set_voltages(). The set points of
+    different masters are written concurrently.'''
+    return await self._aset_points(
+      voltages, Motor.Mode.VOLTAGE_CONTROL, forced)
+
+  def get_voltages(self) -> List[float]:
+    '''Returns the currently applied terminal voltages'''
+    return [motor.get_voltage() for motor in self._modules]
+
+  def _set_points(self, values:Sequence[float], mode:'Motor.Mode',
+                  forced:bool) -> List[float]:
+    '''Checks the modes of all motors, clamps the set points,
+    writes them with one synchronized frame per master and
+    stores them in the motors (see SET_POINTS)'''
+    clamp, attr, method, argument, scale, unit, quantity, index = \
+      SET_POINTS[mode]
+    index = None if index is None else getattr(red.Index, index)
+    groups = self._by_master(values)
+    for motor in self._modules:
+      motor._check_command(mode, forced)
+    recorder = telemetry.RECORDER
+    for master, pairs in groups.items():
+      set_points = [
+        getattr(motor, clamp)(value) for motor, value in pairs]
+      id_sp_pairs = [
+        (motor._smd_id, motor._polarity.value * set_point * scale)
+        for (motor, _), set_point in zip(pairs, set_points)]
+      master.post(
+        (method, tuple(p[0] for p in id_sp_pairs)),
+        method, **{argument: id_sp_pairs})
+      for (motor, _), set_point, (_, value) in zip(
+          pairs, set_points, id_sp_pairs):
+        if unit is not None:
+          set_point *= getattr(motor, unit)
+        setattr(motor, attr, set_point)
+        if recorder is not None:
+          recorder.record(
+            motor, quantity, index,
+            set_point if index is None else value)
+    return [getattr(motor, attr) for motor in self._modules]
+
+  async def _aset_points(self, values:Sequence[float],
+                         mode:'Motor.Mode',
+                         forced:bool) -> List[float]:
+    '''Async counterpart of _set_points(). The set points of
+    different masters are written concurrently.'''
+    groups = self._by_master(values)
+    for motor in self._modules:
+      motor._check_command(mode, forced)
+    await asyncio.gather(*[
+      master.arun(
+        MotorGroup([m for m, _ in pairs])._set_points,
+        [v for _, v in pairs], mode, forced)
+      for master, pairs in groups.items()])
+    attr = SET_POINTS[mode][1]
+    return [getattr(motor, attr) for motor in self._modules]
+
+  def set_velocities(self,
+                     velocities:Sequence[float],
+                     forced:bool=False) -> List[float]:
+    '''Sets the velocity set points of all motors in the
+    group. All motors must be in VELOCITY_CONTROL mode and
+    enabled (see Motor.set_velocity()). The checks are done
+    for all motors before anything is written.
+
+    Args:
+      velocities: velocities in RPM in group order
+      forced: (bool) If True ignore drive enable states
+    Return:
+      Velocity set points (after clamping)
+    '''
+    return self._set_points(
+      velocities, Motor.Mode.VELOCITY_CONTROL, forced)
+
+  async def aset_velocities(self,
+                            velocities:Sequence[float],
+                            forced:bool=False) -> List[float]:
+    '''Async counterpart of set_velocities(). The set points
+    of different masters are written concurrently.'''
+    return await self._aset_points(
+      velocities, Motor.Mode.VELOCITY_CONTROL, forced)
+
+  def get_velocities(self) -> List[float]:
+    '''Returns the measured velocities of all motors in RPM
+    with one transaction per SMD (None for failed reads)'''
+    return self.read(['velocity']).values_of('velocity')
+
+  async def aget_velocities(self) -> List[float]:
+    '''Async counterpart of get_velocities()'''
+    return (await self.aread(['velocity'])).values_of('velocity')
+
+  def set_positions(self,
+                    positions:Sequence[float],
+                    forced:bool=False) -> List[float]:
+    '''Sets the position set points of all motors in the
+    group. All motors must be in POSITION_CONTROL mode and
+    enabled (see Motor.set_position()). The checks are done
+    for all motors before anything is written.
+
+    Args:
+      positions: positions in encoder counts in group order
+      forced: (bool) If True ignore drive enable states
+    Return:
+      Position set points (after clamping)
+    '''
+    return self._set_points(
+      positions, Motor.Mode.POSITION_CONTROL, forced)
+
+  async def aset_positions(self,
+                           positions:Sequence[float],
+                           forced:bool=False) -> List[float]:
+    '''Async counterpart of set_positions(). The set points
+    of different masters are written concurrently.'''
+    return await self._aset_points(
+      positions, Motor.Mode.POSITION_CONTROL, forced)
+
+  def get_positions(self) -> List[float]:
+    '''Returns the measured positions of all motors in
+    encoder counts with one transaction per SMD (None for
+    failed reads)'''
+    return self.read(['position']).values_of('position')
+
+  async def aget_positions(self) -> List[float]:
+    '''Async counterpart of get_positions()'''
+    return (await self.aread(['position'])).values_of('position')
+
+  def set_torques(self,
+                  torques:Sequence[float],
+                  forced:bool=False) -> List[float]:
+    '''Sets the current set points of all motors in the
+    group. All motors must be in TORQUE_CONTROL mode and
+    enabled (see Motor.set_torque()). The checks are done for
+    all motors before anything is written.
+
+    Args:
+      torques: motor currents in mA in group order
+      forced: (bool) If True ignore drive enable states
+    Return:
+      Current set points (after clamping)
+    '''
+    return self._set_points(
+      torques, Motor.Mode.TORQUE_CONTROL, forced)
+
+  async def aset_torques(self,
+                         torques:Sequence[float],
+                         forced:bool=False) -> List[float]:
+    '''Async counterpart of set_torques(). The set points of
+    different masters are written concurrently.'''
+    return await self._aset_points(
+      torques, Motor.Mode.TORQUE_CONTROL, forced)
+
+  def get_currents(self) -> List[float]:
+    '''Returns the measured currents of all motors in mA with
+    one transaction per SMD (None for failed reads)'''
+    return self.read(['current']).values_of('current')
+
+  async def aget_currents(self) -> List[float]:
+    '''Async counterpart of get_currents()'''
+    return (await self.aread(['current'])).values_of('current')
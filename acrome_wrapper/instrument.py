@@ -0,0 +1,286 @@
+'''Instrumentation of master calls
+
+'''
+
+import threading
+from bisect import bisect_left
+from functools import wraps
+from time import perf_counter
+from typing import List, Union
+from .master import Master, MASTERS, FRAME_OVERHEAD, VARIABLE_SIZES
+
+
+__all__ = [
+  'CallStats',
+  'instrument',
+  'uninstrument',
+  'is_instrumented',
+  'metrics',
+  'reset_metrics',
+  'prometheus_metrics',
+]
+
+
+# Master calls wrapped by default. Bus primitives account
+# the bytes of their frames, higher level calls only their
+# latency.
+INSTRUMENTED_CALLS = [
+  'get_variables',
+  'set_variables',
+  'set_variables_sync',
+  'ping',
+  'scan',
+  'scan_modules',
+  'reboot',
+  'eeprom_write',
+  'read_variables',
+  'set_duty_cycle',
+  'set_duty_cycles',
+  'set_velocity',
+  'set_velocities',
+  'get_velocity',
+  'set_position',
+  'set_positions',
+  'get_position',
+  'set_torque',
+  'set_torques',
+  'get_torque',
+  'enable_torque',
+  'enable_torques',
+  'set_operation_mode',
+  'get_operation_mode',
+  'get_distance',
+  'set_buzzer',
+  'set_servo',
+  'set_rgb',
+]
+
+# Upper bounds of the latency histogram buckets in seconds
+LATENCY_BUCKETS = [
+  0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+  0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+]
+
+# Call statistics by (master name, smd_id, call)
+STATS = dict()
+
+_lock = threading.Lock()
+
+
+def _bytes(call:str, args:tuple, kwargs:dict, result) -> tuple:
+  '''Returns the (written, read) frame sizes of a bus
+  primitive call in bytes'''
+  def arg(position, name, default=None):
+    if len(args) > position:
+      return args[position]
+    return kwargs.get(name, default)
+  if call == 'get_variables':
+    index_list = arg(1, 'index_list')
+    return (
+      FRAME_OVERHEAD + len(index_list),
+      0 if result is None else FRAME_OVERHEAD + sum(
+        VARIABLE_SIZES[index] for index in index_list))
+  if call == 'set_variables':
+    size = FRAME_OVERHEAD + sum(
+      VARIABLE_SIZES[index] for index, _ in arg(1, 'idx_val_pairs'))
+    return size, size if result is not None else 0
+  if call == 'set_variables_sync':
+    return FRAME_OVERHEAD + 1 + len(arg(1, 'id_val_pairs')) * \
+      VARIABLE_SIZES[arg(0, 'index')], 0
+  if call == 'ping':
+    return FRAME_OVERHEAD, FRAME_OVERHEAD if result else 0
+  if call in ('reboot', 'eeprom_write'):
+    return FRAME_OVERHEAD, 0
+  return 0, 0
+
+
+class CallStats:
+  '''Counters and latency histogram of a call type of an
+  SMD (or of a master for calls without an SMD)'''
+
+  def __init__(self):
+    self.count = 0
+    self.timeouts = 0
+    self.errors = 0
+    self.total_time = 0.0
+    self.max_time = 0.0
+    self.bytes_written = 0
+    self.bytes_read = 0
+    self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+  def __repr__(self):
+    return ('CallStats: count={} timeouts={} errors={} '
+            'mean={:.1f}us').format(
+              self.count, self.timeouts, self.errors,
+              self.mean_time * 1e6)
+
+  @property
+  def mean_time(self) -> float:
+    return self.total_time / self.count if self.count else 0.0
+
+  def _add(self, elapsed:float, timeout:bool, error:bool,
+           written:int, read:int):
+    self.count += 1
+    self.timeouts += timeout
+    self.errors += error
+    self.total_time += elapsed
+    self.max_time = max(self.max_time, elapsed)
+    self.bytes_written += written
+    self.bytes_read += read
+    self.buckets[bisect_left(LATENCY_BUCKETS, elapsed)] += 1
+
+  def as_dict(self) -> dict:
+    return {
+      'count': self.count,
+      'timeouts': self.timeouts,
+      'errors': self.errors,
+      'total_time': self.total_time,
+      'mean_time': self.mean_time,
+      'max_time': self.max_time,
+      'bytes_written': self.bytes_written,
+      'bytes_read': self.bytes_read,
+      'buckets': dict(zip(
+        [str(b) for b in LATENCY_BUCKETS] + ['+Inf'],
+        self.buckets)),
+    }
+
+
+def _wrap(master:Master, call:str):
+  method = getattr(master, call)
+
+  @wraps(method)
+  def instrumented(*args, **kwargs):
+    smd_id = args[0] if args and call not in (
+      'set_variables_sync', 'set_duty_cycles', 'set_velocities',
+      'set_positions', 'set_torques', 'enable_torques') \
+      else kwargs.get('id', kwargs.get('smd_id'))
+    result, error = None, False
+    start = perf_counter()
+    try:
+      result = method(*args, **kwargs)
+      return result
+    except Exception:
+      error = True
+      raise
+    finally:
+      elapsed = perf_counter() - start
+      timeout = not error and (
+        result is False if call == 'ping' else
+        result is None and call.startswith(('get_', 'read_')))
+      written, read = (0, 0) if error else \
+        _bytes(call, args, kwargs, result)
+      key = (master.name, smd_id, call)
+      with _lock:
+        stats = STATS.get(key)
+        if stats is None:
+          stats = STATS[key] = CallStats()
+        stats._add(elapsed, timeout, error, written, read)
+  return instrumented
+
+
+def _masters(masters) -> List[Master]:
+  if masters is None:
+    return list(MASTERS)
+  if isinstance(masters, Master):
+    return [masters]
+  return list(masters)
+
+
+def instrument(masters:Union[Master, List[Master]]=None,
+               calls:List[str]=INSTRUMENTED_CALLS):
+  '''Starts recording the latency, result and frame sizes of
+  the calls of masters.
+
+  The calls are wrapped on the master instances only, so
+  masters which are not instrumented run the plain calls
+  without any cost.
+
+  Parameters:
+  masters: (optional) master or list of masters, all
+           masters by default
+  calls  : names of the master calls to instrument
+  '''
+  for master in _masters(masters):
+    uninstrument(master)
+    wrapped = list()
+    for call in calls:
+      if hasattr(master, call):
+        setattr(master, call, _wrap(master, call))
+        wrapped.append(call)
+    master._instrumented = wrapped
+
+def uninstrument(masters:Union[Master, List[Master]]=None):
+  '''Stops recording the calls of masters (all by default).
+  Recorded metrics are kept.'''
+  for master in _masters(masters):
+    for call in vars(master).pop('_instrumented', []):
+      delattr(master, call)
+
+def is_instrumented(master:Master) -> bool:
+  '''Returns True if the calls of the master are recorded'''
+  return '_instrumented' in vars(master)
+
+
+def metrics() -> dict:
+  '''Returns a snapshot of the recorded call statistics as
+  nested dictionaries: master name -> smd_id -> call ->
+  statistics. Calls without an SMD have the smd_id None.'''
+  snapshot = dict()
+  with _lock:
+    for (master, smd_id, call), stats in STATS.items():
+      snapshot.setdefault(master, dict()).setdefault(
+        smd_id, dict())[call] = stats.as_dict()
+  return snapshot
+
+def reset_metrics():
+  '''Discards the recorded call statistics'''
+  with _lock:
+    STATS.clear()
+
+
+def prometheus_metrics() -> str:
+  '''Returns the recorded call statistics in Prometheus text
+  exposition format'''
+  with _lock:
+    items = sorted(
+      STATS.items(), key=lambda item: (
+        item[0][0], -1 if item[0][1] is None else item[0][1],
+        item[0][2]))
+    lines = [
+      '# HELP acrome_call_duration_seconds Duration of master calls',
+      '# TYPE acrome_call_duration_seconds histogram']
+    for key, stats in items:
+      labels = _labels(key)
+      cumulative = 0
+      for bound, count in zip(
+          [repr(b) for b in LATENCY_BUCKETS] + ['+Inf'],
+          stats.buckets):
+        cumulative += count
+        lines.append(
+          'acrome_call_duration_seconds_bucket{{{},le="{}"}} {}'.format(
+            labels, bound, cumulative))
+      lines.append('acrome_call_duration_seconds_sum{{{}}} {!r}'.format(
+        labels, stats.total_time))
+      lines.append('acrome_call_duration_seconds_count{{{}}} {}'.format(
+        labels, stats.count))
+    for name, attr, text in [
+        ('acrome_call_timeouts_total', 'timeouts',
+         'Calls without a response'),
+        ('acrome_call_errors_total', 'errors',
+         'Calls raising an exception'),
+        ('acrome_bytes_written_total', 'bytes_written',
+         'Bytes written to the bus'),
+        ('acrome_bytes_read_total', 'bytes_read',
+         'Bytes read from the bus')]:
+      lines.append('# HELP {} {}'.format(name, text))
+      lines.append('# TYPE {} counter'.format(name))
+      for key, stats in items:
+        lines.append('{}{{{}}} {}'.format(
+          name, _labels(key), getattr(stats, attr)))
+  return '\n'.join(lines) + '\n'
+
+def _labels(key:tuple) -> str:
+  master, smd_id, call = key
+  master = str(master).replace('\\', '\\\\').replace('"', '\\"')
+  return 'master="{}",smd_id="{}",call="{}"'.format(
+    master, '' if smd_id is None else smd_id, call)
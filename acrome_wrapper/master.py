@@ -2,10 +2,17 @@
 
 '''
 
-from typing import Union, List, Dict
+import asyncio
+import atexit
+import threading
+import warnings
+from typing import Union, List, Dict, Callable
 from pathlib import Path
-from smd import red
-from .module import Module
+from functools import partial, wraps
+from concurrent.futures import ThreadPoolExecutor
+from .deferred import red
+from .module import Module, UnknownModuleKind
+from .worker import MasterWorker
 
 
 __all__ = [
@@ -19,9 +26,64 @@ __all__ = [
 # Default serial baud rate in Hz
 BAUDRATE = 112500 
 
+# Size of frame header and CRC in bytes
+FRAME_OVERHEAD = 10
+
+# Largest variable payload of a single read response in
+# bytes (package size is a single byte, less header and CRC)
+READ_PAYLOAD_LIMIT = 255 - FRAME_OVERHEAD
+
+# Payload sizes of SMD variables (index byte included),
+# filled when smd.red is loaded
+VARIABLE_SIZES = list()
+
 # List of all communication masters in the system
 MASTERS = list() 
 
+# Registered masters indexed by name and by device path
+MASTER_NAMES = dict()
+MASTER_PATHS = dict()
+
+# Master classes by device path scheme (e.g. replay:session.acrl)
+MASTER_SCHEMES = dict()
+
+# Serial read timeout in seconds (as used by red.Master)
+PORT_TIMEOUT = 0.1
+
+
+class _TransactionLock:
+  '''Reentrant lock serializing the bus transactions of a
+  master, which tells whether the calling thread holds it'''
+
+  def __init__(self):
+    self._lock = threading.RLock()
+    self._owner = None
+    self._depth = 0
+
+  def acquire(self, blocking:bool=True, timeout:float=-1) -> bool:
+    if not self._lock.acquire(blocking, timeout):
+      return False
+    self._owner = threading.get_ident()
+    self._depth += 1
+    return True
+
+  def release(self):
+    self._depth -= 1
+    if not self._depth:
+      self._owner = None
+    self._lock.release()
+
+  def __enter__(self):
+    return self.acquire()
+
+  def __exit__(self, *exc_info):
+    self.release()
+
+  @property
+  def is_held(self) -> bool:
+    '''Returns True if the calling thread holds the lock'''
+    return self._owner == threading.get_ident()
+
 
 class NonUniqueMasterName(Exception):
 
@@ -41,55 +103,255 @@ class NoMasterSetup(Exception):
     super().__init__("No master has been set up")
 
   
-class Master(red.Master):
-  '''A customized implementation of red.Master'''
+class PortPool:
+  '''Open serial ports shared by device path.
+
+  Ports stay open when their masters are cleared and are
+  reused by new masters bound to the same device path. They
+  are closed explicitly with close() or close_unused(), and
+  all of them at interpreter exit. Ports of different device
+  paths are opened concurrently.
+
+  '''
+
+  def __init__(self):
+    self._ports = dict()
+    self._lock = threading.Lock()
+    self._path_locks = dict()
+
+  def __len__(self):
+    return len(self._ports)
+
+  def __contains__(self, device_path:str):
+    return device_path in self._ports
+
+  def acquire(self, device_path:str,
+              baudrate:int) -> 'serial.Serial':
+    '''Returns the open port of the device path, opening it
+    unless it is open. A reused port is set to the baud rate
+    and its buffers are flushed.'''
+    import serial
+    with self._lock:
+      path_lock = self._path_locks.setdefault(
+        device_path, threading.Lock())
+    # Only callers of the same device path wait for the open
+    with path_lock:
+      with self._lock:
+        port = self._ports.get(device_path)
+      if port is None or not port.is_open:
+        port = serial.serial_for_url(
+          device_path, baudrate=baudrate, timeout=PORT_TIMEOUT)
+        with self._lock:
+          self._ports[device_path] = port
+      else:
+        if port.baudrate != baudrate:
+          port.baudrate = baudrate
+        port.reset_input_buffer()
+        port.reset_output_buffer()
+      return port
+
+  def close(self, device_path:str=None):
+    '''Closes the port of the device path (all ports by
+    default) and removes it from the pool'''
+    with self._lock:
+      device_paths = list(self._ports) if device_path is None \
+        else [device_path]
+      for device_path in device_paths:
+        port = self._ports.pop(device_path, None)
+        if port is not None:
+          port.close()
+
+  def close_unused(self, used:set):
+    '''Closes the ports which are not in the given set'''
+    with self._lock:
+      for device_path, port in list(self._ports.items()):
+        if port not in used:
+          port.close()
+          del self._ports[device_path]
+
+
+# Open serial ports of the masters
+PORTS = PortPool()
+atexit.register(PORTS.close)
+
+
+class _RedMaster:
+  '''Placeholder base of Master until smd.red is loaded, when
+  it is replaced with red.Master (see _bind_red)'''
+
+
+class Master(_RedMaster):
+  '''A customized implementation of red.Master.
+
+  The smd package is only imported when the first master is
+  created. Master then becomes a subclass of red.Master
+  (and so do its own subclasses), with the calls customized
+  here overriding the ones of red.Master.
+
+  Every red.Master call holds the transaction lock of the
+  master while it runs, so the write and the response read
+  of a transaction are not interleaved with those of another
+  thread (e.g. a scheduler loop and the caller thread). The
+  lock is reentrant and can be held to run several calls as
+  one transaction:
+
+  with master.transaction:
+    ...
+
+  '''
+
+  _name = None
+  _device_path = None
+  _worker = None
+  _executor = None
+  _port = None
 
   def __init__(self,
                device_path:str,
                baudrate:int=BAUDRATE,
-               name:str=None):
+               name:str=None,
+               lazy:bool=False):
     '''Initializer for Master
 
     Parameters:
     device_path: path to the serial device
     baudrate: serial baud rate in Hz
     name: (optional) Unique name for Master
+    lazy: if True the serial port is opened on first I/O
+          instead of here
 
     Raises:
     NonUniqueMasterName: if there is a master with the same
     name exists
 
     '''
+    self._transaction_lock = _TransactionLock()
     self.device_path = device_path
     self.name = name or Path(device_path).name
-    super().__init__(
-      portname=device_path, baudrate=baudrate)
+    self._topology = dict()
+    self._open(baudrate)
+    if not lazy:
+      self.open()
     MASTERS.append(self)
+    MASTER_NAMES[self._name] = self
+    MASTER_PATHS[self._device_path] = self
+
+  def _open(self, baudrate:int):
+    '''Sets up the protocol state of red.Master without
+    touching the serial port. Child classes not backed by a
+    serial device override it.'''
+    if baudrate > 12500000 or baudrate < 3053:
+      raise ValueError(
+        'Baudrate must be between 3.053 KBits/s and 12.5 MBits/s.')
+    self._Master__attached_drivers = []
+    self._Master__driver_list = [red.Red(255)] * 256
+    self._Master__baudrate = baudrate
+    self._Master__post_sleep = (10 / baudrate) * 12
+
+  def __del__(self):
+    # Serial ports are shared through PORTS and outlive
+    # their masters (see close() and close_ports())
+    pass
+
+  @property
+  def transaction(self) -> _TransactionLock:
+    '''Returns the transaction lock of the master. While a
+    thread holds it, its bus calls run on that thread even
+    if an I/O worker runs.'''
+    return self._transaction_lock
+
+  @property
+  def is_open(self) -> bool:
+    '''Returns True if the serial port is open'''
+    return self._port is not None
+
+  def open(self):
+    '''Opens the serial port of the master unless it is open.
+    An open port of an earlier master with the same device
+    path is reused.'''
+    if self._port is not None:
+      return
+    self._port = PORTS.acquire(
+      self._device_path, self._Master__baudrate)
+
+  def close(self):
+    '''Closes the serial port of the master unless another
+    registered master uses it. The port is opened again on
+    the next I/O.'''
+    port, self._port = self._port, None
+    if port is not None and all(m._port is not port for m in MASTERS):
+      PORTS.close(self._device_path)
+
+  def _port_handle(self) -> 'serial.Serial':
+    self.open()
+    return self._port
+
+  def _set_port_handle(self, port:'serial.Serial'):
+    self._port = port
+
+  # red.Master accesses its serial port through the private
+  # __ph attribute, which opens the port on first use
+  _Master__ph = property(_port_handle, _set_port_handle)
+
+  @staticmethod
+  def open_all(masters:List['Master']=None):
+    '''Opens the serial ports of masters (all by default)
+    concurrently
+
+    Raises:
+    the first error raised while opening a port
+    '''
+    masters = [
+      m for m in (MASTERS if masters is None else masters)
+      if not m.is_open]
+    if len(masters) > 1:
+      with ThreadPoolExecutor(max_workers=len(masters)) as executor:
+        for future in [executor.submit(m.open) for m in masters]:
+          future.result()
+    else:
+      for master in masters:
+        master.open()
+
+  @staticmethod
+  def close_ports():
+    '''Closes the serial ports which are not used by any
+    registered master'''
+    PORTS.close_unused({m._port for m in MASTERS})
 
   @property
   def name(self):
     return self._name
   @name.setter
   def name(self, value):
-    if value in map(lambda m: m.name, MASTERS):
+    if value in MASTER_NAMES:
       raise NonUniqueMasterName(value)
-    else:
-      self._name = value
+    if MASTER_NAMES.get(self._name) is self:
+      del MASTER_NAMES[self._name]
+      MASTER_NAMES[value] = self
+    self._name = value
 
   @property
   def device_path(self):
     return self._device_path
   @device_path.setter
   def device_path(self, value):
-    if value in map(lambda m: m.device_path, MASTERS):
+    if value in MASTER_PATHS:
       raise DuplicateMasterError(value)
-    else:
-      self._device_path = value
+    if MASTER_PATHS.get(self._device_path) is self:
+      del MASTER_PATHS[self._device_path]
+      MASTER_PATHS[value] = self
+    self._device_path = value
 
   @property
   def baudrate(self) -> int:
     '''Returns the current serial baud rate in Hz'''
     return self._Master__baudrate
+
+  def update_master_baudrate(self, br:int):
+    '''Updates the baud rate of the serial port (see
+    red.Master) and keeps track of it'''
+    super().update_master_baudrate(br)
+    self._Master__baudrate = br
       
   def __str__(self):
     return self.name
@@ -98,15 +360,316 @@ class Master(red.Master):
     return 'Master: {}'.format(self.name)
   
   def discover(self):
-    for smd_id in self.scan():
+    self.populate(self.scan_topology())
+
+  def scan_topology(self) -> Dict[int, List[str]]:
+    '''Scans the bus without touching the module registry
+
+    Returns:
+    dictionary of SMD IDs (in scan order) mapped to the list
+    of module labels reported by each SMD
+    '''
+    self._topology = {
+      smd_id: self.fetch('scan_modules', id=smd_id) or []
+      for smd_id in self.fetch('scan')}
+    return dict(self._topology)
+
+  @property
+  def topology(self) -> Dict[int, List[str]]:
+    '''Returns the SMD IDs found by earlier scans and probes
+    mapped to the module labels they reported (None if their
+    modules are not scanned yet)'''
+    return dict(self._topology)
+
+  def probe(self, smd_id:int, refresh:bool=False) -> bool:
+    '''Checks whether the SMD with the given ID is present
+    on the bus. SMDs already found by an earlier scan or
+    probe are not queried again unless refresh is set. A
+    present SMD is left attached for communication.'''
+    if not refresh and smd_id in self._topology:
+      return True
+    self.attach_id(smd_id)
+    if self.fetch('ping', id=smd_id):
+      self._topology.setdefault(smd_id, None)
+      return True
+    self.detach(smd_id)
+    self._topology.pop(smd_id, None)
+    return False
+
+  def module_labels(self, smd_id:int,
+                    refresh:bool=False) -> List[str]:
+    '''Returns the module labels reported by the SMD with the
+    given ID. The result of an earlier scan is reused unless
+    refresh is set.'''
+    module_labels = self._topology.get(smd_id)
+    if module_labels is None or refresh:
+      module_labels = self.fetch('scan_modules', id=smd_id)
+      if module_labels is None:
+        return []
+      self._topology[smd_id] = module_labels
+    return module_labels
+
+  def populate(self, topology:Dict[int, List[str]]):
+    '''Adds the modules of a scanned topology (see
+    scan_topology()) into the module registry. Modules whose
+    labels no registered module class serves are skipped
+    with a warning.'''
+    for smd_id, module_labels in topology.items():
       Module.add(
         master=self, smd_id=smd_id, kind=Module.Kind.MOTOR)
-      module_labels = self.scan_modules(smd_id) or []
       for module_label in module_labels:
-        kind_name, index = module_label.split('_')
-        kind = Module.Kind.member(kind_name)
+        try:
+          kind, mod_id = Module.parse_label(module_label)
+        except (UnknownModuleKind, ValueError):
+          warnings.warn(
+            'Skipping unsupported module {} of SMD {} on {}'.format(
+              module_label, smd_id, self))
+          continue
         Module.add(master=self, smd_id=smd_id,
-                   kind=kind, mod_id=int(index))
+                   kind=kind, mod_id=mod_id)
+
+  @property
+  def worker(self) -> MasterWorker:
+    '''Returns the running I/O worker or None'''
+    return self._worker
+
+  def start_worker(self, poll_period:float=0.0) -> MasterWorker:
+    '''Starts a dedicated I/O worker thread for the master.
+
+    While the worker runs module writes (set points, enable
+    and mode changes) are queued and superseded set points
+    are dropped, and every other bus call is executed on the
+    worker thread. Reads registered with poll() return the
+    most recently polled values. See worker.MasterWorker.
+
+    Parameters:
+    poll_period: minimum time in seconds between two polls
+                 of the same read
+
+    Returns:
+    the running worker
+    '''
+    if self._worker is None:
+      self._worker = MasterWorker(self, poll_period=poll_period)
+      self._worker.start()
+    return self._worker
+
+  def stop_worker(self):
+    '''Sends the queued writes and stops the I/O worker.
+    Module calls are executed synchronously afterwards.'''
+    if self._worker is not None:
+      worker, self._worker = self._worker, None
+      worker.stop()
+
+  @property
+  def executor(self) -> ThreadPoolExecutor:
+    '''Returns the single thread executor running the async
+    calls of the master. Having one thread per master lets
+    async calls on different masters run concurrently while
+    the calls on the same bus are serialized.'''
+    if self._executor is None:
+      self._executor = ThreadPoolExecutor(
+        max_workers=1, thread_name_prefix=self.name)
+    return self._executor
+
+  def shutdown(self):
+    '''Stops the I/O worker and the async call executor'''
+    self.stop_worker()
+    if self._executor is not None:
+      executor, self._executor = self._executor, None
+      executor.shutdown(wait=True)
+
+  async def arun(self, function:Callable, *args, **kwargs):
+    '''Runs a blocking call using the bus of the master on
+    the executor of the master without blocking the event
+    loop
+
+    Parameters:
+    function: blocking callable
+    args, kwargs: arguments of the call
+
+    Returns:
+    return value of the call
+    '''
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+      self.executor, partial(function, *args, **kwargs))
+
+  async def ascan(self) -> List[int]:
+    '''Async counterpart of scan()'''
+    return await self.arun(self.scan)
+
+  async def ascan_topology(self) -> Dict[int, List[str]]:
+    '''Async counterpart of scan_topology()'''
+    return await self.arun(self.scan_topology)
+
+  async def adiscover(self):
+    '''Async counterpart of discover(). The module registry
+    is updated on the event loop thread.'''
+    self.populate(await self.ascan_topology())
+
+  def _is_direct(self) -> bool:
+    '''Returns True if bus calls run on the calling thread,
+    i.e. no I/O worker runs, this is its thread or the
+    thread holds the transaction lock (the worker would wait
+    for the lock)'''
+    return (self._worker is None or self._worker.is_current
+            or self._transaction_lock.is_held)
+
+  @staticmethod
+  def _read_key(method:str, kwargs:dict) -> tuple:
+    return (method,) + tuple(
+      (name, tuple(value) if isinstance(value, list) else value)
+      for name, value in sorted(kwargs.items()))
+
+  def post(self, key:tuple, method:str, **kwargs):
+    '''Executes a write on the bus or queues it on the I/O
+    worker if one is running
+
+    Parameters:
+    key   : coalescing key; a queued write with the same key
+            is superseded. Writes which must keep their order
+            (e.g. enable and mode changes) pass None
+    method: name of the master method to call
+    kwargs: keyword arguments of the method
+    '''
+    if self._is_direct():
+      return getattr(self, method)(**kwargs)
+    self._worker.submit(key, method, kwargs)
+
+  def fetch(self, method:str, **kwargs):
+    '''Executes a call with a result (a read, a scan, an ID
+    change) on the bus. If an I/O worker is running the call
+    is executed on the worker thread, or the most recently
+    polled value is returned for a read registered with
+    poll().
+
+    Parameters:
+    method: name of the master method to call
+    kwargs: keyword arguments of the method
+    '''
+    if self._is_direct():
+      return getattr(self, method)(**kwargs)
+    key = self._read_key(method, kwargs)
+    if self._worker.is_polled(key):
+      return self._worker.latest(key)
+    return self._worker.call(method, kwargs)
+
+  def poll(self, method:str, **kwargs):
+    '''Marks a read as streaming: while the I/O worker runs
+    it polls the read continuously and fetch() of the same
+    read (e.g. motor.get_position()) returns the most recent
+    value instead of waiting for a transaction
+
+    master.poll('get_position', id=0)
+
+    Parameters:
+    method: name of the master method to call
+    kwargs: keyword arguments of the method
+
+    Raises:
+    RuntimeError: if no I/O worker is running
+    '''
+    if self._worker is None:
+      raise RuntimeError(
+        'Master {} has no running I/O worker'.format(self))
+    self._worker.poll(self._read_key(method, kwargs), method, kwargs)
+
+  def unpoll(self, method:str, **kwargs):
+    '''Stops polling a read marked with poll()'''
+    if self._worker is not None:
+      self._worker.forget(self._read_key(method, kwargs))
+
+  def attach_id(self, smd_id:int, module_labels:List[str]=None):
+    '''Attaches the SMD with the given ID for communication
+    without any bus traffic. Used when the topology is known
+    in advance instead of being scanned.
+
+    Parameters:
+    smd_id       : ID of the SMD
+    module_labels: (optional) module labels the SMD is known
+                   to report, reused instead of a module scan
+    '''
+    self.attach(red.Red(smd_id))
+    if module_labels is not None:
+      self._topology[smd_id] = list(module_labels)
+
+  def read_variables(self, smd_id:int,
+                     index_list:List[int]) -> list:
+    '''Reads the given variables of an SMD in as few
+    transactions as the package size permits
+
+    Parameters:
+    smd_id: ID of the SMD
+    index_list: list of variable indexes (red.Index)
+
+    Returns:
+    list of values in index_list order. Values of failed
+    transactions are None.
+    '''
+    values = list()
+    chunk, size = list(), 0
+    for index in index_list:
+      if chunk and size + VARIABLE_SIZES[index] > READ_PAYLOAD_LIMIT:
+        values.extend(self.get_variables(smd_id, chunk) or
+                      [None] * len(chunk))
+        chunk, size = list(), 0
+      chunk.append(index)
+      size += VARIABLE_SIZES[index]
+    if chunk:
+      values.extend(self.get_variables(smd_id, chunk) or
+                    [None] * len(chunk))
+    return values
+
+  def set_duty_cycles(self, id_pct_pairs:List[tuple]):
+    '''Sets the duty cycles of several SMDs in a single
+    synchronized write frame
+
+    Parameters:
+    id_pct_pairs: list of (SMD ID, duty cycle percentage)
+    '''
+    self.set_variables_sync(
+      red.Index.SetDutyCycle, id_pct_pairs)
+
+  def set_velocities(self, id_sp_pairs:List[tuple]):
+    '''Sets the velocity set points of several SMDs in a
+    single synchronized write frame
+
+    Parameters:
+    id_sp_pairs: list of (SMD ID, velocity in RPM)
+    '''
+    self.set_variables_sync(
+      red.Index.SetVelocity, id_sp_pairs)
+
+  def set_positions(self, id_sp_pairs:List[tuple]):
+    '''Sets the position set points of several SMDs in a
+    single synchronized write frame
+
+    Parameters:
+    id_sp_pairs: list of (SMD ID, position in encoder counts)
+    '''
+    self.set_variables_sync(
+      red.Index.SetPosition, id_sp_pairs)
+
+  def set_torques(self, id_sp_pairs:List[tuple]):
+    '''Sets the current set points of several SMDs in a
+    single synchronized write frame
+
+    Parameters:
+    id_sp_pairs: list of (SMD ID, current in mA)
+    '''
+    self.set_variables_sync(
+      red.Index.SetTorque, id_sp_pairs)
+
+  def enable_torques(self, id_en_pairs:List[tuple]):
+    '''Enables or disables several motor drivers in a single
+    synchronized write frame
+
+    Parameters:
+    id_en_pairs: list of (SMD ID, enable) pairs
+    '''
+    self.set_variables_sync(
+      red.Index.TorqueEnable, id_en_pairs)
 
   def layout(self, prefix=''):
     print(prefix, self)
@@ -115,28 +678,64 @@ class Master(red.Master):
 
   @staticmethod
   def clear():
+    for master in MASTERS:
+      master.shutdown()
     MASTERS.clear()
+    MASTER_NAMES.clear()
+    MASTER_PATHS.clear()
       
+  @staticmethod
+  def register_scheme(scheme:str, cls:type):
+    '''Registers a Master subclass for device paths starting
+    with the given scheme and a colon (e.g. replay:). Such
+    paths passed to add() create an instance of the class.'''
+    MASTER_SCHEMES[scheme] = cls
+
+  @staticmethod
+  def create(device_path:str,
+             baudrate:int=BAUDRATE,
+             name:str=None,
+             lazy:bool=False) -> 'Master':
+    '''Creates a master of the class registered for the
+    scheme of the device path (see register_scheme) or a
+    serial Master'''
+    scheme, separator, _ = device_path.partition(':')
+    if separator and scheme in MASTER_SCHEMES:
+      return MASTER_SCHEMES[scheme](
+        device_path=device_path, baudrate=baudrate, name=name)
+    return Master(
+      device_path=device_path, baudrate=baudrate, name=name,
+      lazy=lazy)
+
   @staticmethod
   def add(device_paths:Union[str, List[str], Dict[str, str]],
           baudrate:int=BAUDRATE,
-          name:str=None) -> Union['Master', List['Master']]:
+          name:str=None,
+          lazy:bool=False) -> Union['Master', List['Master']]:
+    '''Adds masters for device paths. Several ports are
+    opened concurrently. With lazy set the ports are opened
+    on first I/O instead.'''
     if isinstance(device_paths, str):
-      return Master(
-        device_path=device_paths, baudrate=baudrate, name=name)
+      return Master.create(
+        device_path=device_paths, baudrate=baudrate, name=name,
+        lazy=lazy)
     elif isinstance(device_paths, list):
-      return [
-        Master(device_path=path, baudrate=baudrate)
+      masters = [
+        Master.create(device_path=path, baudrate=baudrate, lazy=True)
         for path in device_paths]
     elif isinstance(device_paths, dict):
-      return [
-        Master(device_path=path, baudrate=baudrate, name=name)
+      masters = [
+        Master.create(
+          device_path=path, baudrate=baudrate, name=name, lazy=True)
         for name,path in device_paths.items()]
     else:
       raise Exception(
         '''device_paths must be a string representing the
         device path or a list of device path strings or
         dictionary of names mapped to device paths.''')
+    if not lazy:
+      Master.open_all(masters)
+    return masters
       
   @staticmethod
   def all():
@@ -145,3 +744,25 @@ class Master(red.Master):
     else:
       raise NoMasterSetup
 
+
+def _transaction(method:Callable) -> Callable:
+  '''Wraps a red.Master call to hold the transaction lock of
+  the master while it runs'''
+  @wraps(method)
+  def call(self, *args, **kwargs):
+    with self._transaction_lock:
+      return method(self, *args, **kwargs)
+  return call
+
+
+def _bind_red(module):
+  '''Makes Master a subclass of red.Master, whose calls hold
+  the transaction lock, and fills the variable size table
+  once smd.red is loaded'''
+  Master.__bases__ = (type('RedMaster', (module.Master,), {
+    name: _transaction(value)
+    for name, value in vars(module.Master).items()
+    if callable(value) and not name.startswith('_')}),)
+  VARIABLE_SIZES[:] = [var.size() + 1 for var in module.Red(0).vars]
+
+red.on_load(_bind_red)
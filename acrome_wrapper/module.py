@@ -2,10 +2,14 @@
 
 '''
 
-from typing import List
+from typing import Tuple
 from enum import Enum
-from smd import red
+from itertools import count
+from .deferred import red
 from .defaults import *
+from .cache import StateCache
+from .streaming import ModuleStream, STREAM_CAPACITY
+from . import telemetry
 
 
 __all__ = [
@@ -17,10 +21,131 @@ __all__ = [
   'Module',
   'Motor',
   'Distance',
+  'Buzzer',
+  'Servo',
+  'RGB',
+  'Button',
+  'Light',
+  'Joystick',
+  'QRT',
+  'Potmeter',
+  'IMU',
 ]
   
 
-MODULES = list()
+class ModuleRegistry:
+  '''Ordered collection of modules with hash indexes.
+
+  Modules are kept in insertion order and indexed by every
+  field that Module.find() can filter on. Each index maps a
+  field value to the set of modules holding that value so
+  that a query only visits the modules in the smallest
+  matching bucket.
+
+  '''
+
+  FIELDS = ('master', 'kind', 'smd_id', 'mod_id', 'name')
+
+  def __init__(self):
+    self._modules = list()
+    self._order = dict()
+    self._keys = dict()
+    self._indexes = {field: dict() for field in self.FIELDS}
+    self._sequence = count()
+
+  def __iter__(self):
+    return iter(self._modules)
+
+  def __len__(self):
+    return len(self._modules)
+
+  def __contains__(self, module):
+    return module in self._keys
+
+  @staticmethod
+  def _fields(module:'Module') -> tuple:
+    return (module.master, module.kind, module._smd_id,
+            module.mod_id, module.name)
+
+  def _index(self, module:'Module', keys:tuple):
+    for field, key in zip(self.FIELDS, keys):
+      self._indexes[field].setdefault(key, set()).add(module)
+
+  def _unindex(self, module:'Module', keys:tuple):
+    for field, key in zip(self.FIELDS, keys):
+      bucket = self._indexes[field][key]
+      bucket.discard(module)
+      if not bucket:
+        del self._indexes[field][key]
+
+  def add(self, module:'Module'):
+    '''Registers a module and indexes its current fields'''
+    keys = self._fields(module)
+    self._modules.append(module)
+    self._order[module] = next(self._sequence)
+    self._keys[module] = keys
+    self._index(module, keys)
+
+  def update(self, module:'Module'):
+    '''Re-indexes a registered module after any of its
+    indexed fields (name, smd_id, mod_id) has changed.
+    Unregistered modules are ignored.'''
+    keys = self._keys.get(module)
+    if keys is None:
+      return
+    new_keys = self._fields(module)
+    if new_keys != keys:
+      self._unindex(module, keys)
+      self._keys[module] = new_keys
+      self._index(module, new_keys)
+
+  def clear(self):
+    '''Removes all modules and empties every index'''
+    self._modules.clear()
+    self._order.clear()
+    self._keys.clear()
+    for index in self._indexes.values():
+      index.clear()
+
+  def has_name(self, name:str) -> bool:
+    '''Returns True if a registered module holds the name'''
+    return name in self._indexes['name']
+
+  def all(self) -> list['Module']:
+    '''Returns all registered modules in insertion order'''
+    return self._modules
+
+  def find(self, **conditions) -> list['Module']:
+    '''Returns the modules matching all given field values
+    in insertion order. Conditions with None values are
+    ignored.'''
+    buckets = list()
+    for field, value in conditions.items():
+      if value is None:
+        continue
+      bucket = self._indexes[field].get(value)
+      if not bucket:
+        return list()
+      buckets.append(bucket)
+    if not buckets:
+      return list(self._modules)
+    buckets.sort(key=len)
+    smallest, others = buckets[0], buckets[1:]
+    modules = [m for m in smallest
+               if all(m in bucket for bucket in others)]
+    modules.sort(key=self._order.__getitem__)
+    return modules
+
+
+MODULES = ModuleRegistry()
+
+# Module classes serving each module kind (see
+# Module.register_kind())
+MODULE_KINDS = dict()
+
+# Module kinds by the red.Index name prefix of their
+# variables, which module scans report (e.g. QTR_1)
+MODULE_LABELS = dict()
 
 
 class UndefinedModuleKind(Exception):
@@ -115,6 +240,7 @@ class Module:
     IMU = 'IMU'
     
   _kind = None
+  _label = None
   _name = None
   
   def __init__(self,
@@ -140,7 +266,7 @@ class Module:
     self._smd_id = smd_id
     self._mod_id = mod_id
     self.name = name
-    MODULES.append(self)
+    MODULES.add(self)
     
   def __str__(self):
     return self.name
@@ -191,14 +317,51 @@ class Module:
     if value is None:
       value = "{}:{}[{}]".format(
         self.master.name, self.kind.value, self.label)
-    if value in map(lambda m: m.name, MODULES):
+    if MODULES.has_name(value):
       raise NonUniqueModuleName(value)
     else:
       self._name = value
+      MODULES.update(self)
   
   @staticmethod
   def clear():
     MODULES.clear()
+
+  @staticmethod
+  def register_kind(cls:type):
+    '''Registers the module class serving a module kind.
+    Module.add() and discovery create the modules of the
+    kind as instances of the class. A class registered later
+    for the same kind replaces the earlier one, so subclasses
+    of the built-in module classes can take their place.
+
+    Parameters:
+    cls: Module subclass with its _kind (and the red.Index
+         name prefix of its variables as _label) set
+
+    Raises:
+    UndefinedModuleKind: if the class has no module kind
+    '''
+    if cls._kind not in Module.Kind.choices:
+      raise UndefinedModuleKind(cls._kind)
+    MODULE_KINDS[cls._kind] = cls
+    if cls._label is not None:
+      MODULE_LABELS[cls._label] = cls._kind
+
+  @staticmethod
+  def parse_label(module_label:str) -> tuple['Module.Kind', int]:
+    '''Parses a module label reported by SMD module scan
+    (e.g. Distance_2) into module kind and module ID
+
+    Raises:
+    UnknownModuleKind: if no module class serves the label
+    ValueError: if the label is malformed
+    '''
+    prefix, index = module_label.split('_')
+    kind = MODULE_LABELS.get(prefix)
+    if kind is None:
+      raise UnknownModuleKind(prefix)
+    return kind, int(index)
   
   @staticmethod
   def add(master:'master.Master',
@@ -221,47 +384,25 @@ class Module:
     Module instance for the new module
 
     Raises:
-    UnknownModuleKind: if kind in module_label is unrecognized
+    UnknownModuleKind: if no module class serves the kind
     '''
+    cls = MODULE_KINDS.get(kind)
+    if cls is None:
+      raise UnknownModuleKind(getattr(kind, 'value', kind))
+    return cls(master=master, smd_id=smd_id, mod_id=mod_id, name=name)
 
-    match kind:
-      case Module.Kind.MOTOR:
-        module = Motor(
-          master=master, smd_id=smd_id, name=name)
-      case Module.Kind.BUZZER:
-        raise NotImplementedError
-      case Module.Kind.SERVO:
-        raise NotImplementedError
-      case Module.Kind.RGB:
-        raise NotImplementedError
-      case Module.Kind.BUTTON:
-        raise NotImplementedError
-      case Module.Kind.LIGHT:
-        raise NotImplementedError
-      case Module.Kind.JOYSTICK:
-        raise NotImplementedError
-      case Module.Kind.DISTANCE:
-        module = Distance(
-          master=master, smd_id=smd_id, mod_id=mod_id,
-          name=name)
-      case Module.Kind.QRT:
-        raise NotImplementedError
-      case Module.Kind.POTMETER:
-        raise NotImplementedError
-      case Module.Kind.IMU:
-        raise NotImplementedError
-      case _:
-        raise UnknownModuleKind(kind)
-    return module
-
-  @staticmethod
-  def all():
+  @classmethod
+  def all(cls):
     '''Returns the list of all modules in the system
-    abstraction'''
-    return MODULES
+    abstraction. Called on a module class only the modules
+    of its kind are returned.'''
+    if cls._kind is None:
+      return MODULES.all()
+    return MODULES.find(kind=cls._kind)
   
-  @staticmethod
-  def find(master:'master.Master'=None,
+  @classmethod
+  def find(cls,
+           master:'master.Master'=None,
            kind:'Module.Kind'=None,
            mod_id:int=None,
            smd_id:int=None,
@@ -270,7 +411,8 @@ class Module:
 
     Parameters:
     master: (optional) communication gateway master
-    kind  : (optional) module kind
+    kind  : (optional) module kind, implied when called on a
+            module class
     mod_id: (optional) module hardware index
     smd_id: (optional) id of the managing SMD card (Motor)
     name  : (optional) full name of the module
@@ -278,26 +420,12 @@ class Module:
     Returns:
     list of Module instances satisfying conditions
     '''
-    modules = MODULES
-    if master is not None:
-      modules = filter(
-        lambda m: m.master == master, modules)
-    if kind is not None:
-      modules = filter(
-        lambda m: m.kind == kind, modules)
-    if mod_id is not None:
-      modules = filter(
-        lambda m: m.mod_id == mod_id, modules)
-    if smd_id is not None:
-      modules = filter(
-        lambda m: m._smd_id == smd_id, modules)
-    if name is not None:
-      modules = filter(
-        lambda m: m.name == name, modules)
-    return list(modules)
+    return MODULES.find(
+      master=master, kind=cls._kind or kind, mod_id=mod_id,
+      smd_id=smd_id, name=name)
 
-  @staticmethod
-  def get(*args, **kwargs):
+  @classmethod
+  def get(cls, *args, **kwargs):
     '''Returns the unique module satisfying conditions
 
     Parameters:
@@ -309,7 +437,7 @@ class Module:
     Raises:
     MultipleModulesFound: if more than one Module satisfies
     '''
-    modules = Module.find(*args, **kwargs)
+    modules = cls.find(*args, **kwargs)
     if len(modules) == 1:
       return modules[0]
     elif len(modules) > 1:
@@ -324,6 +452,62 @@ class Module:
     setup on start-up is required this method will be
     overridden by the child module class.'''
     pass
+
+  def _read_indexes(self) -> dict:
+    '''Returns the quantities that can be read in batch (see
+    group.ModuleGroup.read()) mapped to the SMD variable
+    index holding them. Overridden by child module classes.'''
+    return dict()
+
+  def _decode(self, quantity:str, value):
+    '''Converts a raw variable value read in batch into the
+    module quantity and updates any internally stored
+    state. Overridden by child module classes.'''
+    return value
+
+  def _variable(self) -> 'red.Index':
+    '''Returns the index of the SMD variable of the module
+
+    Raises:
+    red.InvalidIndexError: if the module ID is out of 1..5
+    '''
+    index = red.Index[self._label + '_1'] + self._mod_id - 1
+    if not (red.Index[self._label + '_1'] <= index
+            <= red.Index[self._label + '_5']):
+      raise red.InvalidIndexError()
+    return red.Index(index)
+
+  def _record(self, recorder:'telemetry.Recorder', quantity:str,
+              index:int, value, decoded):
+    '''Records a value read. Fields of multi-field variables
+    (e.g. joystick axes) are recorded decoded and without
+    index since the recorder stores scalars.'''
+    if isinstance(value, list):
+      index, value = None, decoded
+    recorder.record(self, quantity, index, value)
+
+  def _read(self, *quantities:str) -> list:
+    '''Reads quantities of the module (see _read_indexes())
+    with a single transaction
+
+    Returns:
+    list of the decoded values in quantities order. Values
+    of failed reads are None.
+    '''
+    indexes = self._read_indexes()
+    index_list = list(dict.fromkeys(indexes[q] for q in quantities))
+    values = dict(zip(index_list, self._master.fetch(
+      'read_variables', smd_id=self._smd_id, index_list=index_list)))
+    recorder = telemetry.RECORDER
+    decoded = list()
+    for quantity in quantities:
+      value = values[indexes[quantity]]
+      decoded.append(
+        None if value is None else self._decode(quantity, value))
+      if recorder is not None:
+        self._record(
+          recorder, quantity, indexes[quantity], value, decoded[-1])
+    return decoded
   
 
   
@@ -338,11 +522,16 @@ class Motor(Module):
   '''
 
   class Mode(Option):
-    '''Motor drive control modes'''
-    VOLTAGE_CONTROL = red.OperationMode.PWM
-    POSITION_CONTROL = red.OperationMode.Position
-    VELOCITY_CONTROL = red.OperationMode.Velocity
-    TORQUE_CONTROL = red.OperationMode.Torque
+    '''Motor drive control modes.
+
+    The values are the ones of red.OperationMode, written out
+    so that defining the class does not import smd.red
+
+    '''
+    VOLTAGE_CONTROL = 0   # red.OperationMode.PWM
+    POSITION_CONTROL = 1  # red.OperationMode.Position
+    VELOCITY_CONTROL = 2  # red.OperationMode.Velocity
+    TORQUE_CONTROL = 3    # red.OperationMode.Torque
 
   class Polarity(Enum):
     '''Polarity of the motor terminal connection.'''
@@ -366,11 +555,26 @@ class Motor(Module):
   _mode = None
   _is_enabled = None
   _voltage = 0.0
+  _velocity = 0.0
   _supply_voltage = DEFAULT_SUPPLY_VOLTAGE
   _polarity = Polarity.POSITIVE
+  _velocity_limit = None
+  _position = 0.0
+  _position_limits = None
+  _torque = 0.0
+  _torque_limit = None
+  # Incremented on supply voltage, polarity and SMD ID changes
+  # of any motor, so groups can tell their parameters are
+  # outdated
+  _revision = 0
   
-  def __init__(self, *args, **kwargs):
-    super().__init__(*args, **kwargs)
+  def __init__(self,
+               master:'master.Master',
+               smd_id:int,
+               mod_id:int=None,
+               name:str=None):
+    super().__init__(master, smd_id, name=name)
+    self._cache = StateCache()
 
   @staticmethod
   def add(master:'master.Master',
@@ -392,46 +596,6 @@ class Motor(Module):
     '''
     return Motor(master=master, smd_id=smd_id, name=name)
 
-  @staticmethod
-  def all() -> List['module.Motor']:
-    return Module.find(kind=Module.Kind.MOTOR)
-  
-  @staticmethod
-  def find(master:'master.Master'=None,
-           mod_id:int=None,
-           smd_id:int=None,
-           name:str=None) -> list['module.Motor']:
-    '''Returns a list of motor modules satisfying conditions
-
-    Parameters:
-    master: (optional) communication gateway master
-    mod_id: (optional) module hardware index
-    smd_id: (optional) id of the managing SMD card (Motor)
-    name  : (optional) full name of the module
-
-    Returns:
-    list of Module instances satisfying conditions
-    '''
-    return Module.find(
-      master=master, kind=Module.Kind.MOTOR,
-      mod_id=mod_id, smd_id=smd_id, name=name)
-
-  @staticmethod
-  def get(*args, **kwargs) -> 'module.Motor':
-    '''Returns the unique Motor module satisfying conditions
-
-    Parameters:
-    see find()
-
-    Returns:
-    Satisfying single Motor module instance of None
-
-    Raises:
-    MultipleModulesFound: if more than one Motor module satisfies
-    '''
-    kwargs.update({'kind': Module.Kind.MOTOR})
-    return Module.get(*args, **kwargs)
-
   def get_info(self) -> dict:
     '''Returns the hardware and firmware version of the
     associated embedded SMD card.
@@ -439,19 +603,21 @@ class Motor(Module):
     HardwareVersion: SMD hardware version
     SoftwareVersion: SMD firmware version
     '''
-    return self._master.get_driver_info(
-      id=self._smd_id)
+    return self._master.fetch(
+      'get_driver_info', id=self._smd_id)
 
   def update_fw(self, version:str='v1.0.1') -> bool:
-    return self._master.update_fw_version(
-      id=self._smd_id, version=version)
+    return self._master.fetch(
+      'update_fw_version', id=self._smd_id, version=version)
       
   @Module.mod_id.setter
   def mod_id(self, id:int):
     assert 0 <= id <= 254, 'id must be in [0,254] range'
-    self._master.update_driver_id(id=self._smd_id, id_new=id)
-    for module in Module.find(smd_id=self._smd_id):
+    self._master.fetch('update_driver_id', id=self._smd_id, id_new=id)
+    for module in Module.find(master=self._master, smd_id=self._smd_id):
       module._smd_id = id
+      MODULES.update(module)
+    Motor._revision += 1
   
   def setup(self):
     '''Hardware setup for the motor module.
@@ -464,40 +630,104 @@ class Motor(Module):
     self.mode = Motor.Mode.VOLTAGE_CONTROL
     self.set_voltage(0.0, forced=True)
 
+  def _read_indexes(self) -> dict:
+    return {
+      'enabled': red.Index.TorqueEnable,
+      'mode': red.Index.OperationMode,
+      'velocity': red.Index.PresentVelocity,
+      'position': red.Index.PresentPosition,
+      'current': red.Index.MotorCurrent,
+    }
+
+  def _decode(self, quantity:str, value):
+    if quantity == 'enabled':
+      self._is_enabled = bool(value)
+      self._cache.touch('is_enabled')
+      return self._is_enabled
+    elif quantity == 'mode':
+      self._mode = Motor.Mode.member(value)
+      self._cache.touch('mode')
+      return self._mode
+    elif quantity in ('velocity', 'position', 'current'):
+      return self._polarity.value * value
+    return value
+
+  @property
+  def cache(self) -> StateCache:
+    '''Returns the state cache of the motor. The mode and
+    is_enabled properties are served from the stored states
+    while they are fresh (see StateCache). By default the
+    time-to-live is zero and every read goes to the bus.
+
+    motor.cache.set_ttl(mode=1.0, is_enabled=0.1)
+    '''
+    return self._cache
+
+  def refresh(self):
+    '''Reads the mode and the enable state from the motor
+    drive hardware regardless of their freshness'''
+    self._cache.invalidate()
+    self._get_mode()
+    self._get_is_enabled()
+
+  def invalidate(self, attr:str=None):
+    '''Marks the stored mode and enable states (or only the
+    given one) stale so that the next read goes to the
+    bus'''
+    self._cache.invalidate(attr)
+
   def _get_is_enabled(self):
     '''Updates the internally stored motor drive enable
     state.'''
     try:
-      self._is_enabled = bool(self._master.get_variables(
-        id=self._smd_id,
+      self._is_enabled = bool(self._master.fetch(
+        'get_variables', id=self._smd_id,
         index_list=[red.Index.TorqueEnable])[0])
+      self._cache.touch('is_enabled')
     except TypeError:
       pass
 
   @property
   def is_enabled(self) -> bool:
-    '''Updates the motor drive enable state and returns it'''
-    self._get_is_enabled()
+    '''Updates the motor drive enable state (unless the
+    stored state is fresh) and returns it'''
+    if not self._cache.is_fresh('is_enabled'):
+      self._get_is_enabled()
     return self._is_enabled
   
   def enable(self):
     '''Enables motor driver.'''
-    self._master.enable_torque(
-      id=self._smd_id, en=True)
+    self._master.post(
+      None, 'enable_torque', id=self._smd_id, en=True)
     self._is_enabled = True
+    self._cache.touch('is_enabled')
+    if telemetry.RECORDER is not None:
+      telemetry.RECORDER.record(
+        self, 'enabled', red.Index.TorqueEnable, 1.0)
 
   def disable(self):
     '''Disables motor driver.'''
-    self._master.enable_torque(
-      id=self._smd_id, en=False)
+    self._master.post(
+      None, 'enable_torque', id=self._smd_id, en=False)
     self._is_enabled = False
+    self._cache.touch('is_enabled')
+    if telemetry.RECORDER is not None:
+      telemetry.RECORDER.record(
+        self, 'enabled', red.Index.TorqueEnable, 0.0)
+
+  def _get_mode(self):
+    '''Updates the internally stored operation mode.'''
+    self._mode = Motor.Mode.member(self._master.fetch(
+      'get_operation_mode', id=self._smd_id))
+    self._cache.touch('mode')
 
   @property
   def mode(self) -> 'Motor.Mode':
     '''Acquires the the currently active mode from motor drive
-    hardware and returns it'''
-    self._mode = Motor.Mode.member(
-      self._master.get_operation_mode(id=self._smd_id))
+    hardware (unless the stored mode is fresh) and returns
+    it'''
+    if not self._cache.is_fresh('mode'):
+      self._get_mode()
     return self._mode
 
   @mode.setter
@@ -513,8 +743,36 @@ class Motor(Module):
       return
     self.disable()
     self._mode = operation
-    self._master.set_operation_mode(
+    self._master.post(
+      None, 'set_operation_mode',
       id=self._smd_id, mode=operation.value)
+    self._cache.touch('mode')
+    if telemetry.RECORDER is not None:
+      telemetry.RECORDER.record(
+        self, 'mode', red.Index.OperationMode, operation.value)
+
+  async def aget_is_enabled(self) -> bool:
+    '''Async counterpart of is_enabled'''
+    return await self._master.arun(
+      lambda: self.is_enabled)
+
+  async def aenable(self):
+    '''Async counterpart of enable()'''
+    await self._master.arun(self.enable)
+
+  async def adisable(self):
+    '''Async counterpart of disable()'''
+    await self._master.arun(self.disable)
+
+  async def aget_mode(self) -> 'Motor.Mode':
+    '''Async counterpart of the mode getter'''
+    return await self._master.arun(lambda: self.mode)
+
+  async def aset_mode(self, operation:'Motor.Mode'):
+    '''Async counterpart of the mode setter'''
+    def set_mode():
+      self.mode = operation
+    await self._master.arun(set_mode)
 
   def reset(self):
     '''Resets the control mode and command to voltage mode
@@ -536,6 +794,7 @@ class Motor(Module):
     assert voltage > 0.0, \
       'Supply voltage must be a positive value'
     self._supply_voltage = voltage
+    Motor._revision += 1
     
   @property
   def polarity(self) -> 'Motor.Polarity':
@@ -546,6 +805,7 @@ class Motor(Module):
   def polarity(self, direction:'Motor.Polarity'):
     '''Sets the motor terminal polarity'''
     self._polarity = direction
+    Motor._revision += 1
     
   def set_voltage(self,
                   voltage:float,
@@ -562,16 +822,37 @@ class Motor(Module):
       Actual voltage generated (after clampping)
 
     '''
-    if self._mode != Motor.Mode.VOLTAGE_CONTROL:
+    self._check_command(Motor.Mode.VOLTAGE_CONTROL, forced)
+    duty_cycle = self._duty_cycle(voltage)
+    self._master.post(
+      ('set_duty_cycle', self._smd_id), 'set_duty_cycle',
+      id=self._smd_id, pct=self._polarity.value*duty_cycle*100.0)
+    self._voltage = duty_cycle * self._supply_voltage
+    if telemetry.RECORDER is not None:
+      telemetry.RECORDER.record(self, 'voltage', None, self._voltage)
+    return self._voltage
+
+  def _check_command(self, mode:'Motor.Mode', forced:bool=False):
+    '''Raises IncorrectModeError if the current control mode
+    is not the given mode and NotEnabledError if the motor
+    drive is not enabled (unless forced)'''
+    if self._mode != mode:
       raise Motor.IncorrectModeError(self._mode)
     if not forced and not self._is_enabled:
       raise Motor.NotEnabledError
+
+  def _duty_cycle(self, voltage:float) -> float:
+    '''Returns the duty cycle for the given terminal voltage
+    clamped to [-1.0, 1.0] range'''
     duty_cycle = float(voltage / self._supply_voltage)
-    duty_cycle = max(-1.0, min(duty_cycle, 1.0))
-    self._master.set_duty_cycle(
-      id=self._smd_id, pct=self._polarity.value*duty_cycle*100.0)
-    self._voltage = duty_cycle * self._supply_voltage
-    return self._voltage
+    return max(-1.0, min(duty_cycle, 1.0))
+
+  async def aset_voltage(self,
+                         voltage:float,
+                         forced:bool=False) -> float:
+    '''Async counterpart of set_voltage()'''
+    return await self._master.arun(
+      self.set_voltage, voltage, forced=forced)
 
   def get_voltage(self) -> float:
     '''Returns the currently applied motor terminal
@@ -582,52 +863,392 @@ class Motor(Module):
       raise Motor.IncorrectModeError(self._mode)
     return self._voltage
 
-  
-class Distance(Module):
+  @property
+  def shaft_cpr(self) -> float:
+    '''Returns the encoder counts per revolution of the
+    output shaft'''
+    return self._master.fetch('get_shaft_cpr', id=self._smd_id)
+
+  @shaft_cpr.setter
+  def shaft_cpr(self, cpr:float):
+    '''Sets the encoder counts per revolution of the output
+    shaft used by the velocity and position controllers'''
+    assert cpr > 0.0, 'CPR must be a positive value'
+    self._master.post(
+      None, 'set_shaft_cpr', id=self._smd_id, cpr=cpr)
 
-  _kind = Module.Kind.DISTANCE
+  @property
+  def shaft_rpm(self) -> float:
+    '''Returns the output shaft speed at 12V in RPM'''
+    return self._master.fetch('get_shaft_rpm', id=self._smd_id)
 
-  @staticmethod
-  def all() -> List['module.Distance']:
-    '''Returns a list of all distance modules'''
-    return Module.find(kind=Module.Kind.DISTANCE)
-  
-  @staticmethod
-  def find(master:'master.Master'=None,
-           mod_id:int=None,
-           smd_id:int=None,
-           name:str=None) -> list['module.Distance']:
-    '''Returns a list of distance modules satisfying conditions
+  @shaft_rpm.setter
+  def shaft_rpm(self, rpm:float):
+    '''Sets the output shaft speed at 12V in RPM'''
+    assert rpm > 0.0, 'RPM must be a positive value'
+    self._master.post(
+      None, 'set_shaft_rpm', id=self._smd_id, rpm=rpm)
 
-    Parameters:
-    master: (optional) communication gateway master
-    mod_id: (optional) module hardware index
-    smd_id: (optional) id of the managing SMD card (Motor)
-    name  : (optional) full name of the module
+  @property
+  def velocity_limit(self) -> int:
+    '''Acquires the velocity limit of the velocity control
+    mode in RPM from the motor drive hardware'''
+    limit = self._master.fetch('get_velocity_limit', id=self._smd_id)
+    if limit is not None:
+      self._velocity_limit = limit
+    return limit
+
+  @velocity_limit.setter
+  def velocity_limit(self, limit:int):
+    '''Sets the velocity limit of the velocity control mode
+    in RPM (at most 65535)'''
+    assert 0 <= limit <= 65535, 'limit must be in [0,65535] range'
+    self._master.post(
+      None, 'set_velocity_limit',
+      id=self._smd_id, vl=int(limit))
+    self._velocity_limit = int(limit)
+
+  def _set_control_parameters(self, method:str, **parameters):
+    '''Writes the given (not None) control block parameters
+    using the master method'''
+    if all(value is None for value in parameters.values()):
+      return
+    self._master.post(
+      None, method, id=self._smd_id, **parameters)
+
+  def _get_control_parameters(self, block:str) -> dict:
+    '''Reads the parameters of the Position, Velocity or
+    Torque control block'''
+    values = self._master.fetch(
+      'read_variables', smd_id=self._smd_id, index_list=[
+        getattr(red.Index, block + name) for name in (
+          'PGain', 'IGain', 'DGain', 'Deadband', 'FF', 'OutputLimit')])
+    if values is None or None in values:
+      return None
+    return dict(zip(('p', 'i', 'd', 'db', 'ff', 'ol'), values))
 
-    Returns:
-    list of Distance instances satisfying conditions
+  def set_velocity_parameters(self, p:float=None, i:float=None,
+                              d:float=None, db:float=None,
+                              ff:float=None, ol:float=None):
+    '''Sets the velocity control block parameters. Only the
+    given parameters are written.
+
+    Args:
+      p, i, d: proportional, integral and derivative gains
+      db: deadband in RPM
+      ff: feedforward
+      ol: maximum output limit (950 by default)
     '''
-    return Module.find(
-      master=master, kind=Module.Kind.DISTANCE,
-      mod_id=mod_id, smd_id=smd_id, name=name)
+    self._set_control_parameters(
+      'set_control_parameters_velocity',
+      p=p, i=i, d=d, db=db, ff=ff, ol=ol)
+
+  def get_velocity_parameters(self) -> dict:
+    '''Returns the velocity control block parameters as a
+    dictionary with p, i, d, db, ff and ol keys (None if the
+    read fails)'''
+    return self._get_control_parameters('Velocity')
+
+  def _clamp_velocity(self, velocity:float) -> float:
+    '''Returns the velocity clamped to the known velocity
+    limit'''
+    velocity = float(velocity)
+    limit = self._velocity_limit
+    if limit is None:
+      return velocity
+    return max(-limit, min(velocity, limit))
+
+  def set_velocity(self,
+                   velocity:float,
+                   forced:bool=False) -> float:
+    '''Sets the output shaft velocity set point. Requires
+    the current control mode to be VELOCITY_CONTROL otherwise
+    raises IncorrectModeError exception. If the motor is not
+    enabled NotEnabled exception is raised.
+
+    The polarity applies to the velocity set points and
+    feedback, i.e. with NEGATIVE polarity a positive velocity
+    turns the shaft in the negative direction of the drive.
 
-  @staticmethod
-  def get(*args, **kwargs) -> 'module.Distance':
-    '''Returns the unique Distance module satisfying conditions
+    Args:
+      velocity: (float) Velocity in RPM
+      forced: (bool) If True ignore drive enable state
+    Return:
+      Velocity set point (after clamping to the velocity
+      limit if it is known)
+    '''
+    self._check_command(Motor.Mode.VELOCITY_CONTROL, forced)
+    velocity = self._clamp_velocity(velocity)
+    set_point = self._polarity.value * velocity
+    self._master.post(
+      ('set_velocity', self._smd_id), 'set_velocity',
+      id=self._smd_id, sp=set_point)
+    self._velocity = velocity
+    if telemetry.RECORDER is not None:
+      telemetry.RECORDER.record(
+        self, 'velocity_set_point', red.Index.SetVelocity, set_point)
+    return velocity
+
+  async def aset_velocity(self,
+                          velocity:float,
+                          forced:bool=False) -> float:
+    '''Async counterpart of set_velocity()'''
+    return await self._master.arun(
+      self.set_velocity, velocity, forced=forced)
+
+  def get_velocity_set_point(self) -> float:
+    '''Returns the most recent velocity set point in RPM.
+    Requires the current control mode to be VELOCITY_CONTROL
+    otherwise raises IncorrectModeError exception.'''
+    if self._mode != Motor.Mode.VELOCITY_CONTROL:
+      raise Motor.IncorrectModeError(self._mode)
+    return self._velocity
+
+  def get_velocity(self) -> float:
+    '''Returns the measured output shaft velocity in RPM
+    (None if the read fails). Available in all control
+    modes.'''
+    velocity = self._master.fetch('get_velocity', id=self._smd_id)
+    if telemetry.RECORDER is not None:
+      telemetry.RECORDER.record(
+        self, 'velocity', red.Index.PresentVelocity, velocity)
+    if velocity is None:
+      return None
+    return self._polarity.value * velocity
 
-    Parameters:
-    see find()
+  async def aget_velocity(self) -> float:
+    '''Async counterpart of get_velocity()'''
+    return await self._master.arun(self.get_velocity)
 
-    Returns:
-    Satisfying single Distance module instance of None
+  @property
+  def position_limits(self) -> tuple:
+    '''Acquires the (minimum, maximum) position limits in
+    encoder counts from the motor drive hardware'''
+    limits = self._master.fetch(
+      'get_position_limits', id=self._smd_id)
+    if limits is None or None in limits:
+      return None
+    self._position_limits = tuple(limits)
+    return self._position_limits
+
+  @position_limits.setter
+  def position_limits(self, limits:tuple):
+    '''Sets the (minimum, maximum) position limits in
+    encoder counts. The drive disables the motor when the
+    shaft leaves the limits.'''
+    minimum, maximum = (int(limit) for limit in limits)
+    assert minimum < maximum, 'minimum must be below maximum'
+    self._master.post(
+      None, 'set_position_limits',
+      id=self._smd_id, plmin=minimum, plmax=maximum)
+    self._position_limits = (minimum, maximum)
+
+  def set_position_parameters(self, p:float=None, i:float=None,
+                              d:float=None, db:float=None,
+                              ff:float=None, ol:float=None):
+    '''Sets the position control block parameters. Only the
+    given parameters are written.
 
-    Raises:
-    MultipleModulesFound: if more than one Distance module satisfies
+    Args:
+      p, i, d: proportional, integral and derivative gains
+      db: deadband in encoder counts
+      ff: feedforward
+      ol: maximum output limit (950 by default)
+    '''
+    self._set_control_parameters(
+      'set_control_parameters_position',
+      p=p, i=i, d=d, db=db, ff=ff, ol=ol)
+
+  def get_position_parameters(self) -> dict:
+    '''Returns the position control block parameters as a
+    dictionary with p, i, d, db, ff and ol keys (None if the
+    read fails)'''
+    return self._get_control_parameters('Position')
+
+  def _clamp_position(self, position:float) -> float:
+    '''Returns the position clamped to the known position
+    limits (in the polarity of the motor)'''
+    position = float(position)
+    if self._position_limits is None:
+      return position
+    minimum, maximum = sorted(
+      self._polarity.value * limit for limit in self._position_limits)
+    return max(minimum, min(position, maximum))
+
+  def set_position(self,
+                   position:float,
+                   forced:bool=False) -> float:
+    '''Sets the output shaft position set point. Requires
+    the current control mode to be POSITION_CONTROL otherwise
+    raises IncorrectModeError exception. If the motor is not
+    enabled NotEnabled exception is raised. The polarity
+    applies as in set_velocity().
+
+    Args:
+      position: (float) Position in encoder counts
+      forced: (bool) If True ignore drive enable state
+    Return:
+      Position set point (after clamping to the position
+      limits if they are known)
+    '''
+    self._check_command(Motor.Mode.POSITION_CONTROL, forced)
+    position = self._clamp_position(position)
+    set_point = self._polarity.value * position
+    self._master.post(
+      ('set_position', self._smd_id), 'set_position',
+      id=self._smd_id, sp=set_point)
+    self._position = position
+    if telemetry.RECORDER is not None:
+      telemetry.RECORDER.record(
+        self, 'position_set_point', red.Index.SetPosition, set_point)
+    return position
+
+  async def aset_position(self,
+                          position:float,
+                          forced:bool=False) -> float:
+    '''Async counterpart of set_position()'''
+    return await self._master.arun(
+      self.set_position, position, forced=forced)
+
+  def get_position_set_point(self) -> float:
+    '''Returns the most recent position set point in
+    encoder counts. Requires the current control mode to be
+    POSITION_CONTROL otherwise raises IncorrectModeError
+    exception.'''
+    if self._mode != Motor.Mode.POSITION_CONTROL:
+      raise Motor.IncorrectModeError(self._mode)
+    return self._position
+
+  def get_position(self) -> float:
+    '''Returns the measured output shaft position in
+    encoder counts (None if the read fails). Available in all
+    control modes.'''
+    position = self._master.fetch('get_position', id=self._smd_id)
+    if telemetry.RECORDER is not None:
+      telemetry.RECORDER.record(
+        self, 'position', red.Index.PresentPosition, position)
+    if position is None:
+      return None
+    return self._polarity.value * position
+
+  async def aget_position(self) -> float:
+    '''Async counterpart of get_position()'''
+    return await self._master.arun(self.get_position)
+
+  @property
+  def torque_limit(self) -> int:
+    '''Acquires the torque (current) limit in mA from the
+    motor drive hardware'''
+    limit = self._master.fetch('get_torque_limit', id=self._smd_id)
+    if limit is not None:
+      self._torque_limit = limit
+    return limit
+
+  @torque_limit.setter
+  def torque_limit(self, limit:int):
+    '''Sets the torque (current) limit in mA (at most 65535).
+    The drive disables the motor after a timeout if the motor
+    current exceeds the limit.'''
+    assert 0 <= limit <= 65535, 'limit must be in [0,65535] range'
+    self._master.post(
+      None, 'set_torque_limit', id=self._smd_id, tl=int(limit))
+    self._torque_limit = int(limit)
+
+  def set_torque_parameters(self, p:float=None, i:float=None,
+                            d:float=None, db:float=None,
+                            ff:float=None, ol:float=None):
+    '''Sets the torque control block parameters. Only the
+    given parameters are written.
+
+    Args:
+      p, i, d: proportional, integral and derivative gains
+      db: deadband in mA
+      ff: feedforward
+      ol: maximum output limit (950 by default)
     '''
-    kwargs.update({'kind': Module.Kind.DISTANCE})
-    return Module.get(*args, **kwargs)
+    self._set_control_parameters(
+      'set_control_parameters_torque',
+      p=p, i=i, d=d, db=db, ff=ff, ol=ol)
+
+  def get_torque_parameters(self) -> dict:
+    '''Returns the torque control block parameters as a
+    dictionary with p, i, d, db, ff and ol keys (None if the
+    read fails)'''
+    return self._get_control_parameters('Torque')
+
+  def _clamp_torque(self, torque:float) -> float:
+    '''Returns the torque clamped to the known torque
+    limit'''
+    torque = float(torque)
+    limit = self._torque_limit
+    if limit is None:
+      return torque
+    return max(-limit, min(torque, limit))
+
+  def set_torque(self,
+                 torque:float,
+                 forced:bool=False) -> float:
+    '''Sets the motor current set point. Requires the
+    current control mode to be TORQUE_CONTROL otherwise raises
+    IncorrectModeError exception. If the motor is not enabled
+    NotEnabled exception is raised. The polarity applies as
+    in set_velocity().
+
+    Args:
+      torque: (float) Motor current in mA
+      forced: (bool) If True ignore drive enable state
+    Return:
+      Current set point (after clamping to the torque limit
+      if it is known)
+    '''
+    self._check_command(Motor.Mode.TORQUE_CONTROL, forced)
+    torque = self._clamp_torque(torque)
+    set_point = self._polarity.value * torque
+    self._master.post(
+      ('set_torque', self._smd_id), 'set_torque',
+      id=self._smd_id, sp=set_point)
+    self._torque = torque
+    if telemetry.RECORDER is not None:
+      telemetry.RECORDER.record(
+        self, 'torque_set_point', red.Index.SetTorque, set_point)
+    return torque
+
+  async def aset_torque(self,
+                        torque:float,
+                        forced:bool=False) -> float:
+    '''Async counterpart of set_torque()'''
+    return await self._master.arun(
+      self.set_torque, torque, forced=forced)
+
+  def get_torque_set_point(self) -> float:
+    '''Returns the most recent current set point in mA.
+    Requires the current control mode to be TORQUE_CONTROL
+    otherwise raises IncorrectModeError exception.'''
+    if self._mode != Motor.Mode.TORQUE_CONTROL:
+      raise Motor.IncorrectModeError(self._mode)
+    return self._torque
+
+  def get_current(self) -> float:
+    '''Returns the measured motor current in mA (None if
+    the read fails). Available in all control modes.'''
+    current = self._master.fetch('get_torque', id=self._smd_id)
+    if telemetry.RECORDER is not None:
+      telemetry.RECORDER.record(
+        self, 'current', red.Index.MotorCurrent, current)
+    if current is None:
+      return None
+    return self._polarity.value * current
+
+  async def aget_current(self) -> float:
+    '''Async counterpart of get_current()'''
+    return await self._master.arun(self.get_current)
+
   
+class Distance(Module):
+
+  _kind = Module.Kind.DISTANCE
+  _label = 'Distance'
+
   def setup(self):
     '''Hardware setup for the distance module.
     '''
@@ -635,7 +1256,358 @@ class Distance(Module):
 
   def measure(self) -> int:
     '''Returns the most recent measured range.'''
-    return self._master.get_distance(
-      self._smd_id, self._mod_id)
-    
+    distance = self._master.fetch(
+      'get_distance', id=self._smd_id, module_id=self._mod_id)
+    if telemetry.RECORDER is not None:
+      telemetry.RECORDER.record(
+        self, 'distance', self._read_indexes()['distance'], distance)
+    return distance
+
+  async def ameasure(self) -> int:
+    '''Async counterpart of measure()'''
+    return await self._master.arun(self.measure)
+
+  def _read_indexes(self) -> dict:
+    return {
+      'distance': self._variable(),
+    }
+
+
+
+
+class Buzzer(Module):
+  '''Buzzer module abstraction class.'''
+
+  _kind = Module.Kind.BUZZER
+  _label = 'Buzzer'
+  _frequency = 0
+
+  @property
+  def frequency(self) -> int:
+    '''Returns the note frequency last set in Hz (0 when
+    silent)'''
+    return self._frequency
+
+  def play(self, frequency:int):
+    '''Sounds a note until another one is played or the
+    buzzer is silenced
+
+    Args:
+      frequency: (int) Note frequency in Hz, 0 silences
+    '''
+    if frequency < 0:
+      raise ValueError(
+        'Note frequency must not be negative: {}'.format(frequency))
+    self._master.post(
+      ('set_buzzer', self._smd_id, self._mod_id), 'set_buzzer',
+      id=self._smd_id, module_id=self._mod_id,
+      note_frequency=int(frequency))
+    self._frequency = int(frequency)
+    if telemetry.RECORDER is not None:
+      telemetry.RECORDER.record(
+        self, 'frequency', self._variable(), self._frequency)
+
+  def silence(self):
+    '''Stops the note being played'''
+    self.play(0)
+
+
+class Servo(Module):
+  '''RC servo module abstraction class.'''
+
+  _kind = Module.Kind.SERVO
+  _label = 'Servo'
+  _position = None
+
+  @property
+  def position(self) -> int:
+    '''Returns the position last set (None before the
+    first)'''
+    return self._position
+
+  def set_position(self, position:int):
+    '''Moves the servo to a position
+
+    Args:
+      position: (int) Position in the range [0, 255] spanning
+        the travel of the servo
+    '''
+    if not 0 <= position <= 255:
+      raise ValueError(
+        'Servo position must be in range 0 - 255: {}'.format(position))
+    self._master.post(
+      ('set_servo', self._smd_id, self._mod_id), 'set_servo',
+      id=self._smd_id, module_id=self._mod_id, val=int(position))
+    self._position = int(position)
+    if telemetry.RECORDER is not None:
+      telemetry.RECORDER.record(
+        self, 'position', self._variable(), self._position)
+
+
+class RGB(Module):
+  '''RGB LED module abstraction class.'''
+
+  _kind = Module.Kind.RGB
+  _label = 'RGB'
+  _color = (0, 0, 0)
+
+  @property
+  def color(self) -> Tuple[int, int, int]:
+    '''Returns the red, green and blue components last set'''
+    return self._color
 
+  def set_color(self, red:int, green:int, blue:int):
+    '''Sets the emitted color
+
+    Args:
+      red, green, blue: (int) Color components in the range
+        [0, 255]
+    '''
+    color = (int(red), int(green), int(blue))
+    if not all(0 <= c <= 255 for c in color):
+      raise ValueError(
+        'RGB color values must be in range 0 - 255: {}'.format(color))
+    self._master.post(
+      ('set_rgb', self._smd_id, self._mod_id), 'set_rgb',
+      id=self._smd_id, module_id=self._mod_id,
+      red=color[0], green=color[1], blue=color[2])
+    self._color = color
+    if telemetry.RECORDER is not None:
+      telemetry.RECORDER.record(
+        self, 'color', self._variable(),
+        color[0] + (color[1] << 8) + (color[2] << 16))
+
+  def off(self):
+    '''Turns the LED off'''
+    self.set_color(0, 0, 0)
+
+
+class Button(Module):
+  '''Push button module abstraction class.'''
+
+  _kind = Module.Kind.BUTTON
+  _label = 'Button'
+
+  def is_pressed(self) -> bool:
+    '''Returns True while the button is pressed (None if the
+    read fails)'''
+    return self._read('pressed')[0]
+
+  async def ais_pressed(self) -> bool:
+    '''Async counterpart of is_pressed()'''
+    return await self._master.arun(self.is_pressed)
+
+  def _read_indexes(self) -> dict:
+    return {
+      'pressed': self._variable(),
+    }
+
+  def _decode(self, quantity:str, value):
+    return bool(value)
+
+
+class Light(Module):
+  '''Ambient light sensor module abstraction class.'''
+
+  _kind = Module.Kind.LIGHT
+  _label = 'Light'
+
+  def measure(self) -> int:
+    '''Returns the most recent illuminance in lux (None if
+    the read fails)'''
+    return self._read('light')[0]
+
+  async def ameasure(self) -> int:
+    '''Async counterpart of measure()'''
+    return await self._master.arun(self.measure)
+
+  def _read_indexes(self) -> dict:
+    return {
+      'light': self._variable(),
+    }
+
+
+class Joystick(Module):
+  '''Joystick module abstraction class.
+
+  The module reports both analog axes and the button with a
+  single variable, so all three are read together.
+
+  '''
+
+  _kind = Module.Kind.JOYSTICK
+  _label = 'Joystick'
+
+  def get_axes(self) -> Tuple[int, int]:
+    '''Returns the x and y axis readings (None if the read
+    fails)'''
+    x, y = self._read('x', 'y')
+    return None if x is None else (x, y)
+
+  async def aget_axes(self) -> Tuple[int, int]:
+    '''Async counterpart of get_axes()'''
+    return await self._master.arun(self.get_axes)
+
+  def is_pressed(self) -> bool:
+    '''Returns True while the joystick button is pressed
+    (None if the read fails)'''
+    return self._read('pressed')[0]
+
+  async def ais_pressed(self) -> bool:
+    '''Async counterpart of is_pressed()'''
+    return await self._master.arun(self.is_pressed)
+
+  def _read_indexes(self) -> dict:
+    index = self._variable()
+    return {
+      'x': index,
+      'y': index,
+      'pressed': index,
+    }
+
+  def _decode(self, quantity:str, value):
+    x, y, pressed = value
+    if quantity == 'x':
+      return x
+    elif quantity == 'y':
+      return y
+    return bool(pressed)
+
+
+class QRT(Module):
+  '''QTR reflectance sensor module abstraction class. The
+  module carries three sensors (left, middle and right)
+  which detect lines.'''
+
+  _kind = Module.Kind.QRT
+  _label = 'QTR'
+
+  def detect(self) -> Tuple[bool, bool, bool]:
+    '''Returns whether the left, middle and right sensors
+    detect a line (None if the read fails)'''
+    return self._read('lines')[0]
+
+  async def adetect(self) -> Tuple[bool, bool, bool]:
+    '''Async counterpart of detect()'''
+    return await self._master.arun(self.detect)
+
+  def _read_indexes(self) -> dict:
+    return {
+      'lines': self._variable(),
+    }
+
+  def _decode(self, quantity:str, value):
+    return tuple(bool(value >> n & 1) for n in range(3))
+
+
+class Potmeter(Module):
+  '''Potentiometer module abstraction class.'''
+
+  _kind = Module.Kind.POTMETER
+  _label = 'Pot'
+
+  def measure(self) -> int:
+    '''Returns the most recent ADC reading of the wiper in
+    the range [0, 255] (None if the read fails)'''
+    return self._read('value')[0]
+
+  async def ameasure(self) -> int:
+    '''Async counterpart of measure()'''
+    return await self._master.arun(self.measure)
+
+  def _read_indexes(self) -> dict:
+    return {
+      'value': self._variable(),
+    }
+
+
+class IMU(Module):
+  '''Inertial measurement unit module abstraction class.
+
+  The module reports the orientation as roll and pitch
+  angles in degrees with a single variable.
+
+  In streaming mode a background thread reads the
+  orientation as fast as the bus delivers (or at a given
+  rate) into a ring buffer, and consumers take the samples
+  from there instead of the bus:
+
+  stream = imu.start_stream(capacity=4096)
+  t, roll, pitch = stream.next()
+  times, rolls, pitches = stream.latest(100)
+
+  '''
+
+  _kind = Module.Kind.IMU
+  _label = 'IMU'
+  _stream = None
+
+  @property
+  def stream(self) -> ModuleStream:
+    '''Returns the running orientation stream or None'''
+    if self._stream is not None and self._stream.is_running:
+      return self._stream
+    return None
+
+  def start_stream(self, rate:float=None,
+                   capacity:int=STREAM_CAPACITY) -> ModuleStream:
+    '''Starts streaming the orientation into a ring buffer
+    of (timestamp, roll, pitch) samples (see ModuleStream)
+
+    Args:
+      rate: (float) Sampling rate in Hz, as fast as possible
+        by default
+      capacity: (int) Number of samples kept
+    Return:
+      The started stream
+    '''
+    self.stop_stream()
+    self._stream = ModuleStream(
+      self, ('roll', 'pitch'), rate=rate, capacity=capacity)
+    self._stream.start()
+    return self._stream
+
+  def stop_stream(self):
+    '''Stops the orientation stream. Its samples are kept in
+    its ring.'''
+    if self._stream is not None:
+      stream, self._stream = self._stream, None
+      stream.stop()
+
+  def get_orientation(self) -> Tuple[float, float]:
+    '''Returns the roll and pitch angles in degrees (None if
+    the read fails). While streaming the latest streamed
+    sample is returned without a bus transaction.'''
+    stream = self.stream
+    if stream is not None and stream.ring.count:
+      return stream.ring.latest()[1:]
+    roll, pitch = self._read('roll', 'pitch')
+    return None if roll is None else (roll, pitch)
+
+  async def aget_orientation(self) -> Tuple[float, float]:
+    '''Async counterpart of get_orientation()'''
+    return await self._master.arun(self.get_orientation)
+
+  def _read_indexes(self) -> dict:
+    index = self._variable()
+    return {
+      'roll': index,
+      'pitch': index,
+    }
+
+  def _decode(self, quantity:str, value):
+    roll, pitch = value
+    return roll if quantity == 'roll' else pitch
+
+
+Module.register_kind(Motor)
+Module.register_kind(Distance)
+Module.register_kind(Buzzer)
+Module.register_kind(Servo)
+Module.register_kind(RGB)
+Module.register_kind(Button)
+Module.register_kind(Light)
+Module.register_kind(Joystick)
+Module.register_kind(QRT)
+Module.register_kind(Potmeter)
+Module.register_kind(IMU)
@@ -0,0 +1,201 @@
+'''Replay of recorded telemetry logs
+
+'''
+
+from pathlib import Path
+from time import perf_counter
+from urllib.parse import parse_qs
+from .deferred import red
+from .master import Master, BAUDRATE
+from .simulation import SimulatedMaster, MOTOR_FEEDBACK
+from .telemetry import TelemetryLog
+
+
+__all__ = [
+  'ReplayMaster',
+]
+
+
+# Device path scheme of replay masters
+SCHEME = 'replay'
+
+# Marks variables which are not recorded in the log
+_MISSING = object()
+
+
+class ReplayMaster(SimulatedMaster):
+  '''A master serving reads from a recorded telemetry log.
+
+  The SMDs and modules found in the log for the recorded
+  master make up a simulated topology, so discovery works as
+  on the recording setup. Reads of recorded variables
+  (get_distance, get_operation_mode, get_variables and all
+  other reads built on get_variables) return the recorded
+  values and a recorded failed read fails again. Writes and
+  unrecorded variables are handled by the simulation.
+
+  The log is memory mapped and only the blocks around the
+  playback position are touched. Playback starts with the
+  first replayed read. At a speed of 1.0 the recorded values
+  follow the wall clock and other speeds scale it. A speed of
+  None serves the samples of each sensor variable (module
+  readings and motor feedback) one read after the other as
+  fast as they are read, while motor settings follow the
+  time of the latest sensor sample served.
+
+  Replay masters are created by Master.add() for device
+  paths of the form
+
+    replay:<log path>[?speed=<factor|max>][&master=<path>]
+
+  where master selects the recorded master in logs of
+  several masters.
+
+  '''
+
+  def __init__(self,
+               device_path:str,
+               baudrate:int=BAUDRATE,
+               name:str=None,
+               speed:float=1.0,
+               source:str=None):
+    '''Initializer for ReplayMaster
+
+    Parameters:
+    device_path: replay:<log path> with optional speed and
+                 master query parameters, which take
+                 precedence over the arguments
+    baudrate   : nominal serial baud rate in Hz
+    name       : (optional) unique name for Master, defaults
+                 to the log file name
+    speed      : playback speed factor or None for as fast
+                 as read
+    source     : (optional) device path of the recorded
+                 master, required if the log has several
+
+    Raises:
+    InvalidTelemetryLog: if the log can not be read
+    ValueError: if the recorded master is ambiguous
+    '''
+    log_path = device_path
+    if log_path.startswith(SCHEME + ':'):
+      log_path = log_path[len(SCHEME) + 1:]
+    log_path, _, query = log_path.partition('?')
+    options = parse_qs(query)
+    if 'speed' in options:
+      speed = options['speed'][-1]
+      speed = None if speed == 'max' else float(speed)
+    source = options.get('master', [source])[-1]
+    self._log = TelemetryLog(log_path)
+    sources = {c.master for c in self._log.channels}
+    if source is None:
+      if len(sources) > 1:
+        self._log.close()
+        raise ValueError(
+          'Log records several masters, select one of: {}'.format(
+            ', '.join(sorted(sources))))
+      source = next(iter(sources), None)
+    self._speed = speed
+    self._channels = dict()
+    topology = dict()
+    for channel in self._log.find(master=source):
+      labels = topology.setdefault(channel.smd_id, list())
+      if channel.index is None or not self._log.count(channel):
+        continue
+      self._channels[(channel.smd_id, channel.index)] = channel
+      if channel.index >= red.Index.Buzzer_1:
+        label = red.Index(channel.index).name
+        if label not in labels:
+          labels.append(label)
+    self._first = min(
+      (self._log.sample(c, 0)[0] for c in self._channels.values()),
+      default=0.0)
+    self._last = max(
+      (self._log.sample(c, self._log.count(c) - 1)[0]
+       for c in self._channels.values()), default=0.0)
+    self.rewind()
+    super().__init__(
+      device_path=device_path, topology=topology,
+      baudrate=baudrate, name=name or Path(log_path).stem)
+
+  @property
+  def log(self) -> TelemetryLog:
+    return self._log
+
+  @property
+  def speed(self) -> float:
+    '''Returns the playback speed (None for as fast as
+    read)'''
+    return self._speed
+  @speed.setter
+  def speed(self, value:float):
+    self._speed = value
+    self.rewind()
+
+  @property
+  def clock(self) -> float:
+    '''Returns the playback position as log time'''
+    if self._speed is None or self._origin is None:
+      return self._clock
+    return self._first + \
+      (perf_counter() - self._origin) * self._speed
+
+  @property
+  def finished(self) -> bool:
+    '''Returns True once the playback position has reached
+    the last recorded sample'''
+    return self.clock >= self._last
+
+  def rewind(self):
+    '''Restarts playback from the beginning of the log'''
+    self._origin = None
+    self._clock = self._first
+    self._cursors = dict()
+
+  def _replayed(self, smd_id:int, index:int):
+    '''Returns the recorded value of a variable at the
+    playback position, None for a recorded failed read and
+    _MISSING if the variable is not recorded (yet)'''
+    channel = self._channels.get((smd_id, index))
+    if channel is None:
+      return _MISSING
+    sensor = index in MOTOR_FEEDBACK or index >= red.Index.Buzzer_1
+    if self._speed is None and sensor:
+      n = self._cursors.get(channel.id, 0)
+      if n < self._log.count(channel):
+        self._cursors[channel.id] = n + 1
+      else:
+        n -= 1
+      t, value = self._log.sample(channel, n)
+      self._clock = max(self._clock, t)
+      return value
+    if self._origin is None and self._speed is not None:
+      self._origin = perf_counter()
+    t = self.clock
+    if t < self._log.sample(channel, 0)[0]:
+      return _MISSING
+    return self._log.value_at(channel, t)
+
+  def get_variables(self, id:int, index_list:list):
+    with self._bus:
+      values = super().get_variables(id, index_list)
+      if values is None:
+        return None
+      smd = self._smds[id]
+      for n, index in enumerate(index_list):
+        value = self._replayed(id, index)
+        if value is None:
+          return None
+        if value is not _MISSING:
+          if isinstance(smd.get(index), int):
+            value = round(value)
+          smd.set(index, value)
+          values[n] = smd.get(index)
+      return values
+
+  def shutdown(self):
+    super().shutdown()
+    self._log.close()
+
+
+Master.register_scheme(SCHEME, ReplayMaster)
@@ -0,0 +1,224 @@
+'''Fixed-rate feedback sampling of motor groups
+
+'''
+
+import math
+import threading
+from array import array
+from typing import Dict, List, Sequence
+from .module import Motor
+from .background import BackgroundTask
+from .scheduler import Scheduler
+from . import telemetry
+
+
+__all__ = [
+  'FeedbackSampler',
+]
+
+
+# Default sampling rate in Hz
+SAMPLE_RATE = 500.0
+
+# Motor quantities which can be sampled
+SAMPLED_QUANTITIES = ('current', 'velocity', 'position')
+
+
+class FeedbackSampler(BackgroundTask):
+  '''Samples feedback quantities of motors at a fixed rate
+  into preallocated arrays.
+
+  All requested quantities of a motor are read with a single
+  transaction per tick and the values are written straight
+  into flat arrays of doubles, so sampling does not allocate
+  per sample. Sampling runs on a Scheduler with one thread
+  per master.
+
+  Row n of the arrays holds the samples of tick n, i.e. of
+  time n / rate since the start, in motor order. Rows of
+  ticks skipped due to overruns and values of failed reads
+  are NaN. Sampling stops when the arrays are full.
+
+  '''
+
+  def __init__(self,
+               motors:Sequence[Motor],
+               quantities:Sequence[str]=('current',),
+               rate:float=SAMPLE_RATE,
+               samples:int=1000,
+               busy_wait:float=0.0):
+    '''Initializer for FeedbackSampler
+
+    Parameters:
+    motors    : motors to sample (e.g. a MotorGroup)
+    quantities: names of the sampled quantities ('current',
+                'velocity' and/or 'position')
+    rate      : sampling rate in Hz
+    samples   : number of rows of the arrays
+    busy_wait : see Scheduler
+
+    Raises:
+    ValueError: if a quantity can not be sampled
+    '''
+    for quantity in quantities:
+      if quantity not in SAMPLED_QUANTITIES:
+        raise ValueError(
+          'Cannot sample {!r}, choose from: {}'.format(
+            quantity, ', '.join(SAMPLED_QUANTITIES)))
+    self._motors = list(motors)
+    self._quantities = list(dict.fromkeys(quantities))
+    self._period = 1.0 / rate
+    self._samples = samples
+    width = len(self._motors)
+    self._times = array('d', [math.nan]) * samples
+    self._values = {
+      quantity: array('d', [math.nan]) * (samples * width)
+      for quantity in self._quantities}
+    self._scheduler = Scheduler(busy_wait)
+    self._rows = dict()
+    self._reads = dict()
+    self._lock = threading.Lock()
+    columns = dict()
+    for n, motor in enumerate(self._motors):
+      columns.setdefault(motor.master, list()).append(n)
+    self._columns = columns
+    for master in columns:
+      self._scheduler.add(
+        self._sampler(master), period=self._period,
+        name='sampler-{}'.format(master), master=master)
+
+  def __repr__(self):
+    return 'FeedbackSampler: {} motors, {}/{} samples @ {:g} Hz'.format(
+      len(self._motors), self.count, self._samples, self.rate)
+
+  @property
+  def rate(self) -> float:
+    return 1.0 / self._period
+
+  @property
+  def motors(self) -> List[Motor]:
+    return self._motors
+
+  @property
+  def quantities(self) -> List[str]:
+    return self._quantities
+
+  @property
+  def count(self) -> int:
+    '''Returns the number of rows sampled by all masters'''
+    return min(self._rows.values(), default=-1) + 1
+
+  @property
+  def full(self) -> bool:
+    return self.count >= self._samples
+
+  @property
+  def is_running(self) -> bool:
+    return self._scheduler.is_running
+
+  @property
+  def times(self) -> array:
+    '''Returns the sampling times of the rows in seconds
+    since the start'''
+    return self._times
+
+  def values(self, quantity:str) -> array:
+    '''Returns the samples of a quantity as a flat row-major
+    array with one column per motor (e.g. for
+    numpy.frombuffer(...).reshape(-1, len(motors)))'''
+    return self._values[quantity]
+
+  def column(self, quantity:str, motor:Motor) -> memoryview:
+    '''Returns a view of the samples of a quantity of a
+    motor'''
+    width = len(self._motors)
+    return memoryview(self._values[quantity])[
+      self._motors.index(motor)::width]
+
+  def latest(self, quantity:str) -> List[float]:
+    '''Returns the most recent row of samples of a quantity
+    completed for all motors (None before the first one)'''
+    n = self.count - 1
+    if n < 0:
+      return None
+    width = len(self._motors)
+    return self._values[quantity][n * width:(n + 1) * width].tolist()
+
+  def stats(self) -> Dict[str, dict]:
+    '''Returns the timing statistics of the sampling of each
+    master (see Scheduler.stats())'''
+    return self._scheduler.stats()
+
+  def _reads_of(self, columns:List[int]) -> list:
+    '''Returns the reads of the motors in the columns, with
+    their current SMD IDs and polarities'''
+    # One read per SMD: (smd_id, index_list, targets) where
+    # targets are (position in index_list, array, column,
+    # polarity, motor, quantity, index)
+    reads = dict()
+    for column in columns:
+      motor = self._motors[column]
+      indexes = motor._read_indexes()
+      index_list, targets = reads.setdefault(
+        motor._smd_id, (list(), list()))
+      for quantity in self._quantities:
+        index = indexes[quantity]
+        if index not in index_list:
+          index_list.append(index)
+        targets.append((
+          index_list.index(index), self._values[quantity], column,
+          motor._polarity.value, motor, quantity, index))
+    return [
+      (smd_id, index_list, targets)
+      for smd_id, (index_list, targets) in reads.items()]
+
+  def _sampler(self, master:'master.Master'):
+    width = len(self._motors)
+    last = self._samples - 1
+    times = self._times
+    nan = math.nan
+    def sample(t:float):
+      n = round(t / self._period)
+      if n > last:
+        self._finish(master)
+        return
+      offset = n * width
+      recorder = telemetry.RECORDER
+      for smd_id, index_list, targets in self._reads[master]:
+        values = master.fetch(
+          'read_variables', smd_id=smd_id, index_list=index_list)
+        for k, samples, column, polarity, motor, quantity, index \
+            in targets:
+          value = values[k]
+          samples[offset + column] = \
+            nan if value is None else polarity * value
+          if recorder is not None:
+            recorder.record(motor, quantity, index, value)
+      times[n] = t
+      self._rows[master] = n
+      if n == last:
+        self._finish(master)
+    return sample
+
+  def _finish(self, master:'master.Master'):
+    with self._lock:
+      self._rows[master] = self._samples - 1
+      if self.full:
+        self._scheduler.request_stop()
+
+  def _start_threads(self):
+    '''Clears the arrays and starts sampling'''
+    self._times[:] = array('d', [math.nan]) * self._samples
+    for values in self._values.values():
+      values[:] = array('d', [math.nan]) * len(values)
+    self._rows = {master: -1 for master in self._columns}
+    self._reads = {
+      master: self._reads_of(columns)
+      for master, columns in self._columns.items()}
+    self._scheduler.start()
+
+  def _wait_threads(self, timeout:float) -> bool:
+    return self._scheduler.wait(timeout)
+
+  def _stop_threads(self):
+    self._scheduler.stop()
@@ -0,0 +1,349 @@
+'''Fixed-rate scheduling of control loops
+
+'''
+
+import heapq
+import math
+import threading
+from time import perf_counter
+from typing import Callable, Dict, List
+
+
+__all__ = [
+  'SchedulerError',
+  'LoopStats',
+  'Loop',
+  'Scheduler',
+]
+
+
+class SchedulerError(Exception):
+
+  def __init__(self, loop, error):
+    super().__init__(
+      "Control loop {} failed: {!r}".format(loop, error))
+
+
+class LoopStats:
+  '''Running timing statistics of a control loop.
+
+  Latency is the delay of a tick start from its deadline,
+  jitter is the standard deviation of the latency and
+  execution is the duration of the callback. Statistics are
+  accumulated online, so memory use does not grow with the
+  number of ticks.
+
+  '''
+
+  def __init__(self):
+    self.reset()
+
+  def __repr__(self):
+    return ('LoopStats: ticks={} overruns={} skipped={} '
+            'latency={:.1f}us jitter={:.1f}us '
+            'execution={:.1f}us').format(
+              self.ticks, self.overruns, self.skipped,
+              self.mean_latency * 1e6, self.jitter * 1e6,
+              self.mean_execution * 1e6)
+
+  def reset(self):
+    '''Clears the statistics'''
+    self.ticks = 0
+    self.overruns = 0
+    self.skipped = 0
+    self.max_latency = 0.0
+    self.max_execution = 0.0
+    self._latency_sum = 0.0
+    self._latency_squares = 0.0
+    self._execution_sum = 0.0
+
+  def _add(self, latency:float, execution:float):
+    self.ticks += 1
+    self._latency_sum += latency
+    self._latency_squares += latency * latency
+    self._execution_sum += execution
+    self.max_latency = max(self.max_latency, latency)
+    self.max_execution = max(self.max_execution, execution)
+
+  @property
+  def mean_latency(self) -> float:
+    return self._latency_sum / self.ticks if self.ticks else 0.0
+
+  @property
+  def jitter(self) -> float:
+    if not self.ticks:
+      return 0.0
+    mean = self.mean_latency
+    return math.sqrt(max(
+      0.0, self._latency_squares / self.ticks - mean * mean))
+
+  @property
+  def mean_execution(self) -> float:
+    return self._execution_sum / self.ticks if self.ticks else 0.0
+
+  def as_dict(self) -> dict:
+    '''Returns the statistics in a dictionary'''
+    return {
+      'ticks': self.ticks,
+      'overruns': self.overruns,
+      'skipped': self.skipped,
+      'mean_latency': self.mean_latency,
+      'max_latency': self.max_latency,
+      'jitter': self.jitter,
+      'mean_execution': self.mean_execution,
+      'max_execution': self.max_execution,
+    }
+
+
+class Loop:
+  '''A callback run at a fixed rate by a Scheduler.
+
+  The callback receives the scheduled time of the tick in
+  seconds since the start of the scheduler. Deadlines are
+  absolute: the n-th tick is due at start + n * period
+  regardless of how long earlier ticks took.
+
+  '''
+
+  def __init__(self, callback:Callable[[float], None],
+               period:float, name:str,
+               master:'master.Master'=None,
+               on_overrun:Callable=None):
+    '''Initializer for Loop
+
+    Parameters:
+    callback  : callable(t) run each tick
+    period    : tick period in seconds
+    name      : name of the loop
+    master    : (optional) master whose bus the callback uses
+    on_overrun: (optional) callable(loop, lateness) called
+                when a tick ends after the next deadline
+    '''
+    if period <= 0.0:
+      raise ValueError(
+        'Loop period must be positive: {}'.format(period))
+    self.callback = callback
+    self.period = period
+    self.name = name
+    self.master = master
+    self.on_overrun = on_overrun
+    self.stats = LoopStats()
+    self._tick = 0
+
+  def __repr__(self):
+    return 'Loop: {} @ {:g} Hz'.format(self.name, self.rate)
+
+  def __str__(self):
+    return self.name
+
+  @property
+  def rate(self) -> float:
+    return 1.0 / self.period
+
+  def _deadline(self, start:float) -> float:
+    return start + self._tick * self.period
+
+  def _run_tick(self, start:float, clock:Callable[[], float]):
+    '''Runs the due tick and advances to the next deadline
+    in the future, counting the ticks skipped by an
+    overrun'''
+    deadline = self._deadline(start)
+    begin = clock()
+    self.callback(self._tick * self.period)
+    end = clock()
+    self.stats._add(begin - deadline, end - begin)
+    self._tick += 1
+    lateness = end - self._deadline(start)
+    if lateness > 0.0:
+      missed = int(lateness // self.period)
+      self.stats.overruns += 1
+      self.stats.skipped += missed
+      self._tick += missed
+      if self.on_overrun is not None:
+        self.on_overrun(self, lateness)
+
+
+class Scheduler:
+  '''Runs control loops at fixed rates.
+
+  Loops are grouped by their master and each group runs on
+  its own thread, so loops talking to different masters do
+  not delay each other while loops on the same master are
+  interleaved in deadline order. Loops without a master
+  share a group.
+
+  A thread sleeps until the earliest deadline of its group
+  and optionally busy waits the last busy_wait seconds for
+  a more accurate wake up.
+
+  Errors raised in a callback stop the scheduler and are
+  re-raised (wrapped in SchedulerError) by run() or stop().
+
+  '''
+
+  def __init__(self, busy_wait:float=0.0,
+               clock:Callable[[], float]=perf_counter,
+               sleep:Callable[[float], bool]=None):
+    '''Initializer for Scheduler
+
+    Parameters:
+    busy_wait: time in seconds before a deadline spent busy
+               waiting instead of sleeping
+    clock    : (optional) monotonic time source in seconds
+    sleep    : (optional) callable(seconds) sleeping for the
+               given time, returns True to stop the loops.
+               Defaults to waiting on the stop event
+    '''
+    self._busy_wait = busy_wait
+    self._clock = clock
+    self._sleep = sleep
+    self._loops = list()
+    self._stop = threading.Event()
+    self._threads = list()
+    self._error = None
+    self._start = None
+
+  def __repr__(self):
+    return 'Scheduler: [{}]'.format(
+      ', '.join(repr(loop) for loop in self._loops))
+
+  @property
+  def loops(self) -> List[Loop]:
+    return self._loops
+
+  @property
+  def is_running(self) -> bool:
+    return bool(self._threads)
+
+  def add(self, callback:Callable[[float], None],
+          rate:float=None, period:float=None,
+          name:str=None, master:'master.Master'=None,
+          on_overrun:Callable=None) -> Loop:
+    '''Adds a control loop
+
+    Parameters:
+    callback  : callable(t) run each tick with the scheduled
+                time in seconds since start
+    rate      : tick rate in Hz (or give period)
+    period    : tick period in seconds (or give rate)
+    name      : (optional) name of the loop
+    master    : (optional) master whose bus the callback uses
+    on_overrun: (optional) callable(loop, lateness)
+
+    Returns:
+    the added Loop
+    '''
+    if self.is_running:
+      raise RuntimeError('Cannot add loops to a running scheduler')
+    if (rate is None) == (period is None):
+      raise ValueError('Either rate or period must be given')
+    if period is None:
+      period = 1.0 / rate
+    if name is None:
+      name = getattr(callback, '__name__', 'loop{}'.format(
+        len(self._loops)))
+    loop = Loop(callback, period, name, master, on_overrun)
+    self._loops.append(loop)
+    return loop
+
+  def remove(self, loop:Loop):
+    '''Removes a control loop'''
+    if self.is_running:
+      raise RuntimeError(
+        'Cannot remove loops from a running scheduler')
+    self._loops.remove(loop)
+
+  def stats(self) -> Dict[str, dict]:
+    '''Returns the statistics of all loops by loop name'''
+    return {loop.name: loop.stats.as_dict() for loop in self._loops}
+
+  def _wait_until(self, deadline:float) -> bool:
+    '''Waits until the deadline. Returns False if stopped'''
+    sleep = self._stop.wait if self._sleep is None else self._sleep
+    remaining = deadline - self._clock() - self._busy_wait
+    if remaining > 0.0 and sleep(remaining):
+      return False
+    while self._clock() < deadline:
+      if self._stop.is_set():
+        return False
+    return not self._stop.is_set()
+
+  def _run_group(self, loops:List[Loop]):
+    start = self._start
+    queue = [(loop._deadline(start), n, loop)
+             for n, loop in enumerate(loops)]
+    heapq.heapify(queue)
+    try:
+      while self._wait_until(queue[0][0]):
+        _, n, loop = queue[0]
+        loop._run_tick(start, self._clock)
+        heapq.heapreplace(queue, (loop._deadline(start), n, loop))
+    except Exception as error:
+      self._error = SchedulerError(queue[0][2], error)
+      self._error.__cause__ = error
+      self._stop.set()
+
+  def start(self):
+    '''Starts running the loops on background threads'''
+    if self.is_running:
+      return
+    groups = dict()
+    for loop in self._loops:
+      loop._tick = 0
+      loop.stats.reset()
+      groups.setdefault(loop.master, list()).append(loop)
+    self._stop.clear()
+    self._error = None
+    self._start = self._clock()
+    self._threads = [
+      threading.Thread(
+        target=self._run_group, args=(loops,), daemon=True,
+        name='scheduler-{}'.format(
+          'local' if master is None else master.name))
+      for master, loops in groups.items()]
+    for thread in self._threads:
+      thread.start()
+
+  def stop(self):
+    '''Stops the loops and waits for the running ticks'''
+    self._stop.set()
+    for thread in self._threads:
+      thread.join()
+    self._threads = list()
+    if self._error is not None:
+      error, self._error = self._error, None
+      raise error
+
+  def request_stop(self):
+    '''Makes the loops stop after their running ticks
+    without waiting for them. Can be called from a loop
+    callback; stop() still has to be called to join the
+    threads.'''
+    self._stop.set()
+
+  def wait(self, timeout:float=None) -> bool:
+    '''Waits until the loops are asked to stop (by
+    request_stop(), stop() or an error)
+
+    Parameters:
+    timeout: (optional) maximum wait in seconds
+
+    Returns:
+    False if the timeout expired
+    '''
+    return self._stop.wait(timeout)
+
+  def run(self, duration:float=None):
+    '''Runs the loops for the given duration (or until
+    KeyboardInterrupt or an error) and stops them
+
+    Parameters:
+    duration: (optional) run time in seconds
+    '''
+    self.start()
+    try:
+      self._stop.wait(duration)
+    except KeyboardInterrupt:
+      pass
+    finally:
+      self.stop()
@@ -0,0 +1,386 @@
+'''Simulated communication master
+
+'''
+
+import random
+import struct
+import threading
+from time import sleep, monotonic
+from typing import Dict, List, Callable
+from .deferred import red
+from .master import Master, BAUDRATE, FRAME_OVERHEAD, VARIABLE_SIZES
+
+
+__all__ = [
+  'SimulatedSMD',
+  'SimulatedMaster',
+]
+
+
+# Hardware and firmware versions reported by simulated SMDs
+HARDWARE_VERSION = (2, 2, 0)
+SOFTWARE_VERSION = (1, 0, 1)
+
+# Output shaft speed at 12V of simulated motors in RPM
+SHAFT_RPM = 100.0
+
+# Output shaft counts per revolution of simulated motors
+SHAFT_CPR = 6533.0
+
+# Motor feedback variables which are not provided by sensor,
+# filled when smd.red is loaded
+MOTOR_FEEDBACK = set()
+red.on_load(lambda module: MOTOR_FEEDBACK.update({
+  module.Index.PresentPosition,
+  module.Index.PresentVelocity,
+  module.Index.MotorCurrent,
+}))
+
+
+def _version(major:int, minor:int, build:int) -> int:
+  return struct.unpack('>I', bytes([0, major, minor, build]))[0]
+
+
+class SimulatedSMD:
+  '''Variable table and motor model of a simulated SMD.
+
+  Variables are stored in a red.Red instance so that values
+  are converted to the variable types of the real protocol.
+  The motor model is kinematic: the output shaft follows
+  the duty cycle, velocity or position set point instantly
+  and the motor current follows the torque set point.
+
+  '''
+
+  def __init__(self, smd_id:int, module_labels:List[str]=None,
+               baudrate:int=BAUDRATE):
+    '''Initializer for SimulatedSMD
+
+    Parameters:
+    smd_id: ID of the SMD
+    module_labels: labels of the attached modules as
+                   reported by module scan (e.g. Distance_1)
+    baudrate: serial baud rate the SMD listens at in Hz
+    '''
+    self.smd_id = smd_id
+    self.module_labels = list(module_labels or [])
+    self.baudrate = baudrate
+    self.driver = red.Red(smd_id)
+    self._position = 0.0
+    self._time = monotonic()
+    for index, value in [
+        (red.Index.HardwareVersion, _version(*HARDWARE_VERSION)),
+        (red.Index.SoftwareVersion, _version(*SOFTWARE_VERSION)),
+        (red.Index.Baudrate, baudrate),
+        (red.Index.OutputShaftCPR, SHAFT_CPR),
+        (red.Index.OutputShaftRPM, SHAFT_RPM),
+        (red.Index.TorqueLimit, 65535),
+        (red.Index.VelocityLimit, 65535),
+        (red.Index.MinimumPositionLimit, -2**31),
+        (red.Index.MaximumPositionLimit, 2**31 - 1)]:
+      self.set(index, value)
+    for variable in self.driver.vars:
+      if len(variable.type()) > 1:
+        # Multi-field module variables (joystick, IMU)
+        variable.value([0] * len(variable.type()))
+
+  def get(self, index:int):
+    return self.driver.vars[index].value()
+
+  def set(self, index:int, value):
+    self.driver.vars[index].value(value)
+
+  def advance(self):
+    '''Advances the motor model to the current time'''
+    now = monotonic()
+    dt, self._time = now - self._time, now
+    mode = self.get(red.Index.OperationMode)
+    velocity, current = 0.0, 0.0
+    if self.get(red.Index.TorqueEnable):
+      if mode == red.OperationMode.PWM:
+        velocity = self.get(red.Index.SetDutyCycle) / 100.0 * \
+          self.get(red.Index.OutputShaftRPM)
+      elif mode == red.OperationMode.Velocity:
+        limit = self.get(red.Index.VelocityLimit)
+        velocity = max(-limit, min(
+          self.get(red.Index.SetVelocity), limit))
+      elif mode == red.OperationMode.Position:
+        self._position = self.get(red.Index.SetPosition)
+      elif mode == red.OperationMode.Torque:
+        current = self.get(red.Index.SetTorque)
+    self._position += \
+      velocity / 60.0 * self.get(red.Index.OutputShaftCPR) * dt
+    self.set(red.Index.PresentVelocity, velocity)
+    self.set(red.Index.PresentPosition, self._position)
+    self.set(red.Index.MotorCurrent, current)
+
+
+class SimulatedMaster(Master):
+  '''In-process stand-in for a serial master.
+
+  Implements the red.Master primitives (scan, ping, module
+  scan, variable reads and writes, synchronized writes and
+  the like) against simulated SMDs. All higher level
+  red.Master calls built on these primitives (set_duty_cycle,
+  get_operation_mode, get_distance, enable_torque, ...) work
+  unchanged.
+
+  Every transaction takes the configured latency plus a
+  random jitter while holding the bus, and a response is
+  dropped with the configured probability. Transaction and
+  byte counters allow measuring bus traffic.
+
+  SMDs only hear the master while both use the same baud
+  rate. A rebooted SMD switches to the baud rate stored in
+  its Baudrate variable. Above the baudrate_limit of the bus
+  a frame is corrupted with probability 1 - limit / rate.
+
+  '''
+
+  def __init__(self,
+               device_path:str,
+               topology:Dict[int, List[str]]=None,
+               baudrate:int=BAUDRATE,
+               name:str=None,
+               latency:float=0.0,
+               jitter:float=0.0,
+               drop_rate:float=0.0,
+               timeout:float=0.0,
+               sensor:Callable=None,
+               seed:int=None,
+               baudrate_limit:int=None,
+               wire_time:bool=False):
+    '''Initializer for SimulatedMaster
+
+    Parameters:
+    device_path: unique label standing for the device path
+    topology : SMD IDs mapped to the labels of their attached
+               modules, e.g. {0: ['Distance_1'], 1: []}
+    baudrate : nominal serial baud rate in Hz
+    name     : (optional) unique name for Master
+    latency  : duration of a transaction in seconds
+    jitter   : maximum random extra duration of a transaction
+               in seconds
+    drop_rate: probability of a dropped response
+    timeout  : time waited for an absent SMD in seconds
+    sensor   : (optional) callable(smd_id, index) returning
+               the value of a module variable when it is
+               read. By default the stored value is returned.
+    seed     : (optional) random generator seed
+    baudrate_limit: (optional) highest reliable baud rate of
+               the bus in Hz
+    wire_time: if True transactions also take the time their
+               frames need on the wire at the baud rate
+    '''
+    self._smds = {
+      smd_id: SimulatedSMD(smd_id, module_labels, baudrate)
+      for smd_id, module_labels in (topology or {}).items()}
+    self.latency = latency
+    self.jitter = jitter
+    self.drop_rate = drop_rate
+    self.timeout = timeout
+    self.sensor = sensor
+    self.baudrate_limit = baudrate_limit
+    self.wire_time = wire_time
+    self._random = random.Random(seed)
+    self._bus = threading.RLock()
+    self._attached = set()
+    self.transactions = 0
+    self.dropped = 0
+    self.bytes_written = 0
+    self.bytes_read = 0
+    super().__init__(
+      device_path=device_path, baudrate=baudrate, name=name)
+
+  def _open(self, baudrate:int):
+    self._Master__baudrate = baudrate
+    self._Master__post_sleep = 0.0
+    self._Master__driver_list = [red.Red(255)] * 256
+
+  @property
+  def is_open(self) -> bool:
+    return True
+
+  def open(self):
+    pass
+
+  @property
+  def smds(self) -> Dict[int, SimulatedSMD]:
+    '''Returns the simulated SMDs by ID'''
+    return self._smds
+
+  def _transaction(self, smd_id:int,
+                   written:int, read:int=0) -> SimulatedSMD:
+    '''Accounts a transaction and waits for its duration.
+
+    Returns:
+    the addressed SMD or None if it is absent or its
+    response is dropped
+    '''
+    self.transactions += 1
+    self.bytes_written += written
+    baudrate = self._Master__baudrate
+    delay = self.latency
+    if self.jitter:
+      delay += self._random.uniform(0.0, self.jitter)
+    if self.wire_time:
+      delay += (written + read) * 10.0 / baudrate
+    if delay:
+      sleep(delay)
+    smd = self._smds.get(smd_id)
+    if smd is not None and (
+        smd.baudrate != baudrate or (
+          self.baudrate_limit and baudrate > self.baudrate_limit and
+          self._random.random() > self.baudrate_limit / baudrate)):
+      smd = None
+    if smd is None:
+      if read and self.timeout:
+        sleep(self.timeout)
+      return None
+    if read and self.drop_rate and \
+       self._random.random() < self.drop_rate:
+      self.dropped += 1
+      if self.timeout:
+        sleep(self.timeout)
+      return None
+    self.bytes_read += read
+    smd.advance()
+    return smd
+
+  def _check_attached(self, id:int):
+    if (id < 0) or (id > 254):
+      raise ValueError("{} is not a valid ID!".format(id))
+    if id not in self._attached:
+      raise ValueError("{} is not an attached ID!".format(id))
+
+  def attach(self, driver:'red.Red'):
+    self._attached.add(driver.vars[red.Index.DeviceID].value())
+
+  def detach(self, id:int):
+    self._attached.discard(id)
+
+  def attached(self):
+    return sorted(self._attached)
+
+  def ping(self, id:int) -> bool:
+    with self._bus:
+      return self._transaction(
+        id, FRAME_OVERHEAD, FRAME_OVERHEAD) is not None
+
+  def scan(self) -> list:
+    connected = list()
+    for id in range(255):
+      self.attach(red.Red(id))
+      if self.ping(id):
+        connected.append(id)
+      else:
+        self.detach(id)
+    return connected
+
+  def scan_modules(self, id:int) -> list:
+    with self._bus:
+      smd = self._transaction(
+        id, 2 * FRAME_OVERHEAD, FRAME_OVERHEAD + 8)
+      if smd is None:
+        return None
+      return list(smd.module_labels)
+
+  def set_variables(self, id:int, idx_val_pairs=[], ack=False):
+    self._check_attached(id)
+    if len(idx_val_pairs) == 0:
+      raise IndexError("Given id, value pair list is empty!")
+    with self._bus:
+      size = sum(VARIABLE_SIZES[index] for index, _ in idx_val_pairs)
+      smd = self._transaction(
+        id, FRAME_OVERHEAD + size,
+        FRAME_OVERHEAD + size if ack else 0)
+      if smd is None:
+        return None
+      for index, value in idx_val_pairs:
+        smd.set(index, value)
+      if ack:
+        return [smd.get(index) for index, _ in idx_val_pairs]
+      return None
+
+  def get_variables(self, id:int, index_list:list):
+    self._check_attached(id)
+    if len(index_list) == 0:
+      raise IndexError("Given index list is empty!")
+    with self._bus:
+      size = sum(VARIABLE_SIZES[index] for index in index_list)
+      smd = self._transaction(
+        id, FRAME_OVERHEAD + len(index_list),
+        FRAME_OVERHEAD + size)
+      if smd is None:
+        return None
+      if self.sensor is not None:
+        for index in index_list:
+          if index >= red.Index.Buzzer_1 and \
+             index not in MOTOR_FEEDBACK:
+            value = self.sensor(id, index)
+            if value is not None:
+              smd.set(index, value)
+      return [smd.get(index) for index in index_list]
+
+  def set_variables_sync(self, index:int, id_val_pairs=[]):
+    with self._bus:
+      size = 1 + len(id_val_pairs) * VARIABLE_SIZES[index]
+      self._transaction(
+        red.Master._BROADCAST_ID, FRAME_OVERHEAD + size)
+      for id, value in id_val_pairs:
+        smd = self._smds.get(id)
+        if smd is not None and smd.baudrate == self._Master__baudrate:
+          smd.advance()
+          smd.set(index, value)
+
+  def reboot(self, id:int):
+    with self._bus:
+      smd = self._transaction(id, FRAME_OVERHEAD)
+      if smd is not None:
+        smd.baudrate = smd.get(red.Index.Baudrate)
+
+  def factory_reset(self, id:int):
+    with self._bus:
+      self._transaction(id, FRAME_OVERHEAD)
+
+  def eeprom_write(self, id:int, ack=False):
+    with self._bus:
+      smd = self._transaction(
+        id, FRAME_OVERHEAD, FRAME_OVERHEAD if ack else 0)
+    if ack:
+      return smd is not None
+    return None
+
+  def reset_encoder(self, id:int):
+    with self._bus:
+      smd = self._transaction(id, FRAME_OVERHEAD)
+      if smd is not None:
+        smd._position = 0.0
+        smd.set(red.Index.PresentPosition, 0.0)
+
+  def update_driver_id(self, id:int, id_new:int):
+    if (id < 0) or (id > 254):
+      raise ValueError("{} is not a valid ID!".format(id))
+    if (id_new < 0) or (id_new > 254):
+      raise ValueError("{} is not a valid ID argument!".format(id_new))
+    with self._bus:
+      smd = self._transaction(id, FRAME_OVERHEAD + 2)
+      if smd is not None:
+        del self._smds[id]
+        smd.smd_id = id_new
+        smd.set(red.Index.DeviceID, id_new)
+        self._smds[id_new] = smd
+
+  def update_master_baudrate(self, br:int):
+    if (br < 3053) or (br > 12500000):
+      raise ValueError(f"{br} is not in acceptable range!")
+    self._Master__baudrate = br
+
+  def update_fw_version(self, id:int, version=''):
+    raise NotImplementedError(
+      'Firmware update is not simulated')
+
+  def enter_bootloader(self, id:int):
+    raise NotImplementedError(
+      'Bootloader is not simulated')
+
@@ -0,0 +1,325 @@
+'''Background streaming of module readings into ring buffers
+
+'''
+
+import math
+import threading
+from array import array
+from time import monotonic
+from typing import Sequence, Tuple
+from .background import BackgroundTask
+
+
+__all__ = [
+  'StreamError',
+  'SampleRing',
+  'ModuleStream',
+]
+
+
+# Default number of samples kept by a stream
+STREAM_CAPACITY = 1024
+
+
+class StreamError(Exception):
+
+  def __init__(self, stream, error):
+    super().__init__(
+      "Stream {} failed: {!r}".format(stream, error))
+
+
+class SampleRing:
+  '''Fixed-size ring buffer of timestamped samples.
+
+  Each field (and the timestamps) is stored in a flat array
+  of doubles twice the capacity long and every sample is
+  written to both halves, so the latest n samples are always
+  a contiguous slice. views() hands them out as memoryviews
+  without copying. A view keeps showing the ring, so its
+  contents are overwritten once capacity - n newer samples
+  are appended; copy it (e.g. view.tolist()) to keep it.
+
+  The ring has a single writer. Readers do not lock it and
+  can wait for new samples with wait().
+
+  '''
+
+  def __init__(self, fields:Sequence[str],
+               capacity:int=STREAM_CAPACITY):
+    '''Initializer for SampleRing
+
+    Parameters:
+    fields  : names of the sample fields
+    capacity: number of samples kept
+    '''
+    if capacity < 1:
+      raise ValueError(
+        'Ring capacity must be positive: {}'.format(capacity))
+    self._fields = list(fields)
+    self._capacity = capacity
+    self._times = array('d', [math.nan]) * (2 * capacity)
+    self._values = {
+      field: array('d', [math.nan]) * (2 * capacity)
+      for field in self._fields}
+    self._columns = [self._values[field] for field in self._fields]
+    self._count = 0
+    self._closed = False
+    self._condition = threading.Condition()
+
+  def __repr__(self):
+    return 'SampleRing: [{}] {}/{} samples'.format(
+      ', '.join(self._fields), len(self), self._capacity)
+
+  def __len__(self):
+    '''Returns the number of samples held'''
+    return min(self._count, self._capacity)
+
+  @property
+  def fields(self) -> list[str]:
+    return self._fields
+
+  @property
+  def capacity(self) -> int:
+    return self._capacity
+
+  @property
+  def count(self) -> int:
+    '''Returns the number of samples appended since the ring
+    was cleared'''
+    return self._count
+
+  def append(self, timestamp:float, values:Sequence[float]):
+    '''Appends a sample and wakes the waiting readers
+
+    Parameters:
+    timestamp: time of the sample in seconds
+    values   : values of the fields in field order, None is
+               stored as NaN
+    '''
+    n = self._count % self._capacity
+    m = n + self._capacity
+    self._times[n] = self._times[m] = timestamp
+    for column, value in zip(self._columns, values):
+      column[n] = column[m] = math.nan if value is None else value
+    with self._condition:
+      self._count += 1
+      self._condition.notify_all()
+
+  def _window(self, n:int) -> Tuple[int, int]:
+    '''Returns the slice bounds of the latest n samples'''
+    held = len(self)
+    n = held if n is None else min(n, held)
+    end = self._count % self._capacity + self._capacity
+    return end - n, end
+
+  def times(self, n:int=None) -> memoryview:
+    '''Returns a view of the timestamps of the latest n
+    samples (all held by default), oldest first'''
+    start, end = self._window(n)
+    return memoryview(self._times)[start:end]
+
+  def view(self, field:str, n:int=None) -> memoryview:
+    '''Returns a view of a field of the latest n samples (all
+    held by default), oldest first'''
+    start, end = self._window(n)
+    return memoryview(self._values[field])[start:end]
+
+  def views(self, n:int=None) -> Tuple[memoryview, ...]:
+    '''Returns views of the timestamps and of each field of
+    the latest n samples (all held by default), oldest
+    first'''
+    start, end = self._window(n)
+    return tuple(
+      memoryview(column)[start:end]
+      for column in [self._times] + self._columns)
+
+  def latest(self) -> tuple:
+    '''Returns the latest sample as (timestamp, *values) or
+    None if the ring is empty'''
+    if not self._count:
+      return None
+    n = (self._count - 1) % self._capacity
+    return (self._times[n],) + tuple(
+      column[n] for column in self._columns)
+
+  def wait(self, count:int, timeout:float=None) -> int:
+    '''Waits until more than count samples are appended or
+    the ring is closed
+
+    Parameters:
+    count  : sample count already seen by the reader
+    timeout: (optional) maximum wait in seconds
+
+    Returns:
+    the sample count when the wait ended
+    '''
+    with self._condition:
+      self._condition.wait_for(
+        lambda: self._count > count or self._closed, timeout)
+      return self._count
+
+  def close(self):
+    '''Wakes the waiting readers for good'''
+    with self._condition:
+      self._closed = True
+      self._condition.notify_all()
+
+  def clear(self):
+    '''Empties and reopens the ring'''
+    with self._condition:
+      self._count = 0
+      self._closed = False
+
+
+class ModuleStream(BackgroundTask):
+  '''Reads quantities of a module on a background thread and
+  appends them to a SampleRing.
+
+  Each sample is a single read transaction of the quantities
+  (see Module._read_indexes()) timestamped with monotonic()
+  on arrival, like group Snapshots. Without a rate the
+  module is read back to back, i.e. as fast as the bus
+  delivers. Failed reads are counted and not appended.
+
+  Errors raised on the thread stop the stream and are
+  re-raised (wrapped in StreamError) by stop().
+
+  '''
+
+  def __init__(self, module:'module.Module',
+               quantities:Sequence[str],
+               rate:float=None,
+               capacity:int=STREAM_CAPACITY):
+    '''Initializer for ModuleStream
+
+    Parameters:
+    module    : module to read
+    quantities: names of the streamed quantities
+    rate      : (optional) sampling rate in Hz, as fast as
+                possible by default
+    capacity  : number of samples kept in the ring
+
+    Raises:
+    ValueError: if the module does not provide a quantity
+    '''
+    indexes = module._read_indexes()
+    for quantity in quantities:
+      if quantity not in indexes:
+        raise ValueError(
+          'Cannot stream {!r} of {}, choose from: {}'.format(
+            quantity, module, ', '.join(indexes)))
+    self._module = module
+    self._quantities = tuple(quantities)
+    self._period = 1.0 / rate if rate else 0.0
+    self._ring = SampleRing(self._quantities, capacity)
+    self._stop = threading.Event()
+    self._thread = None
+    self._error = None
+    self._started = None
+    self._stopped = None
+    self.reads = 0
+    self.errors = 0
+
+  def __repr__(self):
+    return 'ModuleStream: {} [{}]'.format(
+      self._module, ', '.join(self._quantities))
+
+  @property
+  def module(self) -> 'module.Module':
+    return self._module
+
+  @property
+  def ring(self) -> SampleRing:
+    return self._ring
+
+  @property
+  def is_running(self) -> bool:
+    return self._thread is not None and not self._stop.is_set()
+
+  @property
+  def sample_rate(self) -> float:
+    '''Returns the achieved rate of samples of the last run
+    in Hz'''
+    if self._started is None:
+      return 0.0
+    elapsed = (self._stopped or monotonic()) - self._started
+    return self._ring.count / elapsed if elapsed > 0.0 else 0.0
+
+  def _run(self):
+    read = self._module._read
+    quantities = self._quantities
+    ring = self._ring
+    period = self._period
+    due = monotonic()
+    try:
+      while not self._stop.is_set():
+        values = read(*quantities)
+        self.reads += 1
+        if None in values:
+          self.errors += 1
+        else:
+          ring.append(monotonic(), values)
+        if period:
+          due += period
+          now = monotonic()
+          if now > due:
+            # Skip the ticks missed by a slow read
+            due += ((now - due) // period + 1) * period
+          if self._stop.wait(due - now):
+            break
+    except Exception as error:
+      self._error = StreamError(self, error)
+      self._error.__cause__ = error
+      self._stop.set()
+    finally:
+      ring.close()
+
+  def _start_threads(self):
+    '''Clears the ring and starts streaming'''
+    if self._thread is not None:
+      # Join the thread of a failed run and raise its error
+      self._stop_threads()
+    self._ring.clear()
+    self._stop.clear()
+    self._error = None
+    self.reads = self.errors = 0
+    self._started = monotonic()
+    self._stopped = None
+    self._thread = threading.Thread(
+      target=self._run, daemon=True,
+      name='{}-stream'.format(self._module.name))
+    self._thread.start()
+
+  def _wait_threads(self, timeout:float) -> bool:
+    return self._stop.wait(timeout)
+
+  def _stop_threads(self):
+    '''Stops streaming. The samples in the ring are kept.'''
+    self._stop.set()
+    if self._thread is not None:
+      self._thread.join()
+      self._thread = None
+      self._stopped = monotonic()
+    if self._error is not None:
+      error, self._error = self._error, None
+      raise error
+
+  def next(self, timeout:float=None) -> tuple:
+    '''Waits for a sample appended after the call
+
+    Parameters:
+    timeout: (optional) maximum wait in seconds
+
+    Returns:
+    the latest sample as (timestamp, *values) or None if the
+    timeout expired or the stream stopped
+    '''
+    count = self._ring.count
+    if self._ring.wait(count, timeout) > count:
+      return self._ring.latest()
+    return None
+
+  def latest(self, n:int=None) -> Tuple[memoryview, ...]:
+    '''Returns views of the timestamps and values of the
+    latest n samples (see SampleRing.views())'''
+    return self._ring.views(n)
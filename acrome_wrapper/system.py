@@ -2,20 +2,37 @@
 
 '''
 
-from .module import Module
-from .master import Master
+import json
+import asyncio
+import hashlib
+from typing import Union, List
+from concurrent.futures import ThreadPoolExecutor, Future
+from .module import Module, UnknownModuleKind, MODULE_KINDS
+from .master import Master, MASTER_PATHS, MASTER_NAMES
 
 
 __all__ = [
   'MissingPhysicalModule',
+  'InvalidLayoutFile',
   'discover',
+  'adiscover',
   'layout',
+  'save_layout',
+  'load_layout',
   'validate',
   'setup',
   'clear',
 ]
 
 
+# Version of the saved layout file format
+LAYOUT_VERSION = 2
+
+# Layout file versions load_layout() accepts. Version 1
+# files have no topology hashes.
+LAYOUT_VERSIONS = (1, 2)
+
+
 
 class MissingPhysicalModule(Exception):
 
@@ -24,12 +41,56 @@ class MissingPhysicalModule(Exception):
       "Missing physical modules: {}".format(
         ', '.join([m.name for m in hashes.values()])))
 
+class InvalidLayoutFile(Exception):
+
+  def __init__(self, path, reason):
+    super().__init__(
+      "Invalid layout file {}: {}".format(path, reason))
+
+
+
+def discover(concurrent:bool=False):
+  '''Discovers all modules attached to the masters in the
+  system
 
+  Parameters:
+  concurrent: if True every master bus is scanned by its
+              own worker thread so that the total time is
+              that of the slowest bus. The scan results are
+              merged into the module registry on the calling
+              thread in master order, hence the module names
+              are the same as in a serial discovery.
 
-def discover():
+  Raises:
+  NoMasterSetup: if no master is setup
+  '''
   Module.clear()
-  for master in Master.all():
-    master.discover()
+  masters = Master.all()
+  if not concurrent:
+    for master in masters:
+      master.discover()
+    return
+  with ThreadPoolExecutor(max_workers=len(masters)) as executor:
+    topologies = list(executor.map(
+      lambda master: master.scan_topology(), masters))
+  for master, topology in zip(masters, topologies):
+    master.populate(topology)
+
+
+async def adiscover():
+  '''Async counterpart of discover(). All master buses are
+  scanned concurrently off the event loop and the results
+  are merged into the module registry in master order.
+
+  Raises:
+  NoMasterSetup: if no master is setup
+  '''
+  Module.clear()
+  masters = Master.all()
+  topologies = await asyncio.gather(
+    *[master.ascan_topology() for master in masters])
+  for master, topology in zip(masters, topologies):
+    master.populate(topology)
 
         
 def layout(prefix:str=''):
@@ -37,24 +98,257 @@ def layout(prefix:str=''):
     master.layout(prefix=prefix)
     
 
-def validate():
-  '''Validates manually setup module system'''
-  hashes = {m.hash: m for m in Module.all()}
-  def remove_hash(master, smd_id, kind, mod_id=None):
-    hash = "{}:{}:{}:{}".format(
-      master.device_path, smd_id, kind, mod_id or '-')
+def _topology_hash(modules) -> str:
+  '''Returns a digest of the (kind, mod_id) pairs of the
+  non-motor modules of an SMD'''
+  pairs = sorted(
+    '{}:{}'.format(kind.value, mod_id) for kind, mod_id in modules)
+  return hashlib.sha1(','.join(pairs).encode()).hexdigest()[:16]
+
+
+def _reported_modules(module_labels:List[str]) -> list:
+  '''Returns the (kind, mod_id) pairs of the module labels
+  reported by an SMD, skipping the unsupported ones'''
+  modules = list()
+  for module_label in module_labels:
     try:
-      hashes.pop(hash)
-    except KeyError:
-      pass
-  for master in Master.all():
-    for smd_id in master.scan():
-      remove_hash(master, smd_id, 'Motor')
-      module_labels = \
-        master.scan_modules(smd_id) or []
-      for module_label in module_labels:
-        kind, mod_id = module_label.split('_')
-        remove_hash(master, smd_id, kind, mod_id)
+      modules.append(Module.parse_label(module_label))
+    except (UnknownModuleKind, ValueError):
+      continue
+  return modules
+
+
+def save_layout(path:str):
+  '''Saves the current system layout (masters and modules)
+  into a JSON file which can be loaded back with
+  load_layout() without scanning the buses.
+
+  For every SMD whose modules were scanned (by discovery or
+  validation) the file also records the topology hash of
+  the modules the SMD reported, see load_layout().
+
+  Parameters:
+  path: path of the layout file to be written
+  '''
+  masters = [
+    {'name': master.name,
+     'device_path': master.device_path,
+     'baudrate': master.baudrate}
+    for master in Master.all()]
+  modules = [
+    {'master': module.master.device_path,
+     'smd_id': module._smd_id,
+     'kind': module.kind.value,
+     'mod_id': module._mod_id,
+     'name': module.name}
+    for module in Module.all()]
+  smds = list()
+  for master, smd_id in dict.fromkeys(
+      (module.master, module._smd_id) for module in Module.all()):
+    module_labels = master.topology.get(smd_id)
+    if module_labels is not None:
+      smds.append(
+        {'master': master.device_path,
+         'smd_id': smd_id,
+         'hash': _topology_hash(_reported_modules(module_labels))})
+  with open(path, 'w') as layout_file:
+    json.dump(
+      {'version': LAYOUT_VERSION,
+       'masters': masters,
+       'modules': modules,
+       'smds': smds},
+      layout_file, indent=2)
+
+
+def _parse_layout(path:str, content:dict) -> tuple:
+  '''Checks the whole content of a layout file and returns
+  the master, module and SMD topology hash entries with
+  module kinds resolved
+
+  Raises:
+  InvalidLayoutFile: if the content cannot be used
+  '''
+  if not isinstance(content, dict):
+    raise InvalidLayoutFile(path, 'not a layout object')
+  if content.get('version') not in LAYOUT_VERSIONS:
+    raise InvalidLayoutFile(
+      path, 'unsupported version {}'.format(
+        content.get('version')))
+  try:
+    masters = [
+      (str(spec['device_path']), int(spec['baudrate']),
+       None if spec['name'] is None else str(spec['name']))
+      for spec in content['masters']]
+    modules = [
+      (spec['master'], int(spec['smd_id']),
+       Module.Kind.member(spec['kind']),
+       None if spec['mod_id'] is None else int(spec['mod_id']),
+       spec['name'])
+      for spec in content['modules']]
+    hashes = {
+      (spec['master'], int(spec['smd_id'])): str(spec['hash'])
+      for spec in content.get('smds', [])}
+  except (KeyError, TypeError, ValueError) as error:
+    raise InvalidLayoutFile(
+      path, 'malformed entry ({!r})'.format(error)) from error
+  device_paths = set()
+  for device_path, _, name in masters:
+    if device_path in device_paths:
+      raise InvalidLayoutFile(
+        path, 'duplicate master {}'.format(device_path))
+    device_paths.add(device_path)
+    master = MASTER_NAMES.get(name)
+    if master is not None and master.device_path != device_path:
+      raise InvalidLayoutFile(
+        path, 'master name {} is bound to {}'.format(
+          name, master.device_path))
+  names = set()
+  for device_path, _, kind, _, name in modules:
+    if device_path not in device_paths:
+      raise InvalidLayoutFile(
+        path, 'unknown master {}'.format(device_path))
+    if kind not in MODULE_KINDS:
+      raise InvalidLayoutFile(
+        path, 'unsupported module kind {}'.format(kind.value))
+    if name is not None and name in names:
+      raise InvalidLayoutFile(
+        path, 'duplicate module name {}'.format(name))
+    names.add(name)
+  return masters, modules, hashes
+
+
+def load_layout(path:str, verify:bool=False) -> Future:
+  '''Rebuilds the system layout from a file written by
+  save_layout() without any bus traffic.
+
+  The whole file is checked before the registries are
+  touched, so an invalid file leaves the system as it was.
+  Masters already bound to a saved device path are reused,
+  the others are created lazily and open their serial ports
+  on first I/O. All existing modules are cleared before the
+  saved modules are added.
+
+  An SMD whose saved topology hash matches the loaded
+  modules on it is known to have reported exactly these
+  modules, so validation only pings it. The modules of SMDs
+  with a missing or mismatched hash are scanned again.
+
+  Parameters:
+  path  : path of the layout file
+  verify: if True the loaded layout is validated against
+          the hardware on a background thread. Its bus
+          transactions are serialized with the ones of the
+          caller by the master transaction locks.
+
+  Returns:
+  Future of the background validation if verify is set
+  (its result() raises MissingPhysicalModule on mismatch),
+  otherwise None
+
+  Raises:
+  InvalidLayoutFile: if the file content cannot be used
+  '''
+  with open(path) as layout_file:
+    try:
+      content = json.load(layout_file)
+    except ValueError as error:
+      raise InvalidLayoutFile(path, str(error)) from error
+  master_specs, module_specs, hashes = _parse_layout(path, content)
+  masters = dict()
+  for device_path, baudrate, name in master_specs:
+    master = MASTER_PATHS.get(device_path)
+    if master is None:
+      master = Master.create(
+        device_path=device_path, baudrate=baudrate, name=name,
+        lazy=True)
+    masters[device_path] = master
+  Module.clear()
+  smds = dict()
+  for device_path, smd_id, kind, mod_id, name in module_specs:
+    Module.add(
+      master=masters[device_path], smd_id=smd_id, kind=kind,
+      mod_id=mod_id, name=name)
+    modules = smds.setdefault((device_path, smd_id), list())
+    if kind != Module.Kind.MOTOR:
+      modules.append((kind, mod_id))
+  for (device_path, smd_id), modules in smds.items():
+    module_labels = None
+    if hashes.get((device_path, smd_id)) == _topology_hash(modules):
+      module_labels = [
+        '{}_{}'.format(MODULE_KINDS[kind]._label, mod_id)
+        for kind, mod_id in modules]
+    masters[device_path].attach_id(smd_id, module_labels)
+  if not verify:
+    return None
+  executor = ThreadPoolExecutor(max_workers=1)
+  future = executor.submit(validate)
+  executor.shutdown(wait=False)
+  return future
+
+
+def validate(masters:Union[Master, List[Master]]=None,
+             modules:List[Module]=None,
+             refresh:bool=False,
+             incremental:bool=False):
+  '''Validates manually setup module system
+
+  Only the SMDs referenced by the validated modules are
+  queried. Each of them is pinged to confirm its motor
+  module and its module scan is executed only if non-motor
+  modules on it are still unaccounted for. The module labels
+  reported by an earlier discovery or validation (or known
+  from a loaded layout) are reused.
+
+  Parameters:
+  masters: (optional) master or list of masters whose
+           modules are validated
+  modules: (optional) list of modules to validate. By
+           default all modules are validated.
+  refresh: if True earlier module scan results are not
+           reused either
+  incremental: if True SMDs found by an earlier discovery
+           or validation are not pinged again, so validating
+           an unchanged system sends nothing. A disconnected
+           SMD then goes unnoticed.
+
+  Returns:
+  True if all modules are present
+
+  Raises:
+  MissingPhysicalModule: if any module is missing
+  '''
+  if modules is None:
+    modules = Module.all()
+  if masters is not None:
+    if isinstance(masters, Master):
+      masters = [masters]
+    masters = set(masters)
+    modules = [m for m in modules if m.master in masters]
+  expected = dict()
+  for module in modules:
+    expected.setdefault(
+      (module.master, module._smd_id), dict())[
+        (module.kind, module._mod_id)] = module
+  for (master, smd_id), pending in expected.items():
+    if not master.probe(
+        smd_id, refresh=refresh or not incremental):
+      continue
+    pending.pop((Module.Kind.MOTOR, None), None)
+    if not pending:
+      continue
+    module_labels = master.module_labels(
+      smd_id, refresh=refresh)
+    for module_label in module_labels:
+      try:
+        pending.pop(Module.parse_label(module_label), None)
+      except (UnknownModuleKind, ValueError):
+        continue
+      if not pending:
+        break
+  hashes = {
+    module.hash: module
+    for pending in expected.values()
+    for module in pending.values()}
   if hashes:
     raise MissingPhysicalModule(hashes)
   else:
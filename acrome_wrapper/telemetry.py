@@ -0,0 +1,455 @@
+'''Telemetry recording into compact binary logs
+
+A log file consists of a header, a sequence of sample blocks
+and a footer holding the channel table:
+
+  header : magic (4s), version (H), reserved (H),
+           start time since epoch (d)
+  block  : channel id (I), sample count n (I),
+           n timestamps (d), n values (d)
+  footer : channel table as UTF-8 JSON
+  trailer: footer offset (Q), magic (4s)
+
+All numbers are little endian and every array starts at an
+8 byte boundary, so that blocks can be used in place from a
+memory map. Timestamps are seconds since the start time.
+
+'''
+
+import json
+import math
+import mmap
+import struct
+import threading
+from array import array
+from bisect import bisect_right
+from itertools import accumulate
+from time import perf_counter, time
+from typing import Iterator, List, Tuple
+
+
+__all__ = [
+  'InvalidTelemetryLog',
+  'Channel',
+  'Recorder',
+  'TelemetryLog',
+  'recorder',
+]
+
+
+MAGIC = b'ACRL'
+VERSION = 1
+HEADER = struct.Struct('<4sHHd')
+BLOCK = struct.Struct('<II')
+TRAILER = struct.Struct('<Q4s')
+
+# Samples held in memory per channel before a batch is retired
+BUFFER_CAPACITY = 4096
+
+# Time in seconds between two flushes of the background writer
+FLUSH_PERIOD = 1.0
+
+# The recorder receiving samples from modules (or None)
+RECORDER = None
+
+
+class InvalidTelemetryLog(Exception):
+
+  def __init__(self, path, reason):
+    super().__init__(
+      "Invalid telemetry log {}: {}".format(path, reason))
+
+
+class Channel:
+  '''A recorded quantity of a module.
+
+  Attributes:
+  id      : position of the channel in the channel table
+  master  : device path of the master of the module
+  smd_id  : ID of the SMD of the module
+  index   : red.Index of the variable the quantity is read
+            from or written to, None if it has no variable
+  module  : name of the module
+  quantity: name of the quantity (e.g. voltage, distance)
+  '''
+
+  FIELDS = ['id', 'master', 'smd_id', 'index', 'module', 'quantity']
+
+  def __init__(self, id:int, master:str, smd_id:int, index:int,
+               module:str, quantity:str):
+    self.id = id
+    self.master = master
+    self.smd_id = smd_id
+    self.index = index
+    self.module = module
+    self.quantity = quantity
+    self.blocks = list()
+
+  def __repr__(self):
+    return 'Channel: {}.{}'.format(self.module, self.quantity)
+
+  def as_dict(self) -> dict:
+    fields = {field: getattr(self, field) for field in self.FIELDS}
+    fields['blocks'] = self.blocks
+    return fields
+
+  @staticmethod
+  def from_dict(fields:dict) -> 'Channel':
+    channel = Channel(*[fields[field] for field in Channel.FIELDS])
+    channel.blocks = [tuple(block) for block in fields['blocks']]
+    return channel
+
+
+class _Buffer:
+  '''Preallocated timestamp and value arrays of a channel'''
+
+  def __init__(self, capacity:int):
+    self.times = array('d', bytes(8 * capacity))
+    self.values = array('d', bytes(8 * capacity))
+    self.count = 0
+    self.channel = None
+
+
+class Recorder:
+  '''Records module commands and readings into a telemetry
+  log.
+
+  While a recorder is started, Motor.set_voltage(), mode
+  changes, enable() and disable(), sensor module reads
+  (e.g. Distance.measure()) and their group counterparts add
+  timestamped samples to it.
+  Adding a sample only stores two numbers into preallocated
+  arrays; full buffers are handed over to a background thread
+  which appends them to the file as blocks, so the control
+  path does no file I/O. Without the background thread
+  (flush_period=None) full buffers are written by the thread
+  filling them.
+
+  with Recorder('session.acrl'):
+    run_control_loop()
+
+  '''
+
+  def __init__(self, path:str,
+               capacity:int=BUFFER_CAPACITY,
+               flush_period:float=FLUSH_PERIOD):
+    '''Initializer for Recorder
+
+    Parameters:
+    path        : path of the log file to create
+    capacity    : samples buffered per channel
+    flush_period: time in seconds between two writes of the
+                  buffered samples by the background thread.
+                  If None samples are only written when a
+                  buffer is full, flush() is called or the
+                  recorder is stopped.
+    '''
+    self._path = path
+    self._capacity = capacity
+    self._flush_period = flush_period
+    self._lock = threading.Lock()
+    self._file_lock = threading.Lock()
+    self._stop = threading.Event()
+    self._channels = dict()
+    self._buffers = dict()
+    self._pending = list()
+    self._pool = list()
+    self._thread = None
+    self._file = None
+    self._origin = None
+    self.samples = 0
+
+  def __repr__(self):
+    return 'Recorder: {} ({} channels, {} samples)'.format(
+      self._path, len(self._channels), self.samples)
+
+  def __enter__(self):
+    self.start()
+    return self
+
+  def __exit__(self, *args):
+    self.stop()
+
+  @property
+  def path(self) -> str:
+    return self._path
+
+  @property
+  def channels(self) -> List[Channel]:
+    return list(self._channels.values())
+
+  @property
+  def is_recording(self) -> bool:
+    return RECORDER is self
+
+  def start(self):
+    '''Creates the log file and starts receiving samples'''
+    global RECORDER
+    if RECORDER is not None:
+      raise RuntimeError(
+        'Another recorder is active: {}'.format(RECORDER))
+    self._file = open(self._path, 'wb')
+    start_time = time()
+    self._origin = perf_counter()
+    self._file.write(HEADER.pack(MAGIC, VERSION, 0, start_time))
+    self._stop.clear()
+    if self._flush_period is not None:
+      self._thread = threading.Thread(
+        target=self._run, daemon=True, name='telemetry')
+      self._thread.start()
+    RECORDER = self
+
+  def stop(self):
+    '''Stops receiving samples, writes the buffered samples
+    and the channel table and closes the log file'''
+    global RECORDER
+    if RECORDER is self:
+      RECORDER = None
+    if self._file is None:
+      return
+    self._stop.set()
+    if self._thread is not None:
+      self._thread.join()
+      self._thread = None
+    self.flush()
+    with self._file_lock:
+      offset = self._file.tell()
+      self._file.write(json.dumps({
+        'channels': [c.as_dict() for c in self._channels.values()],
+      }).encode('utf-8'))
+      self._file.write(TRAILER.pack(offset, MAGIC))
+      self._file.close()
+      self._file = None
+
+  def record(self, module:'module.Module', quantity:str,
+             index:int, value:float):
+    '''Adds a sample of a module quantity
+
+    Parameters:
+    module  : module the sample belongs to
+    quantity: name of the quantity
+    index   : red.Index of the related variable or None
+    value   : value of the sample, None is stored as NaN
+    '''
+    if value is None:
+      value = math.nan
+    key = (module, quantity)
+    with self._lock:
+      # Timestamps of samples recorded by several threads are
+      # taken in the order the samples are stored
+      timestamp = perf_counter() - self._origin
+      buffer = self._buffers.get(key)
+      if buffer is None:
+        buffer = self._add_channel(key, module, quantity, index)
+      elif buffer.count == self._capacity:
+        buffer = self._retire(key)
+      buffer.times[buffer.count] = timestamp
+      buffer.values[buffer.count] = value
+      buffer.count += 1
+      self.samples += 1
+    if self._thread is None and self._pending:
+      self._write_pending()
+
+  def _add_channel(self, key:tuple, module, quantity:str,
+                   index:int) -> _Buffer:
+    channel = Channel(
+      len(self._channels), module.master.device_path,
+      module._smd_id, None if index is None else int(index),
+      module.name, quantity)
+    self._channels[key] = channel
+    buffer = self._take_buffer(channel)
+    self._buffers[key] = buffer
+    return buffer
+
+  def _take_buffer(self, channel:Channel) -> _Buffer:
+    buffer = self._pool.pop() if self._pool else \
+      _Buffer(self._capacity)
+    buffer.count = 0
+    buffer.channel = channel
+    return buffer
+
+  def _retire(self, key:tuple) -> _Buffer:
+    '''Queues the buffer of a channel for writing and
+    replaces it. Must be called with the lock held.'''
+    buffer = self._buffers[key]
+    self._pending.append(buffer)
+    self._buffers[key] = self._take_buffer(buffer.channel)
+    return self._buffers[key]
+
+  def _write_pending(self):
+    with self._lock:
+      pending, self._pending = self._pending, list()
+    with self._file_lock:
+      if self._file is None:
+        return
+      for buffer in pending:
+        offset = self._file.tell() + BLOCK.size
+        self._file.write(BLOCK.pack(buffer.channel.id, buffer.count))
+        self._file.write(memoryview(buffer.times)[:buffer.count])
+        self._file.write(memoryview(buffer.values)[:buffer.count])
+        buffer.channel.blocks.append((offset, buffer.count))
+    with self._lock:
+      self._pool.extend(pending)
+
+  def flush(self):
+    '''Writes all buffered samples to the log file'''
+    with self._lock:
+      for key, buffer in list(self._buffers.items()):
+        if buffer.count:
+          self._retire(key)
+    self._write_pending()
+    with self._file_lock:
+      if self._file is not None:
+        self._file.flush()
+
+  def _run(self):
+    while not self._stop.wait(self._flush_period):
+      self.flush()
+
+
+def recorder() -> Recorder:
+  '''Returns the active recorder or None'''
+  return RECORDER
+
+
+class TelemetryLog:
+  '''Read access to a telemetry log through a memory map.
+
+  Blocks are not loaded into memory: samples() yields
+  memoryviews into the map and value_at() binary searches the
+  blocks of a channel.
+
+  '''
+
+  def __init__(self, path:str):
+    '''Initializer for TelemetryLog
+
+    Parameters:
+    path: path of the log file
+
+    Raises:
+    InvalidTelemetryLog: if the file is not a complete log
+    '''
+    self._path = path
+    with open(path, 'rb') as log_file:
+      try:
+        self._map = mmap.mmap(
+          log_file.fileno(), 0, access=mmap.ACCESS_READ)
+      except ValueError:
+        raise InvalidTelemetryLog(path, 'empty file')
+    try:
+      magic, version, _, self.start_time = \
+        HEADER.unpack_from(self._map, 0)
+      offset, trailer_magic = TRAILER.unpack_from(
+        self._map, len(self._map) - TRAILER.size)
+    except struct.error:
+      self.close()
+      raise InvalidTelemetryLog(path, 'truncated file')
+    if magic != MAGIC or trailer_magic != MAGIC:
+      self.close()
+      raise InvalidTelemetryLog(path, 'missing magic or footer')
+    if version != VERSION:
+      self.close()
+      raise InvalidTelemetryLog(
+        path, 'unsupported version {}'.format(version))
+    footer = json.loads(
+      self._map[offset:len(self._map) - TRAILER.size])
+    self._channels = [
+      Channel.from_dict(fields) for fields in footer['channels']]
+    self._view = memoryview(self._map)
+    self._starts = [
+      [self._time(c, n, 0) for n in range(len(c.blocks))]
+      for c in self._channels]
+    self._firsts = [
+      list(accumulate([count for _, count in c.blocks], initial=0))
+      for c in self._channels]
+
+  def __repr__(self):
+    return 'TelemetryLog: {} ({} channels)'.format(
+      self._path, len(self._channels))
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
+
+  def close(self):
+    '''Releases the memory map'''
+    if getattr(self, '_view', None) is not None:
+      self._view.release()
+      self._view = None
+    self._map.close()
+
+  @property
+  def channels(self) -> List[Channel]:
+    return self._channels
+
+  @property
+  def duration(self) -> float:
+    '''Returns the timestamp of the last sample'''
+    return max(
+      (self._time(c, len(c.blocks) - 1, c.blocks[-1][1] - 1)
+       for c in self._channels if c.blocks), default=0.0)
+
+  def find(self, **conditions) -> List[Channel]:
+    '''Returns the channels whose fields match the
+    conditions, e.g. find(smd_id=0, quantity='distance')'''
+    return [
+      c for c in self._channels
+      if all(getattr(c, field) == value
+             for field, value in conditions.items())]
+
+  def _arrays(self, channel:Channel,
+              block:int) -> Tuple[memoryview, memoryview]:
+    offset, count = channel.blocks[block]
+    size = 8 * count
+    return (
+      self._view[offset:offset + size].cast('d'),
+      self._view[offset + size:offset + 2 * size].cast('d'))
+
+  def _time(self, channel:Channel, block:int, n:int) -> float:
+    offset, _ = channel.blocks[block]
+    return struct.unpack_from('<d', self._map, offset + 8 * n)[0]
+
+  def samples(self, channel:Channel) -> Iterator[
+      Tuple[memoryview, memoryview]]:
+    '''Yields the (timestamps, values) arrays of the blocks
+    of a channel in time order without copying them'''
+    for block in range(len(channel.blocks)):
+      yield self._arrays(channel, block)
+
+  def read(self, channel:Channel) -> Tuple[array, array]:
+    '''Returns copies of all timestamps and values of a
+    channel'''
+    times, values = array('d'), array('d')
+    for block_times, block_values in self.samples(channel):
+      times.frombytes(block_times.cast('B'))
+      values.frombytes(block_values.cast('B'))
+    return times, values
+
+  def count(self, channel:Channel) -> int:
+    '''Returns the number of samples of a channel'''
+    return self._firsts[channel.id][-1]
+
+  def sample(self, channel:Channel, n:int) -> Tuple[float, float]:
+    '''Returns the (timestamp, value) of the n-th sample of a
+    channel. Values of failed reads are None.'''
+    if not 0 <= n < self.count(channel):
+      raise IndexError('{} has no sample {}'.format(channel, n))
+    block = bisect_right(self._firsts[channel.id], n) - 1
+    times, values = self._arrays(channel, block)
+    n -= self._firsts[channel.id][block]
+    value = values[n]
+    return times[n], None if math.isnan(value) else value
+
+  def value_at(self, channel:Channel, t:float):
+    '''Returns the value of the last sample of a channel
+    taken at or before time t, None if there is none'''
+    block = bisect_right(self._starts[channel.id], t) - 1
+    if block < 0:
+      return None
+    times, values = self._arrays(channel, block)
+    n = bisect_right(times, t) - 1
+    value = values[n]
+    return None if math.isnan(value) else value
@@ -0,0 +1,254 @@
+'''Position trajectories streamed at a fixed rate
+
+'''
+
+import math
+import threading
+from bisect import bisect_right
+from typing import Callable, Dict, List, Sequence
+from .deferred import red
+from .module import Motor
+from .background import BackgroundTask
+from .scheduler import Scheduler
+from . import telemetry
+
+
+__all__ = [
+  'Trajectory',
+  'TrajectoryStreamer',
+]
+
+
+# Default rate of streamed set points in Hz
+STREAM_RATE = 100.0
+
+
+class Trajectory:
+  '''A time-parameterized position path of one or more
+  motors.
+
+  The path maps the time since the start of the motion in
+  seconds to a position set point in encoder counts for each
+  motor. Before the start and after the end the positions
+  stay at the first and last set points.
+
+  '''
+
+  def __init__(self,
+               function:Callable[[float], Sequence[float]],
+               duration:float):
+    '''Initializer for Trajectory
+
+    Parameters:
+    function: callable(t) returning the positions of the
+              motors at time t
+    duration: length of the motion in seconds
+    '''
+    if duration < 0.0:
+      raise ValueError(
+        'Trajectory duration must not be negative: {}'.format(
+          duration))
+    self._function = function
+    self._duration = duration
+
+  def __repr__(self):
+    return 'Trajectory: {:g}s'.format(self._duration)
+
+  @staticmethod
+  def linear(times:Sequence[float],
+             positions:Sequence[Sequence[float]]) -> 'Trajectory':
+    '''Returns the piecewise linear trajectory through
+    waypoints
+
+    Parameters:
+    times    : increasing waypoint times in seconds starting
+               with zero
+    positions: positions of the motors at each waypoint
+
+    Raises:
+    ValueError: if the waypoints are not consistent
+    '''
+    times = [float(t) for t in times]
+    rows = [[float(p) for p in row] for row in positions]
+    if not times or len(times) != len(rows):
+      raise ValueError('Expected one position row per waypoint')
+    if times[0] != 0.0 or any(
+        t0 >= t1 for t0, t1 in zip(times, times[1:])):
+      raise ValueError(
+        'Waypoint times must increase from zero: {}'.format(times))
+    if len({len(row) for row in rows}) != 1:
+      raise ValueError('Waypoints must have equal widths')
+    def position(t:float) -> List[float]:
+      k = bisect_right(times, t)
+      if k >= len(times):
+        return rows[-1]
+      t0, t1 = times[k - 1], times[k]
+      a = (t - t0) / (t1 - t0)
+      return [p0 + a * (p1 - p0) for p0, p1 in zip(rows[k - 1], rows[k])]
+    return Trajectory(position, times[-1])
+
+  @property
+  def duration(self) -> float:
+    return self._duration
+
+  def __call__(self, t:float) -> List[float]:
+    '''Returns the positions of the motors at time t'''
+    return list(self._function(min(max(t, 0.0), self._duration)))
+
+  def sample(self, period:float) -> List[List[float]]:
+    '''Returns the positions at 0, period, 2*period, ... up
+    to the end of the motion (included)'''
+    ticks = math.ceil(self._duration / period - 1e-9)
+    return [self(min(n * period, self._duration))
+            for n in range(ticks + 1)]
+
+
+class TrajectoryStreamer(BackgroundTask):
+  '''Feeds the position set points of a trajectory to motors
+  from a background thread at a fixed rate.
+
+  The set point schedule is computed up front: the trajectory
+  is sampled at the stream rate and clamped to the position
+  limits. It is converted into the synchronized write frame
+  of each master when streaming starts, with the current SMD
+  IDs and polarities of the motors. Streaming runs on a Scheduler with one thread
+  per master, and a tick only sends its precomputed frame.
+  Ticks missed due to overruns are skipped, so the motion
+  follows the wall clock. The last set point is always sent.
+
+  '''
+
+  def __init__(self,
+               motors:Sequence[Motor],
+               trajectory:Trajectory,
+               rate:float=STREAM_RATE,
+               busy_wait:float=0.0):
+    '''Initializer for TrajectoryStreamer
+
+    Parameters:
+    motors    : motors in the order of the trajectory
+                positions (e.g. a MotorGroup)
+    trajectory: the path to follow
+    rate      : set point rate in Hz
+    busy_wait : see Scheduler
+
+    Raises:
+    ValueError: if the trajectory width does not match
+    '''
+    self._motors = list(motors)
+    self._trajectory = trajectory
+    self._period = 1.0 / rate
+    rows = trajectory.sample(self._period)
+    if len(rows[0]) != len(self._motors):
+      raise ValueError(
+        'Trajectory drives {} motors, got {}'.format(
+          len(rows[0]), len(self._motors)))
+    self._schedule = [
+      [motor._clamp_position(position)
+       for motor, position in zip(self._motors, row)]
+      for row in rows]
+    columns = dict()
+    for n, motor in enumerate(self._motors):
+      columns.setdefault(motor.master, list()).append(n)
+    self._columns = columns
+    self._scheduler = Scheduler(busy_wait)
+    self._frames = dict()
+    self._sent = dict()
+    self._pending = set()
+    self._lock = threading.Lock()
+    for master, ns in columns.items():
+      self._scheduler.add(
+        self._feeder(master, ns), period=self._period,
+        name='trajectory-{}'.format(master), master=master)
+
+  def __repr__(self):
+    return 'TrajectoryStreamer: {} motors, {} ticks @ {:g} Hz'.format(
+      len(self._motors), len(self._schedule), self.rate)
+
+  @property
+  def rate(self) -> float:
+    return 1.0 / self._period
+
+  @property
+  def schedule(self) -> List[List[float]]:
+    '''Returns the position set points of each tick'''
+    return self._schedule
+
+  @property
+  def is_running(self) -> bool:
+    return self._scheduler.is_running
+
+  @property
+  def finished(self) -> bool:
+    '''Returns True once the last set point is sent to all
+    motors'''
+    return bool(self._sent) and not self._pending
+
+  def stats(self) -> Dict[str, dict]:
+    '''Returns the timing statistics of the stream of each
+    master (see Scheduler.stats())'''
+    return self._scheduler.stats()
+
+  def _frames_of(self, columns:List[int]) -> tuple:
+    '''Returns the coalescing key and the synchronized write
+    frame of each tick for the motors in the columns, with
+    their current SMD IDs and polarities'''
+    smd_ids = tuple(self._motors[n]._smd_id for n in columns)
+    polarities = [self._motors[n]._polarity.value for n in columns]
+    frames = [
+      [(smd_id, polarity * row[n])
+       for smd_id, polarity, n in zip(smd_ids, polarities, columns)]
+      for row in self._schedule]
+    return ('set_positions', smd_ids), frames
+
+  def _feeder(self, master:'master.Master',
+              columns:List[int]) -> Callable[[float], None]:
+    last = len(self._schedule) - 1
+    index = red.Index.SetPosition
+    def feed(t:float):
+      if self._sent.get(master) == last:
+        return
+      n = min(round(t / self._period), last)
+      key, frames = self._frames[master]
+      frame = frames[n]
+      master.post(key, 'set_positions', id_sp_pairs=frame)
+      self._sent[master] = n
+      recorder = telemetry.RECORDER
+      if recorder is not None:
+        for column, (_, value) in zip(columns, frame):
+          recorder.record(
+            self._motors[column], 'position_set_point', index, value)
+      if n == last:
+        with self._lock:
+          self._pending.discard(master)
+          if not self._pending:
+            self._scheduler.request_stop()
+    return feed
+
+  def _start_threads(self, forced:bool=False):
+    '''Starts streaming from the beginning of the trajectory.
+    All motors must be in POSITION_CONTROL mode and enabled
+    (unless forced).'''
+    for motor in self._motors:
+      motor._check_command(Motor.Mode.POSITION_CONTROL, forced)
+    self._frames = {
+      master: self._frames_of(columns)
+      for master, columns in self._columns.items()}
+    self._sent = dict()
+    self._pending = set(self._columns)
+    self._scheduler.start()
+
+  def _wait_threads(self, timeout:float) -> bool:
+    return self._scheduler.wait(timeout)
+
+  def _stop_threads(self):
+    '''Stops streaming. The motors keep the last set point
+    sent.'''
+    try:
+      self._scheduler.stop()
+    finally:
+      for master, columns in self._columns.items():
+        n = self._sent.get(master)
+        if n is not None:
+          for column in columns:
+            self._motors[column]._position = self._schedule[n][column]
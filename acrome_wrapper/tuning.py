@@ -0,0 +1,282 @@
+'''Baud rate tuning of communication masters
+
+'''
+
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter, sleep
+from typing import Dict, List, Union
+from .master import Master, MASTERS
+
+
+__all__ = [
+  'BaudrateError',
+  'RateResult',
+  'TuningReport',
+  'measure_rate',
+  'tune_baudrate',
+  'tune',
+]
+
+
+# Candidate serial baud rates in Hz
+BAUDRATES = [
+  115200, 230400, 460800, 921600, 1000000, 2000000,
+  3000000, 4000000, 6000000, 12500000,
+]
+
+# Time in seconds given to rebooting SMDs to come up
+REBOOT_DELAY = 0.5
+
+# Attempts to bring SMDs back to the last reliable rate
+REVERT_ATTEMPTS = 10
+
+
+class BaudrateError(Exception):
+
+  def __init__(self, master, smd_ids, baudrate):
+    super().__init__(
+      "SMDs {} of master {} do not respond at {} baud".format(
+        smd_ids, master, baudrate))
+
+
+class RateResult:
+  '''Round trip measurement of a master at a baud rate.
+
+  Attributes:
+  baudrate    : serial baud rate in Hz
+  transactions: number of queries sent
+  errors      : number of queries without a valid response
+  rtt_mean    : mean round trip time of the answered queries
+                in seconds
+  rtt_max     : maximum round trip time in seconds
+  elapsed     : duration of the measurement in seconds
+  '''
+
+  def __init__(self, baudrate:int):
+    self.baudrate = baudrate
+    self.transactions = 0
+    self.errors = 0
+    self.rtt_mean = 0.0
+    self.rtt_max = 0.0
+    self.elapsed = 0.0
+
+  def __repr__(self):
+    return ('RateResult: {} baud, rtt={:.3f}ms, errors={:.1%}, '
+            '{:.0f} transactions/s').format(
+              self.baudrate, self.rtt_mean * 1e3, self.error_rate,
+              self.transactions_per_second)
+
+  @property
+  def error_rate(self) -> float:
+    return self.errors / self.transactions if self.transactions else 1.0
+
+  @property
+  def transactions_per_second(self) -> float:
+    '''Returns the rate of answered queries'''
+    if not self.elapsed:
+      return 0.0
+    return (self.transactions - self.errors) / self.elapsed
+
+
+class TuningReport:
+  '''Outcome of tuning the baud rate of a master.
+
+  Attributes:
+  master     : tuned master
+  initial    : baud rate before tuning in Hz
+  baudrate   : baud rate after tuning in Hz
+  smd_ids    : IDs of the SMDs on the bus
+  results    : RateResult of each probed rate in probe order
+  unreachable: IDs of SMDs which could not be brought back
+               to the selected rate
+  '''
+
+  def __init__(self, master:Master, smd_ids:List[int]):
+    self.master = master
+    self.initial = master.baudrate
+    self.baudrate = master.baudrate
+    self.smd_ids = smd_ids
+    self.results = list()
+    self.unreachable = list()
+
+  def __repr__(self):
+    return 'TuningReport: {} {} -> {} baud'.format(
+      self.master, self.initial, self.baudrate)
+
+  def __str__(self):
+    lines = [repr(self)] + [
+      '  {}{}'.format('*' if r.baudrate == self.baudrate else ' ', r)
+      for r in self.results]
+    if self.unreachable:
+      lines.append('  unreachable SMDs: {}'.format(self.unreachable))
+    return '\n'.join(lines)
+
+  @property
+  def result(self) -> RateResult:
+    '''Returns the measurement at the selected baud rate'''
+    for result in reversed(self.results):
+      if result.baudrate == self.baudrate:
+        return result
+    return None
+
+  @property
+  def transactions_per_second(self) -> float:
+    '''Returns the achieved transaction rate at the selected
+    baud rate'''
+    result = self.result
+    return result.transactions_per_second if result else 0.0
+
+
+def measure_rate(master:Master, smd_ids:List[int],
+                 probes:int=20) -> RateResult:
+  '''Measures the round trip time and error rate of driver
+  info queries to the SMDs at the current baud rate
+
+  Parameters:
+  master : master of the bus
+  smd_ids: IDs of the SMDs to query
+  probes : queries sent to each SMD
+  '''
+  result = RateResult(master.baudrate)
+  rtt_sum = 0.0
+  start = perf_counter()
+  for _ in range(probes):
+    for smd_id in smd_ids:
+      sent = perf_counter()
+      answered = master.fetch('get_driver_info', id=smd_id) is not None
+      rtt = perf_counter() - sent
+      result.transactions += 1
+      if answered:
+        rtt_sum += rtt
+        result.rtt_max = max(result.rtt_max, rtt)
+      else:
+        result.errors += 1
+  result.elapsed = perf_counter() - start
+  answered = result.transactions - result.errors
+  result.rtt_mean = rtt_sum / answered if answered else 0.0
+  return result
+
+
+def _switch(master:Master, smd_ids:List[int], baudrate:int,
+            settle:float):
+  '''Commands the SMDs to the baud rate and follows them'''
+  for smd_id in smd_ids:
+    master.fetch('update_driver_baudrate', id=smd_id, br=baudrate)
+  master.fetch('update_master_baudrate', br=baudrate)
+  if settle:
+    sleep(settle)
+
+
+def _responding(master:Master, smd_ids:List[int]) -> List[int]:
+  return [smd_id for smd_id in smd_ids
+          if master.fetch('ping', id=smd_id)]
+
+
+def _revert(master:Master, smd_ids:List[int], current:int,
+            baudrate:int, settle:float) -> List[int]:
+  '''Brings the SMDs from the current rate back to the
+  given rate. Returns the IDs which did not follow.'''
+  pending = list(smd_ids)
+  for _ in range(REVERT_ATTEMPTS):
+    master.fetch('update_master_baudrate', br=current)
+    for smd_id in pending:
+      master.fetch('update_driver_baudrate', id=smd_id, br=baudrate)
+    master.fetch('update_master_baudrate', br=baudrate)
+    if settle:
+      sleep(settle)
+    answered = set(_responding(master, pending))
+    pending = [smd_id for smd_id in pending if smd_id not in answered]
+    if not pending:
+      break
+  return pending
+
+
+def tune_baudrate(master:Master,
+                  baudrates:List[int]=BAUDRATES,
+                  probes:int=20,
+                  max_error_rate:float=0.0,
+                  smd_ids:List[int]=None,
+                  settle:float=REBOOT_DELAY) -> TuningReport:
+  '''Switches a master and all SMDs on its bus to the
+  fastest reliable baud rate.
+
+  The current rate is measured first. Then the SMDs and the
+  master are switched to each higher candidate rate in turn
+  and measured. The first rate whose error rate exceeds
+  max_error_rate (or at which an SMD does not respond) stops
+  the search and the bus is brought back to the last
+  reliable rate.
+
+  The SMD baud rates are stored in their EEPROM, so the
+  selected rate persists over power cycles.
+
+  Parameters:
+  master        : master of the bus
+  baudrates     : candidate baud rates in Hz
+  probes        : driver info queries sent to each SMD per
+                  rate
+  max_error_rate: highest acceptable share of failed queries
+  smd_ids       : (optional) IDs of the SMDs on the bus. By
+                  default the discovered SMDs are used or the
+                  bus is scanned.
+  settle        : time in seconds SMDs are given to reboot
+
+  Returns:
+  TuningReport of the master
+
+  Raises:
+  BaudrateError: if SMDs do not respond at the current rate
+  '''
+  if smd_ids is None:
+    smd_ids = sorted(master.topology) or master.fetch('scan')
+  report = TuningReport(master, list(smd_ids))
+  if not smd_ids:
+    return report
+  answered = set(_responding(master, smd_ids))
+  silent = [smd_id for smd_id in smd_ids if smd_id not in answered]
+  if silent:
+    raise BaudrateError(master, silent, master.baudrate)
+  best = master.baudrate
+  report.results.append(measure_rate(master, smd_ids, probes))
+  for baudrate in sorted(set(baudrates)):
+    if baudrate <= best:
+      continue
+    _switch(master, smd_ids, baudrate, settle)
+    result = measure_rate(master, smd_ids, probes)
+    report.results.append(result)
+    if result.error_rate <= max_error_rate and \
+       len(_responding(master, smd_ids)) == len(smd_ids):
+      best = baudrate
+      continue
+    report.unreachable = _revert(
+      master, smd_ids, baudrate, best, settle)
+    break
+  report.baudrate = master.baudrate
+  if report.results[-1].baudrate != best:
+    report.results.append(measure_rate(master, smd_ids, probes))
+  return report
+
+
+def tune(masters:Union[Master, List[Master]]=None,
+         **kwargs) -> Dict[Master, TuningReport]:
+  '''Tunes the baud rates of masters (all by default)
+  concurrently, one thread per bus
+
+  Parameters:
+  masters: (optional) master or list of masters
+  kwargs : see tune_baudrate()
+
+  Returns:
+  TuningReport of each master
+  '''
+  if masters is None:
+    masters = list(MASTERS)
+  elif isinstance(masters, Master):
+    masters = [masters]
+  if not masters:
+    return dict()
+  with ThreadPoolExecutor(max_workers=len(masters)) as executor:
+    futures = {
+      master: executor.submit(tune_baudrate, master, **kwargs)
+      for master in masters}
+  return {master: future.result() for master, future in futures.items()}
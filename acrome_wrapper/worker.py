@@ -0,0 +1,266 @@
+'''Background I/O worker for communication masters
+
+'''
+
+import threading
+from concurrent.futures import Future
+from itertools import count
+from time import monotonic
+
+
+__all__ = [
+  'WorkerError',
+  'MasterWorker',
+]
+
+
+# Default time in seconds to wait for the first polled value
+POLL_TIMEOUT = 1.0
+
+
+class WorkerError(Exception):
+
+  def __init__(self, master, error):
+    super().__init__(
+      "I/O worker of master {} failed: {!r}".format(
+        master, error))
+
+
+class MasterWorker:
+  '''Dedicated I/O thread of a master.
+
+  While a worker is running it is the only thread talking to
+  the bus of its master. Writes are queued by key and a
+  newer write with the same key supersedes the queued one,
+  so only the most recent set point of a motor is sent.
+  Writes without a key (enable, mode and limit changes) are
+  never superseded and are sent in order.
+  Other calls (one-shot reads, scans, ID changes) are queued
+  with call() and their results are waited for. Reads
+  registered with poll() are polled continuously and served
+  from the most recently polled values.
+
+  A failing queued write does not keep the later writes from
+  being sent. The first error is re-raised (wrapped in
+  WorkerError) on the next submit() or call(). The errors of
+  a call are raised by the call itself. A poll which fails
+  is dropped and its error is raised by the next latest()
+  of the read.
+
+  '''
+
+  def __init__(self, master:'master.Master',
+               poll_period:float=0.0):
+    '''Initializer for MasterWorker
+
+    Parameters:
+    master: master whose bus is owned by the worker
+    poll_period: minimum time in seconds between two polling
+                 passes over the registered reads
+    '''
+    self._master = master
+    self._poll_period = poll_period
+    self._condition = threading.Condition()
+    self._commands = dict()
+    self._sequence = count()
+    self._calls = list()
+    self._polls = dict()
+    self._values = dict()
+    self._failures = dict()
+    self._error = None
+    self._running = False
+    self._thread = None
+
+  @property
+  def master(self) -> 'master.Master':
+    return self._master
+
+  @property
+  def is_running(self) -> bool:
+    return self._running
+
+  @property
+  def is_current(self) -> bool:
+    '''Returns True if called on the worker thread'''
+    return threading.current_thread() is self._thread
+
+  def start(self):
+    '''Starts the worker thread'''
+    with self._condition:
+      if self._running:
+        return
+      self._running = True
+    self._thread = threading.Thread(
+      target=self._run, daemon=True,
+      name='{}-io'.format(self._master.name))
+    self._thread.start()
+
+  def stop(self, timeout:float=None):
+    '''Sends the queued writes and stops the worker thread'''
+    with self._condition:
+      if not self._running:
+        return
+      self._running = False
+      self._condition.notify_all()
+    self._thread.join(timeout)
+    self._thread = None
+
+  def _raise_error(self):
+    if self._error is not None:
+      error, self._error = self._error, None
+      raise WorkerError(self._master, error) from error
+
+  def submit(self, key:tuple, method:str, kwargs:dict):
+    '''Queues a write. A queued write with the same key is
+    replaced.
+
+    Parameters:
+    key   : coalescing key of the write, or None to send the
+            write in order without superseding any
+    method: name of the master method to call
+    kwargs: keyword arguments of the call
+    '''
+    with self._condition:
+      self._raise_error()
+      if key is None:
+        key = (None, next(self._sequence))
+      self._commands.pop(key, None)
+      self._commands[key] = (method, kwargs)
+      self._condition.notify_all()
+
+  def call(self, method:str, kwargs:dict):
+    '''Queues a call after the queued writes and waits for
+    its result
+
+    Parameters:
+    method: name of the master method to call
+    kwargs: keyword arguments of the call
+
+    Returns:
+    return value of the call
+
+    Raises:
+    the error raised by the call
+    '''
+    future = Future()
+    with self._condition:
+      self._raise_error()
+      if not self._running:
+        raise RuntimeError(
+          'I/O worker of master {} is not running'.format(
+            self._master))
+      self._calls.append((method, kwargs, future))
+      self._condition.notify_all()
+    return future.result()
+
+  def poll(self, key:tuple, method:str, kwargs:dict):
+    '''Registers a read for continuous polling
+
+    Parameters:
+    key   : key of the read
+    method: name of the master method to call
+    kwargs: keyword arguments of the call
+    '''
+    with self._condition:
+      self._failures.pop(key, None)
+      if key not in self._polls:
+        self._polls[key] = (method, kwargs)
+        self._condition.notify_all()
+
+  def is_polled(self, key:tuple) -> bool:
+    '''Returns True if the read is registered for polling or
+    its last poll failed'''
+    return key in self._polls or key in self._failures
+
+  def latest(self, key:tuple, timeout:float=POLL_TIMEOUT):
+    '''Returns the most recently polled value of a read
+    registered with poll(). The first value is waited for.
+
+    Parameters:
+    key    : key of the read
+    timeout: time in seconds to wait for the first value
+
+    Raises:
+    KeyError: if the read is not polled
+    WorkerError: if the poll failed, which dropped it
+    TimeoutError: if the first value is not polled in time
+    '''
+    with self._condition:
+      if key in self._failures:
+        error = self._failures.pop(key)
+        raise WorkerError(self._master, error) from error
+      if key not in self._polls:
+        raise KeyError(key)
+      if not self._condition.wait_for(
+          lambda: key in self._values or key in self._failures,
+          timeout):
+        raise TimeoutError(
+          'No value polled for {} on {}'.format(key, self._master))
+      if key in self._failures:
+        error = self._failures.pop(key)
+        raise WorkerError(self._master, error) from error
+      return self._values[key][1]
+
+  def timestamp(self, key:tuple) -> float:
+    '''Returns the monotonic time at which the value of a
+    read was last polled or None'''
+    with self._condition:
+      entry = self._values.get(key)
+    return entry[0] if entry else None
+
+  def forget(self, key:tuple):
+    '''Stops polling a read'''
+    with self._condition:
+      self._polls.pop(key, None)
+      self._values.pop(key, None)
+      self._failures.pop(key, None)
+
+  def _call(self, method:str, kwargs:dict):
+    return getattr(self._master, method)(**kwargs)
+
+  def _run(self):
+    next_poll = monotonic()
+    while True:
+      with self._condition:
+        while self._running and not self._commands and \
+            not self._calls and (
+              not self._polls or monotonic() < next_poll):
+          self._condition.wait(
+            max(0.0, next_poll - monotonic())
+            if self._polls else None)
+        commands, self._commands = self._commands, dict()
+        calls, self._calls = self._calls, list()
+        polls = list(self._polls.items())
+        running = self._running
+      for method, kwargs in commands.values():
+        try:
+          self._call(method, kwargs)
+        except Exception as error:
+          with self._condition:
+            if self._error is None:
+              self._error = error
+            self._condition.notify_all()
+      for method, kwargs, future in calls:
+        try:
+          future.set_result(self._call(method, kwargs))
+        except Exception as error:
+          future.set_exception(error)
+      if not running:
+        return
+      if polls and monotonic() >= next_poll:
+        next_poll = monotonic() + self._poll_period
+        for key, (method, kwargs) in polls:
+          try:
+            value = self._call(method, kwargs)
+          except Exception as error:
+            with self._condition:
+              if key in self._polls:
+                del self._polls[key]
+                self._values.pop(key, None)
+                self._failures[key] = error
+                self._condition.notify_all()
+            continue
+          with self._condition:
+            if key in self._polls:
+              self._values[key] = (monotonic(), value)
+              self._condition.notify_all()
@@ -0,0 +1,381 @@
+'''Performance benchmarks against simulated masters
+
+Measures module registry lookups, discovery and validation
+time against topology size, sustained motor command and
+distance read rates, control tick jitter and IMU streaming
+rates. The results are written as JSON so that runs of
+different versions can be compared (see --compare).
+
+'''
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+from time import perf_counter, time, monotonic
+from acrome_wrapper import \
+  Module, Motor, Distance, MotorGroup, SimulatedMaster, Scheduler, \
+  Recorder, Trajectory, TrajectoryStreamer, FeedbackSampler, IMU, \
+  discover, validate, clear, instrument, uninstrument, reset_metrics
+
+
+def get_arguments():
+  parser = argparse.ArgumentParser(
+    prog='benchmark',
+    description='acrome-wrapper performance benchmarks')
+  parser.add_argument(
+    '-o', '--output', default=None,
+    help='JSON file to write the results (default: stdout)')
+  parser.add_argument(
+    '-c', '--compare', default=None,
+    help='JSON results of an earlier run to compare with')
+  parser.add_argument(
+    '-d', '--duration', type=float, default=1.0,
+    help='duration of each throughput benchmark in seconds')
+  parser.add_argument(
+    '-l', '--latency', type=float, default=0.0,
+    help='simulated transaction latency in seconds')
+  return parser.parse_args()
+
+
+def rate(count:int, elapsed:float) -> dict:
+  return {
+    'count': count,
+    'elapsed_s': elapsed,
+    'per_second': count / elapsed if elapsed else None,
+    'mean_us': elapsed / count * 1e6 if count else None,
+  }
+
+
+def timed_loop(function, duration:float) -> dict:
+  '''Calls function repeatedly for the given duration'''
+  count = 0
+  start = perf_counter()
+  deadline = start + duration
+  while perf_counter() < deadline:
+    function()
+    count += 1
+  return rate(count, perf_counter() - start)
+
+
+def simulated_system(smd_count:int, distances:int=1,
+                     latency:float=0.0,
+                     masters:int=1) -> list:
+  '''Sets up simulated masters sharing smd_count SMDs each
+  with the given number of distance modules'''
+  clear()
+  labels = ['Distance_{}'.format(i + 1) for i in range(distances)]
+  topologies = [dict() for _ in range(masters)]
+  for n in range(smd_count):
+    topologies[n % masters][n // masters] = labels
+  return [
+    SimulatedMaster(
+      'sim/bench{}'.format(i), topology=topology,
+      latency=latency)
+    for i, topology in enumerate(topologies)]
+
+
+def bench_import(repeat:int=5) -> list:
+  '''Measures the import time of the package in fresh
+  interpreters and checks that the smd package is not
+  imported with it'''
+  script = (
+    'import sys, time\n'
+    'start = time.perf_counter()\n'
+    'import acrome_wrapper\n'
+    'print(time.perf_counter() - start, "smd" in sys.modules)\n')
+  times, loaded = list(), False
+  for _ in range(repeat):
+    output = subprocess.run(
+      [sys.executable, '-c', script], check=True,
+      capture_output=True, text=True).stdout.split()
+    times.append(float(output[0]))
+    loaded = loaded or output[1] == 'True'
+  return [{
+    'name': 'package.import',
+    'params': {'repeat': repeat},
+    'metrics': {
+      'min_s': min(times),
+      'max_s': max(times),
+      'smd_loaded': loaded}}]
+
+
+def bench_registry(sizes=(10, 100, 1000),
+                   lookups:int=2000) -> list:
+  results = list()
+  for size in sizes:
+    masters = simulated_system(0, masters=(size + 249) // 250)
+    for n in range(size):
+      Motor.add(master=masters[n % len(masters)],
+                smd_id=n // len(masters))
+    names = [m.name for m in Module.all()]
+    queries = {
+      'find_by_name': lambda i: Module.find(
+        name=names[i % size]),
+      'get_by_master_and_smd_id': lambda i: Motor.get(
+        master=masters[i % len(masters)],
+        smd_id=(i // len(masters)) % (size // len(masters))),
+      'find_by_kind': lambda i: Module.find(
+        kind=Module.Kind.MOTOR),
+    }
+    for query, function in queries.items():
+      start = perf_counter()
+      for i in range(lookups):
+        function(i)
+      results.append({
+        'name': 'registry.' + query,
+        'params': {'modules': size},
+        'metrics': rate(lookups, perf_counter() - start)})
+  clear()
+  return results
+
+
+def bench_discovery(sizes=(1, 10, 50),
+                    latency:float=0.0) -> list:
+  results = list()
+  for size in sizes:
+    simulated_system(size, latency=latency, masters=2)
+    start = perf_counter()
+    discover()
+    discovered = perf_counter() - start
+    start = perf_counter()
+    discover(concurrent=True)
+    concurrent = perf_counter() - start
+    start = perf_counter()
+    validate(refresh=True)
+    validated = perf_counter() - start
+    results.append({
+      'name': 'system.discover',
+      'params': {'smds': size, 'latency_s': latency},
+      'metrics': {
+        'serial_s': discovered,
+        'concurrent_s': concurrent,
+        'validate_s': validated,
+        'modules': len(Module.all())}})
+  clear()
+  return results
+
+
+def bench_commands(duration:float, latency:float=0.0) -> list:
+  simulated_system(1, latency=latency)
+  discover()
+  motor = Motor.all()[0]
+  distance = Distance.all()[0]
+  motor.setup()
+  motor.enable()
+  results = [
+    {'name': 'motor.set_voltage',
+     'params': {'latency_s': latency},
+     'metrics': timed_loop(
+       lambda: motor.set_voltage(3.0), duration)},
+    {'name': 'distance.measure',
+     'params': {'latency_s': latency},
+     'metrics': timed_loop(distance.measure, duration)},
+  ]
+  fd, path = tempfile.mkstemp(suffix='.acrl')
+  os.close(fd)
+  try:
+    with Recorder(path):
+      results.append({
+        'name': 'motor.set_voltage.recorded',
+        'params': {'latency_s': latency},
+        'metrics': timed_loop(
+          lambda: motor.set_voltage(3.0), duration)})
+    results[-1]['metrics']['log_bytes'] = os.path.getsize(path)
+  finally:
+    os.remove(path)
+  instrument(motor.master)
+  results.append({
+    'name': 'motor.set_voltage.instrumented',
+    'params': {'latency_s': latency},
+    'metrics': timed_loop(lambda: motor.set_voltage(3.0), duration)})
+  uninstrument(motor.master)
+  reset_metrics()
+  clear()
+  return results
+
+
+def bench_group_voltages(duration:float, sizes=(8, 64),
+                         latency:float=0.0) -> list:
+  '''Sets the voltages of motor groups from lists and (if
+  NumPy is installed) from arrays'''
+  try:
+    import numpy
+  except ImportError:
+    numpy = None
+  results = list()
+  for size in sizes:
+    simulated_system(size, distances=0, latency=latency)
+    discover()
+    group = MotorGroup(Motor.all())
+    for motor in group:
+      motor.setup()
+    group.enable()
+    voltages = [(n % 25) - 12.0 for n in range(size)]
+    inputs = [('list', voltages)]
+    if numpy is not None:
+      inputs.append(('array', numpy.array(voltages)))
+    for kind, value in inputs:
+      results.append({
+        'name': 'group.set_voltages.{}'.format(kind),
+        'params': {'motors': size, 'latency_s': latency},
+        'metrics': timed_loop(
+          lambda: group.set_voltages(value), duration)})
+  clear()
+  return results
+
+
+def bench_control_tick(duration:float, latency:float=0.0,
+                       period:float=0.002) -> list:
+  '''Runs a fixed period control loop which sets a motor
+  voltage and reads a distance sensor each tick and measures
+  the deviation of the tick start times from their
+  deadlines'''
+  simulated_system(1, latency=latency)
+  discover()
+  motor = Motor.all()[0]
+  distance = Distance.all()[0]
+  motor.setup()
+  motor.enable()
+  def control(t):
+    motor.set_voltage(3.0)
+    distance.measure()
+  scheduler = Scheduler()
+  loop = scheduler.add(control, period=period, master=motor.master)
+  scheduler.run(duration)
+  clear()
+  return [{
+    'name': 'control.tick',
+    'params': {'latency_s': latency, 'period_s': period},
+    'metrics': loop.stats.as_dict()}]
+
+
+def bench_trajectory(duration:float, motors:int=4,
+                     rate:float=500.0, latency:float=0.0) -> list:
+  '''Streams a linear trajectory to a group of motors and
+  measures the set point tick timing'''
+  simulated_system(motors, distances=0, latency=latency)
+  discover()
+  group = MotorGroup(Motor.all())
+  for motor in group:
+    motor.mode = Motor.Mode.POSITION_CONTROL
+  group.enable()
+  trajectory = Trajectory.linear(
+    [0.0, duration], [[0.0] * motors, [6533.0] * motors])
+  start = perf_counter()
+  streamer = TrajectoryStreamer(group, trajectory, rate=rate)
+  precompute = perf_counter() - start
+  streamer.run()
+  stats = next(iter(streamer.stats().values()))
+  stats['precompute_s'] = precompute
+  clear()
+  return [{
+    'name': 'trajectory.stream',
+    'params': {'motors': motors, 'rate_hz': rate,
+               'latency_s': latency},
+    'metrics': stats}]
+
+
+def bench_sampling(duration:float, motors:int=4,
+                   rate:float=500.0, latency:float=0.0) -> list:
+  '''Samples the currents of a group of motors and measures
+  the sampling tick timing'''
+  simulated_system(motors, distances=0, latency=latency)
+  discover()
+  sampler = FeedbackSampler(
+    Motor.all(), ['current'], rate=rate,
+    samples=max(1, int(duration * rate)))
+  sampler.run()
+  stats = next(iter(sampler.stats().values()))
+  clear()
+  return [{
+    'name': 'sampler.current',
+    'params': {'motors': motors, 'rate_hz': rate,
+               'latency_s': latency},
+    'metrics': stats}]
+
+
+def bench_imu_stream(duration:float, latency:float=0.0) -> list:
+  '''Streams the orientation of an IMU module as fast as the
+  bus delivers and measures the sample rate and the delay of
+  next() behind the sample it returns'''
+  clear()
+  SimulatedMaster(
+    'sim/bench0', topology={0: ['IMU_1']}, latency=latency)
+  discover()
+  imu = IMU.get()
+  stream = imu.start_stream()
+  delays = list()
+  deadline = perf_counter() + duration
+  while perf_counter() < deadline:
+    sample = stream.next(timeout=1.0)
+    if sample is not None:
+      delays.append(monotonic() - sample[0])
+  imu.stop_stream()
+  clear()
+  return [{
+    'name': 'imu.stream',
+    'params': {'latency_s': latency},
+    'metrics': {
+      'samples': stream.ring.count,
+      'per_second': stream.sample_rate,
+      'errors': stream.errors,
+      'mean_delay_us': sum(delays) / len(delays) * 1e6
+        if delays else None,
+      'max_delay_us': max(delays) * 1e6 if delays else None}}]
+
+
+def compare(results:list, baseline:list):
+  '''Prints the relative change of every numeric metric with
+  respect to the baseline run'''
+  def key(result):
+    return (result['name'],
+            json.dumps(result['params'], sort_keys=True))
+  previous = {key(r): r['metrics'] for r in baseline}
+  for result in results:
+    metrics = previous.get(key(result))
+    if metrics is None:
+      continue
+    for metric, value in result['metrics'].items():
+      old = metrics.get(metric)
+      if isinstance(value, (int, float)) and \
+         not isinstance(value, bool) and old:
+        print("{:<32s} {:<40s} {:<14s} {:>+8.1%}".format(
+          result['name'], json.dumps(result['params']),
+          metric, value / old - 1.0), file=sys.stderr)
+
+
+if __name__ == '__main__':
+
+  args = get_arguments()
+
+  results = list()
+  results += bench_import()
+  results += bench_registry()
+  results += bench_discovery(latency=args.latency)
+  results += bench_commands(args.duration, latency=args.latency)
+  results += bench_group_voltages(args.duration, latency=args.latency)
+  results += bench_control_tick(args.duration, latency=args.latency)
+  results += bench_trajectory(args.duration, latency=args.latency)
+  results += bench_sampling(args.duration, latency=args.latency)
+  results += bench_imu_stream(args.duration, latency=args.latency)
+
+  report = {
+    'timestamp': time(),
+    'python': platform.python_version(),
+    'platform': platform.platform(),
+    'results': results,
+  }
+  if args.output:
+    with open(args.output, 'w') as output_file:
+      json.dump(report, output_file, indent=2)
+  else:
+    json.dump(report, sys.stdout, indent=2)
+    print()
+
+  if args.compare:
+    with open(args.compare) as baseline_file:
+      compare(results, json.load(baseline_file)['results'])
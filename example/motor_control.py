@@ -4,8 +4,9 @@
 
 import argparse
 import math
-from time import sleep
-from acrome_wrapper import Master, discover, setup, layout, Motor
+from acrome_wrapper import \
+  Master, discover, setup, layout, Motor, Scheduler, \
+  Trajectory, TrajectoryStreamer, FeedbackSampler
 
 
 MODES = [
@@ -27,6 +28,12 @@ def get_arguments():
   return parser.parse_args()
   
 
+def format_reading(value:float, width:int) -> str:
+  '''Formats a reading, which is None if the read failed'''
+  if value is None:
+    return f"{'-':>{width}}"
+  return f"{value:>{width}.1f}"
+
 def execute_voltage_control(motor:Motor):
   motor.mode = Motor.Mode.VOLTAGE_CONTROL
   print("VOLTAGE control mode is set")
@@ -35,27 +42,68 @@ def execute_voltage_control(motor:Motor):
   motor.enable()
   amplitude = motor.supply_voltage
   frequency = 0.1
-  T = 0.1
-  for t in [n*T for n in range(0, 1000)]:
+  def control(t:float):
     voltage = amplitude * math.sin(2*math.pi*frequency*t)
     motor.set_voltage(voltage)
     print(f"{voltage:>4.2f}")
-    sleep(T)
+  scheduler = Scheduler()
+  loop = scheduler.add(control, rate=10.0, master=motor.master)
+  scheduler.run(duration=100.0)
+  print(loop.stats)
 
 def execute_position_control(motor:Motor):
   motor.mode = Motor.Mode.POSITION_CONTROL
   print("POSITION control mode is set")
-  raise NotImplementedError
+  motor.shaft_cpr = 6533.0
+  motor.shaft_rpm = 100.0
+  motor.set_position_parameters(p=0.5, i=0.0, d=0.5)
+  motor.enable()
+  start = motor.get_position()
+  if start is None:
+    motor.disable()
+    print("Cannot read the initial position of the motor")
+    return
+  revolution = 6533.0
+  trajectory = Trajectory.linear(
+    [0.0, 2.0, 4.0, 6.0],
+    [[start], [start + revolution], [start + revolution], [start]])
+  streamer = TrajectoryStreamer([motor], trajectory, rate=100.0)
+  streamer.run()
+  print(f"Position: {format_reading(motor.get_position(), 8)}")
+  print(streamer.stats())
 
 def execute_velocity_control(motor:Motor):
   motor.mode = Motor.Mode.VELOCITY_CONTROL
   print("VELOCITY control mode is set")
-  raise NotImplementedError
+  motor.shaft_cpr = 6533.0
+  motor.shaft_rpm = 100.0
+  motor.velocity_limit = 100
+  motor.set_velocity_parameters(p=30.0, i=5.0, d=0.0)
+  motor.enable()
+  amplitude = 80.0
+  frequency = 0.1
+  def control(t:float):
+    velocity = amplitude * math.sin(2*math.pi*frequency*t)
+    motor.set_velocity(velocity)
+    print(f"{velocity:>6.1f} {format_reading(motor.get_velocity(), 6)}")
+  scheduler = Scheduler()
+  loop = scheduler.add(control, rate=10.0, master=motor.master)
+  scheduler.run(duration=100.0)
+  print(loop.stats)
 
 def execute_torque_control(motor:Motor):
   motor.mode = Motor.Mode.TORQUE_CONTROL
   print("TORQUE control mode is set")
-  raise NotImplementedError
+  motor.torque_limit = 1000
+  motor.set_torque_parameters(p=3.0, i=0.1, d=0.0)
+  motor.enable()
+  sampler = FeedbackSampler([motor], ['current'], rate=200.0, samples=200)
+  for torque in (200.0, -200.0, 0.0):
+    motor.set_torque(torque)
+    sampler.run()
+    currents = sampler.column('current', motor)
+    print(f"{torque:>6.1f} mA: {sum(currents) / len(currents):>6.1f} mA")
+  print(sampler.stats())
 
 
 if __name__ == '__main__':
@@ -1,4 +1,105 @@
+import asyncio
+import json
+import math
+import os
+import subprocess
+import sys
+import tempfile
+import threading
 import unittest
+from time import monotonic
+try:
+  import numpy
+except ImportError:
+  numpy = None
+from smd import red
+from acrome_wrapper import Module, Motor, Distance
+from acrome_wrapper import IMU, Joystick, QRT, Potmeter, Buzzer
+from acrome_wrapper import ModuleNotFound, MultipleModulesFound
+from acrome_wrapper import NonUniqueModuleName
+from acrome_wrapper import ModuleGroup, MotorGroup
+from acrome_wrapper import MasterWorker, WorkerError
+from acrome_wrapper import SimulatedMaster, Master
+from acrome_wrapper import discover, validate, clear
+from acrome_wrapper import save_layout, load_layout, InvalidLayoutFile
+from acrome_wrapper import MissingPhysicalModule
+from acrome_wrapper import Scheduler, SchedulerError
+from acrome_wrapper import Recorder, TelemetryLog
+from acrome_wrapper import ReplayMaster
+from acrome_wrapper import instrument, uninstrument, is_instrumented
+from acrome_wrapper import metrics, reset_metrics, prometheus_metrics
+from acrome_wrapper import tune_baudrate, tune, BaudrateError
+from acrome_wrapper import Trajectory, TrajectoryStreamer
+from acrome_wrapper import FeedbackSampler
+from acrome_wrapper import SampleRing, StreamError
+from acrome_wrapper import BackgroundTask
+
+
+class StubMaster:
+  '''Minimal stand-in for a Master which is enough for module
+  bookkeeping without a serial device. Bus calls are only
+  recorded.'''
+
+  def __init__(self, name):
+    self.name = name
+    self.device_path = '/dev/{}'.format(name)
+    self.calls = list()
+    self.variables = dict()
+
+  async def arun(self, function, *args, **kwargs):
+    return function(*args, **kwargs)
+
+  def post(self, key, method, **kwargs):
+    return getattr(self, method)(**kwargs)
+
+  def fetch(self, method, **kwargs):
+    return getattr(self, method)(**kwargs)
+
+  def read_variables(self, smd_id, index_list):
+    self.calls.append(('read_variables', (smd_id, index_list), {}))
+    return [self.variables.get((smd_id, index)) for index in index_list]
+
+  def __getattr__(self, attr):
+    def call(*args, **kwargs):
+      self.calls.append((attr, args, kwargs))
+    return call
+
+  def __str__(self):
+    return self.name
+
+
+class TrackingPort:
+  '''Serial port stand-in without any locking which counts
+  transactions (a write followed by a response read) of
+  different threads overlapping on the bus. Reads time out
+  right away.'''
+
+  is_open = True
+  baudrate = 115200
+  timeout = 0.1
+
+  def __init__(self):
+    self.owner = None
+    self.transactions = 0
+    self.overlaps = 0
+
+  def write(self, data):
+    if self.owner is not None:
+      self.overlaps += 1
+    self.owner = threading.get_ident()
+    threading.Event().wait(0.0005)
+
+  def read(self, size):
+    if self.owner != threading.get_ident():
+      self.overlaps += 1
+    self.owner = None
+    self.transactions += 1
+    return b''
+
+  def reset_input_buffer(self):
+    pass
+
+  reset_output_buffer = reset_input_buffer
 
 
 class TestWrapper(unittest.TestCase):
@@ -7,5 +108,1193 @@ class TestWrapper(unittest.TestCase):
     self.assertEqual(True, True)
 
 
+class TestModuleRegistry(unittest.TestCase):
+
+  def setUp(self):
+    Module.clear()
+    self.usb0 = StubMaster('USB0')
+    self.usb1 = StubMaster('USB1')
+    self.motor_0 = Motor.add(master=self.usb0, smd_id=0)
+    self.motor_1 = Motor.add(master=self.usb1, smd_id=1)
+    self.distance = Module.add(
+      master=self.usb0, smd_id=0,
+      kind=Module.Kind.DISTANCE, mod_id=2)
+
+  def tearDown(self):
+    Module.clear()
+
+  def test_find_preserves_insertion_order(self):
+    self.assertEqual(
+      Module.find(),
+      [self.motor_0, self.motor_1, self.distance])
+    self.assertEqual(
+      Module.find(master=self.usb0),
+      [self.motor_0, self.distance])
+
+  def test_find_intersects_conditions(self):
+    self.assertEqual(
+      Module.find(master=self.usb0, kind=Module.Kind.MOTOR),
+      [self.motor_0])
+    self.assertEqual(
+      Module.find(master=self.usb1, smd_id=0), [])
+    self.assertEqual(Distance.find(mod_id=2), [self.distance])
+    self.assertEqual(Motor.find(mod_id=1), [self.motor_1])
+
+  def test_get(self):
+    self.assertIs(Motor.get(master=self.usb1), self.motor_1)
+    with self.assertRaises(ModuleNotFound):
+      Motor.get(smd_id=7)
+    with self.assertRaises(MultipleModulesFound):
+      Module.get(kind=Module.Kind.MOTOR)
+
+  def test_register_kind(self):
+    class Sonar(Distance):
+      pass
+    Module.register_kind(Sonar)
+    try:
+      sonar = Module.add(
+        master=self.usb1, smd_id=1,
+        kind=Module.Kind.DISTANCE, mod_id=1)
+    finally:
+      Module.register_kind(Distance)
+    self.assertIsInstance(sonar, Sonar)
+    self.assertEqual(Distance.find(), [self.distance, sonar])
+    self.assertEqual(
+      Module.parse_label('QTR_2'), (Module.Kind.QRT, 2))
+
+  def test_rename_is_indexed(self):
+    old_name = self.motor_0.name
+    self.motor_0.name = 'Left Motor'
+    self.assertIs(Module.get(name='Left Motor'), self.motor_0)
+    self.assertEqual(Module.find(name=old_name), [])
+
+  def test_name_uniqueness_follows_renames(self):
+    old_name = self.motor_0.name
+    self.motor_0.name = 'Left Motor'
+    with self.assertRaises(NonUniqueModuleName):
+      self.motor_1.name = 'Left Motor'
+    self.motor_1.name = old_name
+    self.assertIs(Module.get(name=old_name), self.motor_1)
+
+  def test_variable_range(self):
+    self.assertEqual(self.distance._variable(), red.Index.Distance_2)
+    for mod_id in (0, 6):
+      sonar = Module.add(
+        master=self.usb1, smd_id=1,
+        kind=Module.Kind.DISTANCE, mod_id=mod_id)
+      with self.assertRaises(red.InvalidIndexError):
+        sonar._variable()
+
+  def test_clear(self):
+    Module.clear()
+    self.assertEqual(Module.all(), [])
+    self.assertEqual(Motor.find(master=self.usb0), [])
+    motor = Motor.add(
+      master=self.usb0, smd_id=0, name=self.motor_0.name)
+    self.assertEqual(Module.all(), [motor])
+
+
+class TestMotorGroup(unittest.TestCase):
+
+  def setUp(self):
+    Module.clear()
+    self.usb0 = StubMaster('USB0')
+    self.usb1 = StubMaster('USB1')
+    for master, smd_id in [
+        (self.usb0, 0), (self.usb1, 1), (self.usb0, 2)]:
+      motor = Motor.add(master=master, smd_id=smd_id)
+      motor.mode = Motor.Mode.VOLTAGE_CONTROL
+    Motor.get(smd_id=2).polarity = Motor.Polarity.NEGATIVE
+    self.group = MotorGroup(Motor.all())
+    self.group.enable()
+    self.usb0.calls.clear()
+    self.usb1.calls.clear()
+
+  def tearDown(self):
+    Module.clear()
+
+  def test_one_write_per_master(self):
+    voltages = self.group.set_voltages([6.0, -24.0, 3.0])
+    self.assertEqual(voltages, [6.0, -12.0, 3.0])
+    self.assertEqual(
+      self.usb0.calls,
+      [('set_duty_cycles', (),
+        {'id_pct_pairs': [(0, 50.0), (2, -25.0)]})])
+    self.assertEqual(
+      self.usb1.calls,
+      [('set_duty_cycles', (), {'id_pct_pairs': [(1, -100.0)]})])
+
+  def test_async_set_voltages(self):
+    voltages = asyncio.run(
+      self.group.aset_voltages([6.0, -24.0, 3.0]))
+    self.assertEqual(voltages, [6.0, -12.0, 3.0])
+    self.assertEqual(len(self.usb0.calls), 1)
+    self.assertEqual(len(self.usb1.calls), 1)
+
+  def test_checks_before_writing(self):
+    Motor.get(smd_id=1).disable()
+    with self.assertRaises(Motor.NotEnabledError):
+      self.group.set_voltages([1.0, 1.0, 1.0])
+    self.assertNotIn(
+      'set_duty_cycles', [c[0] for c in self.usb0.calls])
+    with self.assertRaises(ValueError):
+      self.group.set_voltages([1.0])
+
+  @unittest.skipIf(numpy is None, 'NumPy is not installed')
+  def test_array_voltages(self):
+    voltages = self.group.set_voltages(numpy.array([6.0, -24.0, 3.0]))
+    self.assertIsInstance(voltages, numpy.ndarray)
+    self.assertEqual(voltages.tolist(), [6.0, -12.0, 3.0])
+    self.assertEqual(
+      self.usb0.calls,
+      [('set_duty_cycles', (),
+        {'id_pct_pairs': [(0, 50.0), (2, -25.0)]})])
+    self.assertEqual(Motor.get(smd_id=1).get_voltage(), -12.0)
+    Motor.get(smd_id=0).supply_voltage = 24.0
+    voltages = self.group.set_voltages(numpy.array([6.0, 0.0, 0.0]))
+    self.assertEqual(voltages.tolist(), [6.0, 0.0, 0.0])
+    self.assertEqual(
+      self.usb0.calls[-1][2]['id_pct_pairs'], [(0, 25.0), (2, -0.0)])
+    with self.assertRaises(ValueError):
+      self.group.set_voltages(numpy.zeros((3, 1)))
+
+  @unittest.skipIf(numpy is None, 'NumPy is not installed')
+  def test_array_voltages_after_id_change(self):
+    self.group.set_voltages(numpy.array([6.0, 0.0, 3.0]))
+    Motor.get(smd_id=2).mod_id = 5
+    self.group.set_voltages(numpy.array([6.0, 0.0, 3.0]))
+    self.assertEqual(
+      self.usb0.calls[-1][2]['id_pct_pairs'], [(0, 50.0), (5, -25.0)])
+
+
+class TestModuleGroupRead(unittest.TestCase):
+
+  def setUp(self):
+    Module.clear()
+    self.usb0 = StubMaster('USB0')
+    self.motor = Motor.add(master=self.usb0, smd_id=0)
+    self.distances = [
+      Module.add(master=self.usb0, smd_id=0,
+                 kind=Module.Kind.DISTANCE, mod_id=mod_id)
+      for mod_id in (1, 2)]
+    self.usb0.variables.update({
+      (0, red.Index.TorqueEnable): 1,
+      (0, red.Index.OperationMode): 0,
+      (0, red.Index.PresentVelocity): 30.0,
+      (0, red.Index.PresentPosition): 1200.0,
+      (0, red.Index.MotorCurrent): 150.0,
+      (0, red.Index.Distance_1): 40,
+      (0, red.Index.Distance_2): 55,
+    })
+
+  def tearDown(self):
+    Module.clear()
+
+  def test_one_transaction_per_smd(self):
+    snapshot = ModuleGroup(Module.all()).read()
+    self.assertEqual(len(self.usb0.calls), 1)
+    self.assertEqual(snapshot[self.motor], {
+      'enabled': True, 'mode': Motor.Mode.VOLTAGE_CONTROL,
+      'velocity': 30.0, 'position': 1200.0, 'current': 150.0})
+    self.assertEqual(snapshot.values_of('distance'), [40, 55])
+    self.assertTrue(self.motor._is_enabled)
+
+  def test_async_read(self):
+    snapshot = asyncio.run(ModuleGroup(Module.all()).aread())
+    self.assertEqual(list(snapshot), Module.all())
+    self.assertEqual(snapshot.values_of('distance'), [40, 55])
+
+  def test_selected_quantities(self):
+    snapshot = ModuleGroup(Module.all()).read(['distance'])
+    self.assertEqual(snapshot[self.motor], {})
+    self.assertEqual(
+      self.usb0.calls[0][1],
+      (0, [red.Index.Distance_1, red.Index.Distance_2]))
+
+
+class TestMotorStateCache(unittest.TestCase):
+
+  def setUp(self):
+    Module.clear()
+    self.usb0 = StubMaster('USB0')
+    self.motor = Motor.add(master=self.usb0, smd_id=0)
+
+  def tearDown(self):
+    Module.clear()
+
+  def test_reads_every_time_by_default(self):
+    calls = []
+    self.usb0.get_operation_mode = lambda id: calls.append(id) or 1
+    for _ in range(3):
+      self.assertEqual(self.motor.mode, Motor.Mode.POSITION_CONTROL)
+    self.assertEqual(len(calls), 3)
+    self.assertEqual(self.motor.cache.hits, 0)
+
+  def test_fresh_state_is_served_from_cache(self):
+    calls = []
+    self.usb0.get_operation_mode = lambda id: calls.append(id) or 1
+    self.motor.cache.set_ttl(mode=None)
+    for _ in range(3):
+      self.motor.mode
+    self.assertEqual(len(calls), 1)
+    self.assertEqual(
+      (self.motor.cache.hits, self.motor.cache.misses), (2, 1))
+    self.motor.invalidate('mode')
+    self.motor.mode
+    self.assertEqual(len(calls), 2)
+
+  def test_writes_refresh_the_cache(self):
+    self.motor.cache.set_ttl(is_enabled=None)
+    self.motor.enable()
+    self.assertTrue(self.motor.is_enabled)
+    self.assertEqual(self.motor.cache.hits, 1)
+
+
+class GatedMaster(StubMaster):
+  '''Stub master whose duty cycle writes block until the
+  gate is opened'''
+
+  def __init__(self, name):
+    super().__init__(name)
+    self.entered = threading.Event()
+    self.gate = threading.Event()
+    self.failing = False
+
+  def set_duty_cycle(self, id, pct):
+    self.entered.set()
+    self.gate.wait()
+    if id >= 200:
+      raise IOError('No SMD {}'.format(id))
+    self.calls.append(('set_duty_cycle', (id, pct), {}))
+
+  def get_distance(self, id, module_id):
+    if self.failing:
+      raise IOError('No response')
+    return 10 * id + module_id
+
+
+class TestMasterWorker(unittest.TestCase):
+
+  def setUp(self):
+    self.master = GatedMaster('USB0')
+    self.worker = MasterWorker(self.master)
+    self.worker.start()
+
+  def tearDown(self):
+    self.master.gate.set()
+    self.worker.stop()
+
+  def test_superseded_writes_are_coalesced(self):
+    key = ('set_duty_cycle', 0)
+    self.worker.submit(key, 'set_duty_cycle', {'id': 0, 'pct': 1})
+    self.master.entered.wait()
+    for pct in (2, 3, 4):
+      self.worker.submit(
+        key, 'set_duty_cycle', {'id': 0, 'pct': pct})
+    self.master.gate.set()
+    self.worker.stop()
+    self.assertEqual(
+      [c[1] for c in self.master.calls], [(0, 1), (0, 4)])
+
+  def test_failed_write_keeps_later_writes(self):
+    self.worker.submit(
+      ('set_duty_cycle', 0), 'set_duty_cycle', {'id': 0, 'pct': 1})
+    self.master.entered.wait()
+    for smd_id in (200, 1):
+      self.worker.submit(
+        ('set_duty_cycle', smd_id), 'set_duty_cycle',
+        {'id': smd_id, 'pct': 2})
+    self.master.gate.set()
+    self.worker.stop()
+    self.assertEqual(
+      [c[1] for c in self.master.calls], [(0, 1), (1, 2)])
+    with self.assertRaises(WorkerError):
+      self.worker.submit(
+        ('set_duty_cycle', 1), 'set_duty_cycle', {'id': 1, 'pct': 3})
+
+  def test_unkeyed_writes_keep_their_order(self):
+    self.worker.submit(
+      ('set_duty_cycle', 0), 'set_duty_cycle', {'id': 0, 'pct': 1})
+    self.master.entered.wait()
+    self.worker.submit(None, 'enable_torque', {'id': 0, 'en': False})
+    self.worker.submit(None, 'set_operation_mode', {'id': 0, 'mode': 2})
+    self.worker.submit(None, 'enable_torque', {'id': 0, 'en': True})
+    self.master.gate.set()
+    self.worker.stop()
+    self.assertEqual(
+      [(c[0], c[2]) for c in self.master.calls[1:]], [
+        ('enable_torque', {'id': 0, 'en': False}),
+        ('set_operation_mode', {'id': 0, 'mode': 2}),
+        ('enable_torque', {'id': 0, 'en': True})])
+
+  def test_reads_are_polled(self):
+    self.master.gate.set()
+    self.worker.poll(('d', 2, 3), 'get_distance', {'id': 2, 'module_id': 3})
+    self.assertEqual(self.worker.latest(('d', 2, 3)), 23)
+    self.assertIsNotNone(self.worker.timestamp(('d', 2, 3)))
+
+  def test_one_shot_calls(self):
+    self.master.gate.set()
+    self.assertEqual(
+      self.worker.call('get_distance', {'id': 1, 'module_id': 2}), 12)
+    self.assertFalse(self.worker.is_polled(('d', 1, 2)))
+    with self.assertRaises(KeyError):
+      self.worker.latest(('d', 1, 2))
+
+  def test_failed_poll_is_dropped(self):
+    self.master.gate.set()
+    self.master.failing = True
+    self.worker.poll(('d', 2, 3), 'get_distance', {'id': 2, 'module_id': 3})
+    with self.assertRaises(WorkerError):
+      self.worker.latest(('d', 2, 3))
+    self.assertFalse(self.worker.is_polled(('d', 2, 3)))
+    with self.assertRaises(IOError):
+      self.worker.call('get_distance', {'id': 2, 'module_id': 3})
+    self.master.failing = False
+    self.assertEqual(
+      self.worker.call('get_distance', {'id': 2, 'module_id': 3}), 23)
+    self.worker.poll(('d', 2, 3), 'get_distance', {'id': 2, 'module_id': 3})
+    self.assertEqual(self.worker.latest(('d', 2, 3)), 23)
+
+
+class TestSimulatedSystem(unittest.TestCase):
+
+  TOPOLOGY = {
+    0: ['Distance_1', 'Distance_2'],
+    4: [],
+    7: ['Distance_3'],
+  }
+
+  def setUp(self):
+    clear()
+    self.left = SimulatedMaster('sim/left', topology=self.TOPOLOGY)
+    self.right = SimulatedMaster('sim/right', topology={1: []})
+
+  def tearDown(self):
+    clear()
+
+  def test_discovery(self):
+    discover()
+    self.assertEqual(len(Motor.find(master=self.left)), 3)
+    self.assertEqual(len(Distance.find(master=self.left)), 3)
+    self.assertIs(Motor.get(master=self.right).master, self.right)
+    names = [m.name for m in Module.all()]
+    discover(concurrent=True)
+    self.assertEqual([m.name for m in Module.all()], names)
+
+  def test_motor_and_distance(self):
+    self.left.sensor = lambda smd_id, index: 42
+    discover()
+    motor = Motor.get(master=self.left, smd_id=4)
+    motor.setup()
+    motor.enable()
+    self.assertEqual(motor.set_voltage(6.0), 6.0)
+    self.assertEqual(motor.mode, Motor.Mode.VOLTAGE_CONTROL)
+    self.assertTrue(motor.is_enabled)
+    self.assertEqual(
+      self.left.smds[4].get(red.Index.SetDutyCycle), 50.0)
+    self.assertEqual(Distance.get(mod_id=3).measure(), 42)
+
+  def test_mixed_rig(self):
+    mixed = SimulatedMaster('sim/mixed', topology={
+      2: ['IMU_1', 'Joystick_1', 'QTR_1', 'Pot_2', 'Buzzer_1',
+          'Gripper_1']})
+    mixed.sensor = lambda smd_id, index: {
+      red.Index.IMU_1: [1.5, -2.0],
+      red.Index.Joystick_1: [10, -20, 1],
+      red.Index.QTR_1: 0b101}.get(index, 7)
+    with self.assertWarns(UserWarning):
+      mixed.discover()
+    self.assertEqual(
+      [m.kind.value for m in Module.find(master=mixed)],
+      ['Motor', 'IMU', 'Joystick', 'QRT', 'Potmeter', 'Buzzer'])
+    self.assertEqual(IMU.get().get_orientation(), (1.5, -2.0))
+    self.assertEqual(Joystick.get().get_axes(), (10, -20))
+    self.assertTrue(Joystick.get().is_pressed())
+    self.assertEqual(QRT.get().detect(), (True, False, True))
+    self.assertEqual(Potmeter.get(mod_id=2).measure(), 7)
+    Buzzer.get().play(440)
+    self.assertEqual(mixed.smds[2].get(red.Index.Buzzer_1), 440)
+    snapshot = ModuleGroup(Module.find(master=mixed)).read()
+    self.assertEqual(
+      snapshot[IMU.get()], {'roll': 1.5, 'pitch': -2.0})
+
+  def test_velocity_control(self):
+    discover()
+    motor = Motor.get(master=self.left, smd_id=4)
+    motor.shaft_cpr = 4096.0
+    motor.shaft_rpm = 200.0
+    self.assertEqual(motor.shaft_cpr, 4096.0)
+    self.assertEqual(motor.shaft_rpm, 200.0)
+    motor.velocity_limit = 150
+    motor.set_velocity_parameters(p=2.0, ol=500.0)
+    parameters = motor.get_velocity_parameters()
+    self.assertEqual((parameters['p'], parameters['ol']), (2.0, 500.0))
+    motor.mode = Motor.Mode.VELOCITY_CONTROL
+    with self.assertRaises(Motor.NotEnabledError):
+      motor.set_velocity(50.0)
+    motor.enable()
+    motor.polarity = Motor.Polarity.NEGATIVE
+    self.assertEqual(motor.set_velocity(-200.0), -150.0)
+    self.assertEqual(
+      self.left.smds[4].get(red.Index.SetVelocity), 150.0)
+    self.assertEqual(motor.get_velocity(), -150.0)
+    self.assertEqual(motor.get_velocity_set_point(), -150.0)
+    with self.assertRaises(Motor.IncorrectModeError):
+      motor.set_voltage(1.0)
+
+  def test_group_velocities(self):
+    discover()
+    group = MotorGroup(Motor.find(master=self.left))
+    for motor in group:
+      motor.mode = Motor.Mode.VELOCITY_CONTROL
+    group.enable()
+    transactions = self.left.transactions
+    self.assertEqual(
+      group.set_velocities([10.0, 20.0, 30.0]), [10.0, 20.0, 30.0])
+    self.assertEqual(self.left.transactions, transactions + 1)
+    self.assertEqual(group.get_velocities(), [10.0, 20.0, 30.0])
+    self.assertEqual(self.left.transactions, transactions + 4)
+
+  def test_worker_runs_bus_calls(self):
+    threads = set()
+    ping = self.left.ping
+    def recorded_ping(id):
+      threads.add(threading.current_thread().name)
+      return ping(id)
+    self.left.ping = recorded_ping
+    self.left.start_worker()
+    discover()
+    self.assertTrue(validate())
+    motor = Motor.get(master=self.left, smd_id=4)
+    self.assertIsNotNone(motor.get_info())
+    distance = Distance.get(mod_id=3)
+    self.left.sensor = lambda smd_id, index: 42
+    self.left.poll('get_distance', id=7, module_id=3)
+    self.assertEqual(distance.measure(), 42)
+    self.left.sensor = lambda smd_id, index: 43
+    while distance.measure() != 43:
+      threading.Event().wait(0.001)
+    self.left.stop_worker()
+    self.assertEqual(threads, {'left-io'})
+
+  def test_validate_reuses_discovery(self):
+    discover()
+    transactions = self.left.transactions
+    self.assertTrue(validate())
+    # a ping per SMD, the module scans are reused
+    self.assertEqual(self.left.transactions, transactions + 3)
+    self.assertTrue(validate(incremental=True))
+    self.assertEqual(self.left.transactions, transactions + 3)
+    self.left.smds.pop(4)
+    with self.assertRaises(MissingPhysicalModule):
+      validate()
+
+  def test_validate_queries_referenced_smds_only(self):
+    Module.add(master=self.left, smd_id=4, kind=Module.Kind.MOTOR)
+    Module.add(master=self.left, smd_id=7,
+               kind=Module.Kind.DISTANCE, mod_id=3)
+    self.assertTrue(validate())
+    # two pings and a single module scan
+    self.assertEqual(self.left.transactions, 3)
+    Module.add(master=self.left, smd_id=4,
+               kind=Module.Kind.DISTANCE, mod_id=1)
+    with self.assertRaises(MissingPhysicalModule):
+      validate(masters=self.left)
+    self.assertTrue(validate(modules=Motor.all()))
+
+  def test_layout_round_trip(self):
+    discover()
+    names = [m.name for m in Module.all()]
+    fd, path = tempfile.mkstemp(suffix='.json')
+    os.close(fd)
+    try:
+      save_layout(path)
+      Module.clear()
+      transactions = self.left.transactions
+      self.assertIsNone(load_layout(path))
+      self.assertEqual([m.name for m in Module.all()], names)
+      self.assertEqual(self.left.transactions, transactions)
+      self.assertTrue(load_layout(path, verify=True).result())
+    finally:
+      os.remove(path)
+
+  def test_layout_topology_hashes(self):
+    discover()
+    fd, path = tempfile.mkstemp(suffix='.json')
+    os.close(fd)
+    try:
+      save_layout(path)
+      with open(path) as layout_file:
+        content = json.load(layout_file)
+      # SMD 7 lost its hash, SMD 0 reported another module
+      content['smds'] = [
+        spec for spec in content['smds'] if spec['smd_id'] != 7]
+      content['smds'][0]['hash'] = '0' * 16
+      with open(path, 'w') as layout_file:
+        json.dump(content, layout_file)
+      self.left._topology.clear()
+      load_layout(path)
+      transactions = self.left.transactions
+      self.assertTrue(validate())
+      # SMDs 0 and 7 are pinged and scanned, SMD 4 is trusted
+      # and only pinged
+      self.assertEqual(self.left.transactions, transactions + 5)
+    finally:
+      os.remove(path)
+
+  def test_invalid_layout(self):
+    discover()
+    names = [m.name for m in Module.all()]
+    fd, path = tempfile.mkstemp(suffix='.json')
+    os.close(fd)
+    try:
+      save_layout(path)
+      with open(path) as layout_file:
+        content = json.load(layout_file)
+      content['modules'][-1]['kind'] = 'Gripper'
+      with open(path, 'w') as layout_file:
+        json.dump(content, layout_file)
+      with self.assertRaises(InvalidLayoutFile):
+        load_layout(path)
+      self.assertEqual([m.name for m in Module.all()], names)
+      with open(path, 'w') as layout_file:
+        layout_file.write('{"version": 2, "masters": [')
+      with self.assertRaises(InvalidLayoutFile):
+        load_layout(path)
+    finally:
+      os.remove(path)
+
+  def test_latency_and_drops(self):
+    sim = SimulatedMaster(
+      'sim/lossy', topology={0: []}, latency=0.002,
+      drop_rate=1.0)
+    sim.attach_id(0)
+    start = monotonic()
+    self.assertIsNone(sim.get_variables(0, [red.Index.TorqueEnable]))
+    self.assertGreaterEqual(monotonic() - start, 0.002)
+    self.assertEqual(sim.dropped, 1)
+
+
+class TestScheduler(unittest.TestCase):
+
+  def test_rates_and_deadlines(self):
+    # virtual time: sleeping advances the clock, so the
+    # schedule does not depend on the load of the host
+    now = [0.0]
+    done = threading.Event()
+    def sleep(seconds):
+      now[0] += seconds + 1e-9
+      if now[0] >= 0.2:
+        done.set()
+        return True
+      return False
+    scheduler = Scheduler(clock=lambda: now[0], sleep=sleep)
+    times = {'fast': list(), 'slow': list()}
+    fast = scheduler.add(times['fast'].append, rate=200.0, name='fast')
+    slow = scheduler.add(times['slow'].append, rate=50.0, name='slow')
+    scheduler.start()
+    self.assertTrue(done.wait(5.0))
+    scheduler.stop()
+    self.assertEqual(fast.stats.ticks, 40)
+    self.assertEqual(slow.stats.ticks, 10)
+    # callbacks receive the absolute schedule, not the wall time
+    self.assertEqual(times['slow'][:3], [0.0, 0.02, 0.04])
+    self.assertEqual(fast.stats.overruns, 0)
+    self.assertEqual(set(scheduler.stats()), {'fast', 'slow'})
+
+  def test_overruns(self):
+    overruns = list()
+    scheduler = Scheduler()
+    loop = scheduler.add(
+      lambda t: threading.Event().wait(0.025), period=0.01,
+      on_overrun=lambda loop, lateness: overruns.append(lateness))
+    scheduler.run(duration=0.1)
+    self.assertGreater(loop.stats.overruns, 0)
+    self.assertGreaterEqual(loop.stats.skipped, loop.stats.overruns)
+    self.assertEqual(len(overruns), loop.stats.overruns)
+    self.assertGreaterEqual(loop.stats.max_execution, 0.025)
+
+  def test_callback_error(self):
+    scheduler = Scheduler()
+    scheduler.add(lambda t: 1 / 0, rate=100.0, name='broken')
+    with self.assertRaises(SchedulerError):
+      scheduler.run(duration=1.0)
+    self.assertFalse(scheduler.is_running)
+
+
+class TestTrajectory(unittest.TestCase):
+
+  def setUp(self):
+    clear()
+    self.left = SimulatedMaster('sim/left', topology={0: [], 1: []})
+    self.right = SimulatedMaster('sim/right', topology={2: []})
+    discover()
+    self.group = MotorGroup(Motor.all())
+    for motor in self.group:
+      motor.mode = Motor.Mode.POSITION_CONTROL
+    self.group.enable()
+
+  def tearDown(self):
+    clear()
+
+  def test_linear_waypoints(self):
+    trajectory = Trajectory.linear(
+      [0.0, 1.0, 3.0], [[0.0, 10.0], [100.0, 10.0], [100.0, 30.0]])
+    self.assertEqual(trajectory.duration, 3.0)
+    self.assertEqual(trajectory(0.5), [50.0, 10.0])
+    self.assertEqual(trajectory(2.0), [100.0, 20.0])
+    self.assertEqual(trajectory(5.0), [100.0, 30.0])
+    self.assertEqual(len(trajectory.sample(0.5)), 7)
+    with self.assertRaises(ValueError):
+      Trajectory.linear([0.0, 0.0], [[0.0], [1.0]])
+
+  def test_position_commands(self):
+    motor = Motor.get(smd_id=2)
+    motor.position_limits = (-500, 500)
+    self.assertEqual(motor.position_limits, (-500, 500))
+    motor.polarity = Motor.Polarity.NEGATIVE
+    self.assertEqual(motor.set_position(800.0), 500.0)
+    self.assertEqual(
+      self.right.smds[2].get(red.Index.SetPosition), -500.0)
+    self.assertEqual(motor.get_position(), 500.0)
+    self.assertEqual(
+      self.group.set_positions([10.0, 20.0, 30.0]), [10.0, 20.0, 30.0])
+    self.assertEqual(self.group.get_positions(), [10.0, 20.0, 30.0])
+
+  def test_streaming(self):
+    trajectory = Trajectory.linear(
+      [0.0, 0.2], [[0.0, 0.0, 0.0], [1000.0, -1000.0, 500.0]])
+    streamer = TrajectoryStreamer(self.group, trajectory, rate=100.0)
+    self.assertEqual(len(streamer.schedule), 21)
+    self.assertEqual(streamer.schedule[10], [500.0, -500.0, 250.0])
+    transactions = self.left.transactions
+    streamer.run()
+    self.assertTrue(streamer.finished)
+    self.assertFalse(streamer.is_running)
+    self.assertEqual(
+      [self.left.smds[0].get(red.Index.SetPosition),
+       self.left.smds[1].get(red.Index.SetPosition),
+       self.right.smds[2].get(red.Index.SetPosition)],
+      [1000.0, -1000.0, 500.0])
+    self.assertEqual(
+      [m.get_position_set_point() for m in self.group],
+      [1000.0, -1000.0, 500.0])
+    # one synchronized frame per tick for both motors
+    self.assertLessEqual(self.left.transactions - transactions, 21)
+    self.assertEqual(len(streamer.stats()), 2)
+    with self.assertRaises(ValueError):
+      TrajectoryStreamer(self.group[:2], trajectory)
+
+  def test_polarity_change_after_construction(self):
+    trajectory = Trajectory.linear(
+      [0.0, 0.05], [[0.0, 0.0, 0.0], [100.0, 200.0, 300.0]])
+    streamer = TrajectoryStreamer(self.group, trajectory, rate=100.0)
+    self.group[2].polarity = Motor.Polarity.NEGATIVE
+    streamer.run()
+    self.assertEqual(
+      self.right.smds[2].get(red.Index.SetPosition), -300.0)
+
+  def test_checks_modes(self):
+    Motor.get(smd_id=0).mode = Motor.Mode.VELOCITY_CONTROL
+    streamer = TrajectoryStreamer(
+      self.group, Trajectory(lambda t: [t, t, t], 0.1))
+    with self.assertRaises(Motor.IncorrectModeError):
+      streamer.start()
+    self.assertFalse(streamer.is_running)
+
+
+class TestTorqueSampling(unittest.TestCase):
+
+  def setUp(self):
+    clear()
+    self.left = SimulatedMaster('sim/left', topology={0: [], 1: []})
+    self.right = SimulatedMaster('sim/right', topology={2: []})
+    discover()
+    self.group = MotorGroup(Motor.all())
+    for motor in self.group:
+      motor.mode = Motor.Mode.TORQUE_CONTROL
+    self.group.enable()
+
+  def tearDown(self):
+    clear()
+
+  def test_torque_commands(self):
+    motor = Motor.get(smd_id=1)
+    motor.torque_limit = 800
+    self.assertEqual(motor.torque_limit, 800)
+    motor.set_torque_parameters(p=1.5)
+    self.assertEqual(motor.get_torque_parameters()['p'], 1.5)
+    motor.polarity = Motor.Polarity.NEGATIVE
+    self.assertEqual(motor.set_torque(-1000.0), -800.0)
+    self.assertEqual(self.left.smds[1].get(red.Index.SetTorque), 800.0)
+    self.assertEqual(motor.get_current(), -800.0)
+    self.assertEqual(motor.get_torque_set_point(), -800.0)
+    transactions = self.left.transactions
+    self.group.set_torques([100.0, 200.0, 300.0])
+    self.assertEqual(self.left.transactions, transactions + 1)
+    self.assertEqual(self.group.get_currents(), [100.0, 200.0, 300.0])
+
+  def test_sampling(self):
+    self.group.set_torques([100.0, -50.0, 300.0])
+    sampler = FeedbackSampler(
+      self.group, ['current', 'position'], rate=200.0, samples=10)
+    transactions = self.left.transactions
+    sampler.run()
+    self.assertTrue(sampler.full)
+    self.assertFalse(sampler.is_running)
+    self.assertEqual(self.left.transactions - transactions, 2 * 10)
+    self.assertEqual(sampler.latest('current'), [100.0, -50.0, 300.0])
+    self.assertEqual(
+      sampler.column('current', self.group[1]).tolist(), [-50.0] * 10)
+    self.assertEqual(len(sampler.values('position')), 30)
+    self.assertEqual(sampler.times[9], 9 * 0.005)
+    with self.assertRaises(ValueError):
+      FeedbackSampler(self.group, ['mode'])
+
+  def test_polarity_change_after_construction(self):
+    self.group.set_torques([100.0, -50.0, 300.0])
+    sampler = FeedbackSampler(self.group, rate=200.0, samples=3)
+    self.group[1].polarity = Motor.Polarity.NEGATIVE
+    sampler.run()
+    self.assertEqual(sampler.latest('current'), [100.0, 50.0, 300.0])
+
+  def test_failed_reads(self):
+    self.right.drop_rate = 1.0
+    sampler = FeedbackSampler(self.group, rate=200.0, samples=3).run()
+    current = sampler.latest('current')
+    self.assertEqual(current[:2], [0.0, 0.0])
+    self.assertTrue(math.isnan(current[2]))
+
+
+class TestBusTransactions(unittest.TestCase):
+
+  def setUp(self):
+    clear()
+    self.master = Master('loop://', name='tracked', lazy=True)
+    self.master._port = self.port = TrackingPort()
+    self.master.attach_id(1)
+    self.motor = Module.add(
+      master=self.master, smd_id=1, kind=Module.Kind.MOTOR)
+
+  def tearDown(self):
+    self.master._port = None
+    clear()
+
+  def test_background_and_caller_threads(self):
+    sampler = FeedbackSampler(
+      [self.motor], ['position'], rate=500.0, samples=50)
+    sampler.start()
+    reads = 0
+    while sampler.is_running and not sampler.full:
+      self.master.fetch(
+        'read_variables', smd_id=1,
+        index_list=[red.Index.PresentVelocity])
+      reads += 1
+    sampler.wait(5.0)
+    self.assertGreater(reads, 0)
+    self.assertGreater(self.port.transactions, reads)
+    self.assertEqual(self.port.overlaps, 0)
+
+  def test_transaction_with_worker(self):
+    self.master.start_worker(poll_period=0.001)
+    results = list()
+    def transaction():
+      try:
+        with self.master.transaction:
+          self.motor.enable()
+          results.append(self.master.fetch(
+            'read_variables', smd_id=1,
+            index_list=[red.Index.PresentPosition]))
+      except Exception as error:
+        results.append(error)
+    try:
+      caller = threading.Thread(target=transaction, daemon=True)
+      caller.start()
+      caller.join(5.0)
+      self.assertFalse(caller.is_alive())
+    finally:
+      self.master.stop_worker()
+    self.assertEqual(results, [[None]])
+
+
+class TestIMUStream(unittest.TestCase):
+
+  def setUp(self):
+    clear()
+    self.readings = 0
+    self.failing = False
+    def sensor(smd_id, index):
+      if self.failing:
+        raise OSError('bus fault')
+      self.readings += 1
+      return [float(self.readings), -1.0]
+    self.sim = SimulatedMaster(
+      'sim/imu', topology={0: ['IMU_1']}, sensor=sensor)
+    discover()
+    self.imu = IMU.get()
+
+  def tearDown(self):
+    self.imu.stop_stream()
+    clear()
+
+  def test_ring_views(self):
+    ring = SampleRing(['roll'], capacity=4)
+    for n in range(6):
+      ring.append(0.1 * n, [float(n)])
+    self.assertEqual(len(ring), 4)
+    self.assertEqual(ring.view('roll').tolist(), [2.0, 3.0, 4.0, 5.0])
+    times, rolls = ring.views(2)
+    self.assertEqual(rolls.tolist(), [4.0, 5.0])
+    self.assertEqual(times.obj, ring._times)
+    self.assertEqual(ring.latest(), (0.5, 5.0))
+    self.assertEqual(ring.wait(5, timeout=0.0), 6)
+
+  def test_streaming(self):
+    stream = self.imu.start_stream(capacity=16)
+    self.assertIs(self.imu.stream, stream)
+    t, roll, pitch = stream.next(timeout=1.0)
+    self.assertEqual(pitch, -1.0)
+    later = stream.next(timeout=1.0)
+    self.assertGreater(later[1], roll)
+    self.assertGreater(later[0], t)
+    self.assertEqual(self.imu.get_orientation()[1], -1.0)
+    self.imu.stop_stream()
+    self.assertIsNone(self.imu.stream)
+    self.assertIsNone(stream.next(timeout=1.0))
+    self.assertEqual(stream.reads, stream.ring.count + stream.errors)
+    times, rolls, pitches = stream.latest(8)
+    self.assertEqual(len(rolls), 8)
+    self.assertEqual(
+      rolls.tolist(), [rolls[0] + n for n in range(8)])
+
+  def test_failed_read(self):
+    stream = self.imu.start_stream(capacity=16)
+    stream.next(timeout=1.0)
+    self.failing = True
+    with self.assertRaises(StreamError):
+      stream.wait(5.0)
+    self.assertFalse(stream.is_running)
+    self.assertIsNone(self.imu.stream)
+
+  def test_incomplete_task(self):
+    class Unjoined(BackgroundTask):
+      is_running = False
+      def _start_threads(self):
+        pass
+      def _wait_threads(self, timeout):
+        return True
+    with self.assertRaises(TypeError):
+      Unjoined()
+
+
+class TestTelemetry(unittest.TestCase):
+
+  def setUp(self):
+    clear()
+    self.sim = SimulatedMaster(
+      'sim/telemetry', topology={0: ['Distance_1']},
+      sensor=lambda smd_id, index: 42)
+    discover()
+    self.motor = Motor.get()
+    self.distance = Distance.get()
+    self.motor.setup()
+    fd, self.path = tempfile.mkstemp(suffix='.acrl')
+    os.close(fd)
+
+  def tearDown(self):
+    clear()
+    os.remove(self.path)
+
+  def test_record_and_read(self):
+    with Recorder(self.path, capacity=8, flush_period=None) as recorder:
+      self.motor.enable()
+      for n in range(20):
+        self.motor.set_voltage(n * 0.5)
+        self.distance.measure()
+      MotorGroup([self.motor]).set_voltages([1.0])
+    self.motor.set_voltage(2.0)
+    self.assertEqual(recorder.samples, 42)
+    with TelemetryLog(self.path) as log:
+      voltage, = log.find(quantity='voltage')
+      times, values = log.read(voltage)
+      self.assertEqual(list(values), [n * 0.5 for n in range(20)] + [1.0])
+      self.assertEqual(list(times), sorted(times))
+      # three full blocks of 8 and the remainder
+      self.assertEqual([c for _, c in voltage.blocks], [8, 8, 5])
+      distance, = log.find(quantity='distance', smd_id=0)
+      self.assertEqual(distance.master, 'sim/telemetry')
+      self.assertEqual(distance.module, self.distance.name)
+      self.assertEqual(log.value_at(distance, log.duration), 42)
+      self.assertIsNone(log.value_at(distance, -1.0))
+      enabled, = log.find(quantity='enabled')
+      self.assertEqual(log.value_at(enabled, times[3]), 1.0)
+
+  def test_threads_record_in_time_order(self):
+    def record(recorder):
+      for n in range(2000):
+        recorder.record(self.distance, 'distance', None, n)
+    interval = sys.getswitchinterval()
+    # switch threads often to interleave the recording threads
+    sys.setswitchinterval(1e-6)
+    try:
+      with Recorder(self.path, flush_period=None) as recorder:
+        threads = [
+          threading.Thread(target=record, args=(recorder,))
+          for _ in range(4)]
+        for thread in threads:
+          thread.start()
+        for thread in threads:
+          thread.join()
+    finally:
+      sys.setswitchinterval(interval)
+    with TelemetryLog(self.path) as log:
+      distance, = log.find(quantity='distance')
+      times, _ = log.read(distance)
+      self.assertEqual(len(times), 8000)
+      self.assertEqual(list(times), sorted(times))
+
+  def test_background_flush(self):
+    recorder = Recorder(self.path, flush_period=0.01)
+    recorder.start()
+    self.motor.enable()
+    self.motor.set_voltage(1.0)
+    threading.Event().wait(0.05)
+    self.assertGreater(os.path.getsize(self.path), 16)
+    recorder.stop()
+    with TelemetryLog(self.path) as log:
+      self.assertEqual(len(log.channels), 2)
+
+
+class TestReplay(unittest.TestCase):
+
+  def setUp(self):
+    clear()
+    readings = iter(range(10, 1000))
+    SimulatedMaster(
+      'sim/recorded', topology={0: ['Distance_1'], 3: []},
+      sensor=lambda smd_id, index: next(readings))
+    discover()
+    fd, self.path = tempfile.mkstemp(suffix='.acrl')
+    os.close(fd)
+    with Recorder(self.path):
+      self.motor = Motor.get(smd_id=3)
+      self.motor.mode = Motor.Mode.VOLTAGE_CONTROL
+      self.motor.enable()
+      self.recorded = [Distance.get().measure() for _ in range(5)]
+    clear()
+
+  def tearDown(self):
+    clear()
+    os.remove(self.path)
+
+  def test_as_fast_as_read(self):
+    master = Master.add('replay:{}?speed=max'.format(self.path))
+    self.assertIsInstance(master, ReplayMaster)
+    self.assertIsNone(master.speed)
+    discover()
+    self.assertEqual(
+      {(m.kind, m._smd_id) for m in Module.all()},
+      {(Module.Kind.MOTOR, 0), (Module.Kind.MOTOR, 3),
+       (Module.Kind.DISTANCE, 0)})
+    distance = Distance.get()
+    self.assertEqual(
+      [distance.measure() for _ in range(6)],
+      self.recorded + self.recorded[-1:])
+    self.assertTrue(master.finished)
+    self.assertEqual(Motor.get(smd_id=3).mode, Motor.Mode.VOLTAGE_CONTROL)
+    self.assertTrue(Motor.get(smd_id=3).is_enabled)
+    master.rewind()
+    self.assertEqual(distance.measure(), self.recorded[0])
+
+  def test_scaled_speed(self):
+    master = ReplayMaster(self.path, speed=0.0)
+    master.attach_id(0)
+    # playback is held before the first distance sample
+    self.assertEqual(master.get_distance(0, 1), 0)
+    self.assertFalse(master.finished)
+    master.speed = 1e9
+    self.assertEqual(master.get_distance(0, 1), self.recorded[-1])
+    self.assertTrue(master.finished)
+
+
+class TestInstrumentation(unittest.TestCase):
+
+  def setUp(self):
+    clear()
+    reset_metrics()
+    self.sim = SimulatedMaster(
+      'sim/metered', topology={0: ['Distance_1'], 2: []})
+
+  def tearDown(self):
+    uninstrument()
+    reset_metrics()
+    clear()
+
+  def test_call_metrics(self):
+    instrument(self.sim)
+    self.assertTrue(is_instrumented(self.sim))
+    discover()
+    distance = Distance.get()
+    distance.measure()
+    self.sim.drop_rate = 1.0
+    self.assertIsNone(distance.measure())
+    snapshot = metrics()['metered']
+    self.assertEqual(snapshot[None]['scan']['count'], 1)
+    self.assertEqual(snapshot[0]['scan_modules']['count'], 1)
+    get_distance = snapshot[0]['get_distance']
+    self.assertEqual(get_distance['count'], 2)
+    self.assertEqual(get_distance['timeouts'], 1)
+    self.assertEqual(sum(get_distance['buckets'].values()), 2)
+    get_variables = snapshot[0]['get_variables']
+    self.assertEqual(get_variables['bytes_written'], 2 * 11)
+    self.assertEqual(get_variables['bytes_read'], 10 + 3)
+    self.assertEqual(
+      sum(s['ping']['count'] for s in snapshot.values()
+          if 'ping' in s), 255)
+    text = prometheus_metrics()
+    self.assertIn(
+      'acrome_call_duration_seconds_count{master="metered",'
+      'smd_id="0",call="get_distance"} 2', text)
+    self.assertIn(
+      'acrome_call_timeouts_total{master="metered",'
+      'smd_id="0",call="get_distance"} 1', text)
+
+  def test_disabled(self):
+    instrument(self.sim)
+    uninstrument(self.sim)
+    self.assertFalse(is_instrumented(self.sim))
+    self.assertNotIn('get_variables', vars(self.sim))
+    discover()
+    self.assertEqual(metrics(), {})
+
+
+class TestMasterPorts(unittest.TestCase):
+
+  def setUp(self):
+    clear()
+
+  def tearDown(self):
+    clear()
+    Master.close_ports()
+
+  def test_lazy_open(self):
+    master = Master('loop://', name='loop', lazy=True)
+    self.assertFalse(master.is_open)
+    master.reboot(3)
+    self.assertTrue(master.is_open)
+
+  def test_port_reuse(self):
+    port = Master('loop://', name='loop')._port
+    clear()
+    self.assertIs(Master('loop://', name='loop')._port, port)
+    clear()
+    Master.close_ports()
+    self.assertIsNot(Master('loop://', name='loop')._port, port)
+    self.assertFalse(port.is_open)
+
+  def test_close(self):
+    master = Master('loop://', name='loop')
+    port = master._port
+    master.close()
+    self.assertFalse(master.is_open)
+    self.assertFalse(port.is_open)
+    master.reboot(3)
+    self.assertTrue(master.is_open)
+    self.assertIsNot(master._port, port)
+
+  def test_red_subclass(self):
+    master = Master('loop://', name='loop', lazy=True)
+    self.assertIsInstance(master, red.Master)
+    self.assertTrue(issubclass(SimulatedMaster, red.Master))
+
+  def test_concurrent_add(self):
+    import serial
+    serial_for_url = serial.serial_for_url
+    def slow_open(*args, **kwargs):
+      threading.Event().wait(0.2)
+      return serial_for_url(*args, **kwargs)
+    serial.serial_for_url = slow_open
+    try:
+      start = monotonic()
+      masters = Master.add({
+        'a': 'loop://', 'b': 'loop://?logging=warning',
+        'c': 'loop://?logging=info', 'd': 'loop://?logging=debug'})
+      elapsed = monotonic() - start
+    finally:
+      serial.serial_for_url = serial_for_url
+    self.assertTrue(all(m.is_open for m in masters))
+    self.assertLess(elapsed, 0.6)
+    lazy = Master.add(['loop://?logging=error'], lazy=True)
+    self.assertFalse(lazy[0].is_open)
+
+
+class TestBaudrateTuning(unittest.TestCase):
+
+  def setUp(self):
+    clear()
+
+  def tearDown(self):
+    clear()
+
+  def test_fastest_reliable_rate(self):
+    sim = SimulatedMaster(
+      'sim/tuned', topology={0: [], 1: ['Distance_1']},
+      baudrate_limit=1000000, wire_time=True, seed=1)
+    report = tune_baudrate(sim, probes=10, settle=0.0)
+    self.assertEqual(report.initial, 112500)
+    self.assertEqual(report.baudrate, 1000000)
+    self.assertEqual(sim.baudrate, 1000000)
+    self.assertEqual(report.smd_ids, [0, 1])
+    self.assertEqual(report.unreachable, [])
+    self.assertGreater(report.results[-2].error_rate, 0.0)
+    self.assertEqual(report.result.error_rate, 0.0)
+    self.assertGreater(
+      report.transactions_per_second,
+      report.results[0].transactions_per_second)
+    self.assertTrue(sim.ping(0) and sim.ping(1))
+
+  def test_tune_all(self):
+    fast = SimulatedMaster('sim/fast', topology={3: []})
+    slow = SimulatedMaster(
+      'sim/slow', topology={4: []}, baudrate_limit=460800, seed=2)
+    slow.discover()
+    reports = tune(probes=5, settle=0.0)
+    self.assertEqual(reports[fast].baudrate, 12500000)
+    self.assertEqual(reports[slow].baudrate, 460800)
+    self.assertEqual(reports[slow].smd_ids, [4])
+
+  def test_silent_smd(self):
+    sim = SimulatedMaster('sim/silent', topology={0: [], 1: []})
+    for smd_id in (0, 1, 7):
+      sim.attach_id(smd_id)
+    with self.assertRaises(BaudrateError):
+      tune_baudrate(sim, smd_ids=[0, 1, 7], settle=0.0)
+    # a single ping per SMD
+    self.assertEqual(sim.transactions, 3)
+
+
+class TestImport(unittest.TestCase):
+
+  def test_smd_deferred(self):
+    script = (
+      'import sys, acrome_wrapper\n'
+      'assert acrome_wrapper.Motor.Mode.TORQUE_CONTROL.value == 3\n'
+      'print(sorted(m for m in sys.modules\n'
+      '            if m.split(".")[0] in ("smd", "serial")))\n')
+    output = subprocess.run(
+      [sys.executable, '-c', script], check=True,
+      capture_output=True, text=True).stdout
+    self.assertEqual(output.strip(), '[]')
+
+  def test_mode_values(self):
+    for mode, value in [
+        (Motor.Mode.VOLTAGE_CONTROL, red.OperationMode.PWM),
+        (Motor.Mode.POSITION_CONTROL, red.OperationMode.Position),
+        (Motor.Mode.VELOCITY_CONTROL, red.OperationMode.Velocity),
+        (Motor.Mode.TORQUE_CONTROL, red.OperationMode.Torque)]:
+      self.assertEqual(mode.value, value)
+
+
 if __name__ == '__main__':
   unittest.main()